@@ -0,0 +1,278 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import metrics
+
+# Token buckets: tokens refilled per second and bucket size, per session and
+# per client IP. A command costs its weight (COMMAND_WEIGHTS) in tokens.
+SESSION_RATE = float(os.environ.get("TERMINAL_RATE_SESSION", "10"))
+SESSION_BURST = float(os.environ.get("TERMINAL_BURST_SESSION", "40"))
+IP_RATE = float(os.environ.get("TERMINAL_RATE_IP", "30"))
+IP_BURST = float(os.environ.get("TERMINAL_BURST_IP", "120"))
+
+# Buckets kept before the least recently used are dropped (a dropped bucket
+# comes back full, which is what an idle caller's bucket would be anyway)
+MAX_BUCKETS = 100000
+
+# Commands executing at once, how many of those one session may hold, and
+# how many may wait (in total and per session) before callers get a 429
+SCHEDULER_SLOTS = int(os.environ.get("TERMINAL_SCHEDULER_SLOTS", "16"))
+SESSION_SLOTS = int(os.environ.get("TERMINAL_SCHEDULER_SESSION_SLOTS", "4"))
+MAX_QUEUED = int(os.environ.get("TERMINAL_SCHEDULER_QUEUE", "256"))
+MAX_SESSION_QUEUED = int(os.environ.get("TERMINAL_SCHEDULER_SESSION_QUEUE", "32"))
+
+# Longest a command waits for a slot before giving up
+MAX_QUEUE_WAIT = float(os.environ.get("TERMINAL_SCHEDULER_MAX_WAIT", "10"))
+
+# Behind a proxy the client address comes from X-Forwarded-For. On Railway
+# (which sets RAILWAY_ENVIRONMENT) every request arrives through its edge
+# proxy, so this defaults on there. PROXY_HOPS is how many proxies append
+# to the header; the address they add is read from the right, since
+# anything further left was sent by the client and can be forged.
+TRUST_PROXY = os.environ.get("TERMINAL_TRUST_PROXY", "1" if os.environ.get("RAILWAY_ENVIRONMENT") else "0") == "1"
+PROXY_HOPS = max(1, int(os.environ.get("TERMINAL_PROXY_HOPS", "1")))
+
+
+class Overloaded(Exception):
+    # Turned into a 429 with Retry-After by the API
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def client_ip(request):
+    if TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            hops = forwarded.split(",")
+            return hops[-min(PROXY_HOPS, len(hops))].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, rate, burst, now):
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+
+class RateLimiter:
+    # A token bucket per session and per client IP. A command is admitted
+    # only if both buckets hold its cost, and is then charged to both, so a
+    # caller can't escape its session limit by opening more sessions.
+
+    def __init__(self, session_rate=SESSION_RATE, session_burst=SESSION_BURST, ip_rate=IP_RATE, ip_burst=IP_BURST):
+        self.limits = {"session": (session_rate, session_burst), "ip": (ip_rate, ip_burst)}
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.limited = 0
+
+    def _bucket(self, kind, key, now):
+        rate, burst = self.limits[kind]
+        bucket = self._buckets.get((kind, key))
+        if bucket is None:
+            bucket = self._buckets[(kind, key)] = TokenBucket(burst, now)
+            if len(self._buckets) > MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end((kind, key))
+            bucket.refill(rate, burst, now)
+        return bucket
+
+    def check(self, session_id, ip, cost):
+        # Charge cost to both buckets, or raise Overloaded with the time until
+        # they could cover it
+        now = time.monotonic()
+        with self._lock:
+            wait = 0.0
+            buckets = []
+            for kind, key in (("session", session_id), ("ip", ip)):
+                rate, burst = self.limits[kind]
+                bucket = self._bucket(kind, key, now)
+                # Nothing may cost more than a full bucket
+                needed = min(cost, burst) - bucket.tokens
+                if needed > 0:
+                    wait = max(wait, needed / rate if rate > 0 else 60.0)
+                buckets.append((bucket, min(cost, burst)))
+            if wait > 0:
+                self.limited += 1
+                raise Overloaded("rate limit exceeded, slow down", wait)
+            for bucket, charge in buckets:
+                bucket.tokens -= charge
+            self.admitted += 1
+
+    def stats(self):
+        with self._lock:
+            return {"buckets": len(self._buckets), "admitted": self.admitted, "limited": self.limited}
+
+
+class _Ticket:
+    __slots__ = ("session_id", "cost", "kind", "future", "loop", "granted", "abandoned", "queued_at")
+
+    def __init__(self, session_id, cost, kind):
+        self.session_id = session_id
+        self.cost = cost
+        self.kind = kind
+        self.future = None
+        self.loop = None
+        self.granted = False
+        self.abandoned = False
+        self.queued_at = time.monotonic()
+
+
+class FairScheduler:
+    # Weighted fair queueing in front of command execution. Each session is
+    # a flow and a command's weight is its size: a queued command gets the
+    # finish tag max(virtual time, the session's last tag) + weight, and the
+    # smallest tag runs next. A session that floods the queue with du only
+    # pushes its own tags further out, so another user's pwd still goes to
+    # the front. A session may also hold at most SESSION_SLOTS running slots,
+    # so it can't occupy every slot before anyone else arrives.
+    # Slots are released from worker threads (streamed responses), so state
+    # is guarded by a threading lock and waiters are woken on their loop.
+
+    def __init__(self, slots=SCHEDULER_SLOTS, session_slots=SESSION_SLOTS, max_queued=MAX_QUEUED,
+                 max_session_queued=MAX_SESSION_QUEUED, max_wait=MAX_QUEUE_WAIT):
+        self.slots = slots
+        self.session_slots = session_slots
+        self.max_queued = max_queued
+        self.max_session_queued = max_session_queued
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._heap = []
+        self._order = itertools.count()
+        self._finish = {}  # session -> finish tag of its latest command
+        self._running = {}  # session -> slots held
+        self._queued = {}  # session -> commands waiting
+        self.virtual_time = 0.0
+        self.running = 0
+        self.queued = 0
+        self.granted = 0
+        self.rejected = 0
+        self.expired = 0
+
+    def _tag(self, session_id, cost):
+        finish = max(self.virtual_time, self._finish.get(session_id, 0.0)) + cost
+        self._finish[session_id] = finish
+        if len(self._finish) > 4 * self.max_queued + self.slots:
+            # Sessions whose tags virtual time has passed are level with a new one
+            self._finish = {key: tag for key, tag in self._finish.items() if tag > self.virtual_time}
+        return finish
+
+    def _grant(self, ticket):
+        ticket.granted = True
+        self.running += 1
+        self.granted += 1
+        self._running[ticket.session_id] = self._running.get(ticket.session_id, 0) + 1
+
+    def _dispatch(self):
+        # Hand free slots to the smallest tags whose sessions are under their cap
+        skipped = []
+        while self._heap and self.running < self.slots:
+            entry = heapq.heappop(self._heap)
+            finish, _, ticket = entry
+            if ticket.abandoned:
+                continue
+            if self._running.get(ticket.session_id, 0) >= self.session_slots:
+                skipped.append(entry)
+                continue
+            self._leave_queue(ticket)
+            self.virtual_time = max(self.virtual_time, finish - ticket.cost)
+            self._grant(ticket)
+            ticket.loop.call_soon_threadsafe(_wake, ticket.future)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+
+    def _leave_queue(self, ticket):
+        self.queued -= 1
+        left = self._queued[ticket.session_id] - 1
+        if left:
+            self._queued[ticket.session_id] = left
+        else:
+            del self._queued[ticket.session_id]
+
+    async def acquire(self, session_id, cost, kind="cheap"):
+        # Wait for a slot; returns a ticket to pass to release()
+        ticket = _Ticket(session_id, cost, kind)
+        with self._lock:
+            if self.running < self.slots and self._running.get(session_id, 0) < self.session_slots and not self._heap:
+                # Nothing waiting: run now, and let virtual time catch up
+                self.virtual_time = max(self.virtual_time, self._tag(session_id, cost) - cost)
+                self._grant(ticket)
+                metrics.record_queue_wait(kind, 0.0)
+                return ticket
+            if self.queued >= self.max_queued or self._queued.get(session_id, 0) >= self.max_session_queued:
+                self.rejected += 1
+                raise Overloaded("too many commands waiting, try again shortly", 1)
+            ticket.loop = asyncio.get_running_loop()
+            ticket.future = ticket.loop.create_future()
+            heapq.heappush(self._heap, (self._tag(session_id, cost), next(self._order), ticket))
+            self.queued += 1
+            self._queued[session_id] = self._queued.get(session_id, 0) + 1
+            # Everything already queued may belong to sessions at their cap
+            self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if not ticket.granted:
+                    ticket.abandoned = True
+                    self._leave_queue(ticket)
+            if ticket.granted:
+                # Woken as the wait ended: hand the slot straight back
+                self.release(ticket)
+            if isinstance(e, asyncio.TimeoutError):
+                with self._lock:
+                    self.expired += 1
+                raise Overloaded("timed out waiting for an execution slot", 1)
+            raise
+        metrics.record_queue_wait(kind, time.monotonic() - ticket.queued_at)
+        return ticket
+
+    def release(self, ticket):
+        with self._lock:
+            if not ticket.granted:
+                return
+            ticket.granted = False
+            self.running -= 1
+            held = self._running[ticket.session_id] - 1
+            if held:
+                self._running[ticket.session_id] = held
+            else:
+                del self._running[ticket.session_id]
+            self._dispatch()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "session_slots": self.session_slots,
+                "running": self.running,
+                "queued": self.queued,
+                "sessions_queued": len(self._queued),
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "expired": self.expired,
+            }
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# Shared by every session
+limiter = RateLimiter()
+scheduler = FairScheduler()
@@ -0,0 +1,631 @@
+import bz2
+import gzip
+import lzma
+import os
+import queue
+import shutil
+import stat
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import dir_index
+import file_cache
+from pipeline import Diagnostic
+
+# Threads that run archive jobs; compression is CPU-bound so keep this small
+ARCHIVE_WORKERS = int(os.environ.get("TERMINAL_ARCHIVE_WORKERS", "2"))
+
+# Refuse to extract more than this many bytes from a single archive
+ARCHIVE_MAX_EXTRACT = int(os.environ.get("TERMINAL_ARCHIVE_MAX_EXTRACT", str(4 * 1024 ** 3)))
+
+# How often a running job reports progress, and the copy block size
+PROGRESS_INTERVAL = 5.0
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# Compression levels: gzip's own default rather than tarfile's 9
+GZIP_LEVEL = 6
+BZIP2_LEVEL = 9
+XZ_PRESET = 6
+
+TAR_SUFFIXES = {
+    ".tar.gz": "gz", ".tgz": "gz",
+    ".tar.bz2": "bz2", ".tbz2": "bz2", ".tbz": "bz2",
+    ".tar.xz": "xz", ".txz": "xz",
+}
+
+ZIP_METHODS = {
+    "store": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+
+TAR_USAGE = "Usage: tar -c|-x|-t [-z|-j|-J] [-v] -f <archive> [-C dir] [files...]"
+ZIP_USAGE = "Usage: zip [-r] [-q] [-0..-9] [-Z store|deflate|bzip2|lzma] <archive> <files...>"
+UNZIP_USAGE = "Usage: unzip [-l] [-o] [-q] [-d dir] <archive> [members...]"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class ArchiveCancelled(Exception):
+    pass
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS, thread_name_prefix="archive")
+        return _pool
+
+
+def _format_bytes(n):
+    for unit in ("B", "K", "M", "G", "T"):
+        if n < 1024 or unit == "T":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+
+
+def _inside(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def _arcname(operand):
+    # Member name for an operand, like tar: no leading "/" or "../"
+    parts = [p for p in os.path.normpath(operand).split(os.sep) if p not in ("", ".", "..")]
+    return "/".join(parts) or "."
+
+
+class Progress:
+    # Shared by a job and its reader wrappers: counts bytes, checks for
+    # cancellation on every read and emits a progress line now and then
+    def __init__(self, report, cancel, label, total=None):
+        self.report = report
+        self.cancel = cancel
+        self.label = label
+        self.total = total
+        self.bytes = 0
+        self.files = 0
+        self.started = time.monotonic()
+        self._last = self.started
+
+    def advance(self, nbytes):
+        if self.cancel.is_set():
+            raise ArchiveCancelled()
+        self.bytes += nbytes
+        now = time.monotonic()
+        if now - self._last >= PROGRESS_INTERVAL:
+            self._last = now
+            done = f" ({self.bytes * 100 // self.total}%)" if self.total else ""
+            self.report(f"{self.label}: {self.files} files, {_format_bytes(self.bytes)}{done}")
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+
+class ProgressReader:
+    # File wrapper that feeds every read into a Progress
+    def __init__(self, fileobj, progress):
+        self._file = fileobj
+        self._progress = progress
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self._progress.advance(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def run_job(label, job, *args):
+    # Run job(report, cancel, *args) on the archive pool and yield the lines
+    # it reports as they arrive. Closing the generator (client gone, timeout)
+    # sets cancel, and the job stops at its next read. Returns 1 if the job
+    # failed, 0 otherwise.
+    events = queue.Queue()
+    cancel = threading.Event()
+
+    def runner():
+        status = 1
+        try:
+            job(lambda line: events.put(("line", line)), cancel, *args)
+            status = 0
+        except ArchiveCancelled:
+            pass
+        except ArchiveError as e:
+            events.put(("line", Diagnostic(e)))
+        except (tarfile.TarError, zipfile.BadZipFile, OSError, EOFError, lzma.LZMAError) as e:
+            events.put(("line", Diagnostic(f"{label}: {e}")))
+        except Exception as e:
+            print(f"Error in archive job: {e}")  # Debug logging
+            events.put(("line", Diagnostic(f"Error: {e}")))
+        finally:
+            events.put(("done", status))
+
+    _get_pool().submit(runner)
+    try:
+        while True:
+            kind, value = events.get()
+            if kind == "done":
+                return value
+            yield value
+    finally:
+        cancel.set()
+
+
+def _walk(top):
+    # (path, is_dir) for top and, if it's a directory, everything below it
+    # in sorted order; symlinks are listed but not followed
+    yield top, os.path.isdir(top) and not os.path.islink(top)
+    if not os.path.isdir(top) or os.path.islink(top):
+        return
+    for dirpath, dirnames, filenames in os.walk(top):
+        dirnames.sort()
+        for name in dirnames:
+            path = os.path.join(dirpath, name)
+            yield path, not os.path.islink(path)
+        for name in sorted(filenames):
+            yield os.path.join(dirpath, name), False
+
+
+def _resolve_sources(operands, cwd, root, label):
+    sources = []
+    for operand in operands:
+        path = os.path.join(cwd, operand)
+        if not _inside(os.path.realpath(path), root):
+            raise ArchiveError(f"{label}: {operand}: outside the terminal root")
+        if not os.path.lexists(path):
+            raise ArchiveError(f"{label}: {operand}: No such file or directory")
+        sources.append((operand, path))
+    return sources
+
+
+def _output_path(name, cwd, root, label):
+    path = os.path.join(cwd, name)
+    if not _inside(os.path.realpath(path), root):
+        raise ArchiveError(f"{label}: {name}: outside the terminal root")
+    return path
+
+
+def _finish_write(path, before, ok):
+    # Keep the du index and read cache in step with a written archive, or
+    # remove a partial one
+    if not ok:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        dir_index.index.adjust(path, -before)
+        return
+    dir_index.index.adjust(path, os.path.getsize(path) - before)
+
+
+def _safe_mode(mode):
+    # Plain permission bits only: no setuid/setgid/sticky from an archive
+    return mode & 0o777
+
+
+# ---------- tar ----------
+
+def parse_tar_args(args):
+    mode = None
+    compression = None
+    verbose = False
+    archive = None
+    directory = None
+    members = []
+    args = list(args)
+    # Old-style bundle without a dash: "tar czf out.tgz dir"
+    if args and not args[0].startswith("-") and set(args[0]) <= set("cxtzjJvf"):
+        args[0] = "-" + args[0]
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in ("--gzip", "--gunzip"):
+            compression = "gz"
+        elif arg == "--bzip2":
+            compression = "bz2"
+        elif arg == "--xz":
+            compression = "xz"
+        elif arg in ("--create", "--extract", "--list"):
+            mode = {"--create": "c", "--extract": "x", "--list": "t"}[arg]
+        elif arg.startswith("--file="):
+            archive = arg[7:]
+        elif arg.startswith("--directory="):
+            directory = arg[12:]
+        elif arg == "-C":
+            if i + 1 >= len(args):
+                raise ArchiveError("tar: option requires an argument -- 'C'")
+            directory = args[i + 1]
+            i += 1
+        elif arg.startswith("-") and len(arg) > 1 and not arg.startswith("--"):
+            for ch in arg[1:]:
+                if ch in "cxt":
+                    if mode is not None and mode != ch:
+                        raise ArchiveError("tar: You may not specify more than one '-ctx' option")
+                    mode = ch
+                elif ch == "z":
+                    compression = "gz"
+                elif ch == "j":
+                    compression = "bz2"
+                elif ch == "J":
+                    compression = "xz"
+                elif ch == "v":
+                    verbose = True
+                elif ch == "f":
+                    if i + 1 >= len(args):
+                        raise ArchiveError("tar: option requires an argument -- 'f'")
+                    archive = args[i + 1]
+                    i += 1
+                else:
+                    raise ArchiveError(f"tar: invalid option -- '{ch}'")
+        else:
+            members.append(arg)
+        i += 1
+    if mode is None or archive is None:
+        raise ArchiveError(TAR_USAGE)
+    if mode == "c" and compression is None:
+        lower = archive.lower()
+        compression = next((c for suffix, c in TAR_SUFFIXES.items() if lower.endswith(suffix)), None)
+    return mode, compression, verbose, archive, directory, members
+
+
+def _open_compressed(raw, compression):
+    if compression == "gz":
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL)
+    if compression == "bz2":
+        return bz2.BZ2File(raw, "wb", compresslevel=BZIP2_LEVEL)
+    if compression == "xz":
+        return lzma.LZMAFile(raw, "wb", preset=XZ_PRESET)
+    return None
+
+
+def _tar_create(report, cancel, archive, sources, compression, verbose):
+    progress = Progress(report, cancel, "tar")
+    real_archive = os.path.realpath(archive)
+    before = os.path.getsize(archive) if os.path.isfile(archive) else 0
+    file_cache.cache.invalidate(archive)
+    ok = False
+    try:
+        with open(archive, "wb") as raw:
+            compressed = _open_compressed(raw, compression)
+            try:
+                # Stream mode ("w|"): members are written strictly in order
+                # and file data is copied in blocks, so memory stays flat
+                with tarfile.open(fileobj=compressed or raw, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                    for operand, top in sources:
+                        base = _arcname(operand)
+                        for path, is_dir in _walk(top):
+                            if os.path.realpath(path) == real_archive:
+                                report(f"tar: {base}: file is the archive; not dumped")
+                                continue
+                            rel = os.path.relpath(path, top)
+                            name = base if rel == "." else f"{base}/{rel.replace(os.sep, '/')}"
+                            info = tar.gettarinfo(path, arcname=name)
+                            if info is None:
+                                report(f"tar: {name}: socket or device ignored")
+                                continue
+                            if info.isreg():
+                                with open(path, "rb") as f:
+                                    tar.addfile(info, ProgressReader(f, progress))
+                            else:
+                                tar.addfile(info)
+                            progress.files += 1
+                            if verbose:
+                                report(name + ("/" if is_dir else ""))
+            finally:
+                if compressed is not None:
+                    compressed.close()
+        ok = True
+    finally:
+        _finish_write(archive, before, ok)
+    size = os.path.getsize(archive)
+    report(f"tar: wrote {os.path.basename(archive)}: {progress.files} files, "
+           f"{_format_bytes(progress.bytes)} -> {_format_bytes(size)} in {progress.elapsed:.2f}s")
+
+
+def _check_member(member, dest):
+    # Where member would land, or None if it would escape dest
+    target = os.path.realpath(os.path.join(dest, member.name))
+    if not _inside(target, dest):
+        return None
+    if member.issym():
+        link = os.path.realpath(os.path.join(os.path.dirname(target), member.linkname))
+        if os.path.isabs(member.linkname) or not _inside(link, dest):
+            return None
+    elif member.islnk():
+        if not _inside(os.path.realpath(os.path.join(dest, member.linkname)), dest):
+            return None
+    return target
+
+
+def _tar_extract(report, cancel, archive, dest, members, verbose):
+    total = os.path.getsize(archive)
+    progress = Progress(report, cancel, "tar", total)
+    wanted = set(_arcname(m) for m in members)
+    extracted = 0
+    uid, gid = os.getuid(), os.getgid()
+    with open(archive, "rb") as raw:
+        # "r|*" reads the archive as a stream and detects the compression
+        with tarfile.open(fileobj=ProgressReader(raw, progress), mode="r|*") as tar:
+            for member in tar:
+                if wanted and _arcname(member.name) not in wanted and not any(
+                        _arcname(member.name).startswith(w + "/") for w in wanted):
+                    continue
+                if member.isdev() or member.isfifo():
+                    report(f"tar: {member.name}: special file ignored")
+                    continue
+                target = _check_member(member, dest)
+                if target is None:
+                    report(f"tar: {member.name}: path escapes the extraction directory, skipped")
+                    continue
+                extracted += member.size
+                if extracted > ARCHIVE_MAX_EXTRACT:
+                    raise ArchiveError(f"tar: archive expands past {_format_bytes(ARCHIVE_MAX_EXTRACT)}, stopped")
+                before = os.path.getsize(target) if os.path.isfile(target) and not os.path.islink(target) else 0
+                file_cache.cache.invalidate(target)
+                # Never restore ownership or setuid bits from the archive
+                member.mode = _safe_mode(member.mode)
+                member.uid, member.gid, member.uname, member.gname = uid, gid, "", ""
+                tar.extract(member, dest, set_attrs=not member.issym())
+                if member.isdir():
+                    dir_index.index.created_dir(target)
+                elif member.isreg() or member.islnk():
+                    dir_index.index.adjust(target, member.size - before)
+                elif member.issym():
+                    dir_index.index.adjust(target, os.lstat(target).st_size)
+                progress.files += 1
+                if verbose:
+                    report(member.name)
+    report(f"tar: extracted {progress.files} entries, {_format_bytes(extracted)} in {progress.elapsed:.2f}s")
+
+
+def _tar_list(report, cancel, archive, verbose):
+    progress = Progress(report, cancel, "tar", os.path.getsize(archive))
+    with open(archive, "rb") as raw:
+        with tarfile.open(fileobj=ProgressReader(raw, progress), mode="r|*") as tar:
+            for member in tar:
+                if verbose:
+                    kind = "d" if member.isdir() else "l" if member.issym() else "-"
+                    perms = stat.filemode(member.mode)[1:]
+                    when = time.strftime("%Y-%m-%d %H:%M", time.localtime(member.mtime))
+                    owner = f"{member.uname or member.uid}/{member.gname or member.gid}"
+                    link = f" -> {member.linkname}" if member.issym() else ""
+                    report(f"{kind}{perms} {owner} {member.size:>10} {when} {member.name}{link}")
+                else:
+                    report(member.name)
+
+
+def tar(args, cwd, root):
+    # Generator behind the tar command; returns its exit status
+    root = os.path.realpath(str(root))
+    cwd = str(cwd)
+    try:
+        mode, compression, verbose, archive, directory, members = parse_tar_args(args)
+        archive_path = _output_path(archive, cwd, root, "tar")
+        if mode == "c":
+            if not members:
+                raise ArchiveError("tar: Cowardly refusing to create an empty archive")
+            base = os.path.join(cwd, directory) if directory else cwd
+            sources = _resolve_sources(members, base, root, "tar")
+            return (yield from run_job("tar", _tar_create, archive_path, sources, compression, verbose))
+        if not os.path.isfile(archive_path):
+            raise ArchiveError(f"tar: {archive}: Cannot open: No such file or directory")
+        if mode == "t":
+            return (yield from run_job("tar", _tar_list, archive_path, verbose))
+        dest = os.path.realpath(os.path.join(cwd, directory) if directory else cwd)
+        if not _inside(dest, root) or not os.path.isdir(dest):
+            raise ArchiveError(f"tar: {directory}: Cannot open: No such directory")
+        return (yield from run_job("tar", _tar_extract, archive_path, dest, members, verbose))
+    except ArchiveError as e:
+        yield Diagnostic(e)
+        return 1
+
+
+# ---------- zip ----------
+
+def _zip_create(report, cancel, archive, sources, method, level, recursive, quiet):
+    progress = Progress(report, cancel, "zip")
+    before = os.path.getsize(archive) if os.path.isfile(archive) else 0
+    real_archive = os.path.realpath(archive)
+    file_cache.cache.invalidate(archive)
+    ok = False
+    try:
+        with zipfile.ZipFile(archive, "w", compression=method, compresslevel=level, allowZip64=True) as zf:
+            for operand, top in sources:
+                base = _arcname(operand)
+                entries = _walk(top) if recursive else [(top, os.path.isdir(top))]
+                for path, is_dir in entries:
+                    if os.path.realpath(path) == real_archive:
+                        continue
+                    rel = os.path.relpath(path, top)
+                    name = base if rel == "." else f"{base}/{rel.replace(os.sep, '/')}"
+                    info = zipfile.ZipInfo.from_file(path, name)
+                    if is_dir:
+                        zf.writestr(info, b"")
+                    elif os.path.islink(path) or not os.path.isfile(path):
+                        continue
+                    else:
+                        info.compress_type = method
+                        # ZipFile.open() doesn't apply the archive's level itself
+                        info._compresslevel = level
+                        # Copy in blocks through the member stream rather than
+                        # ZipFile.write, so reads can report progress and be cancelled
+                        with open(path, "rb") as src, zf.open(info, "w", force_zip64=info.file_size > 2 ** 31) as dst:
+                            shutil.copyfileobj(ProgressReader(src, progress), dst, COPY_BLOCK_SIZE)
+                    progress.files += 1
+                    if not quiet:
+                        report(f"  adding: {name}{'/' if is_dir else ''}")
+        ok = True
+    finally:
+        _finish_write(archive, before, ok)
+    size = os.path.getsize(archive)
+    report(f"zip: wrote {os.path.basename(archive)}: {progress.files} entries, "
+           f"{_format_bytes(progress.bytes)} -> {_format_bytes(size)} in {progress.elapsed:.2f}s")
+
+
+def zip_files(args, cwd, root):
+    # Generator behind the zip command; returns its exit status
+    root = os.path.realpath(str(root))
+    cwd = str(cwd)
+    recursive = quiet = False
+    level = None
+    method = zipfile.ZIP_DEFLATED
+    operands = []
+    try:
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "-Z":
+                if i + 1 >= len(args) or args[i + 1] not in ZIP_METHODS:
+                    raise ArchiveError(f"zip: -Z takes one of {', '.join(ZIP_METHODS)}")
+                method = ZIP_METHODS[args[i + 1]]
+                i += 1
+            elif arg.startswith("-") and len(arg) > 1:
+                for ch in arg[1:]:
+                    if ch == "r":
+                        recursive = True
+                    elif ch == "q":
+                        quiet = True
+                    elif ch.isdigit():
+                        level = int(ch)
+                    else:
+                        raise ArchiveError(f"zip: invalid option -- '{ch}'")
+            else:
+                operands.append(arg)
+            i += 1
+        if len(operands) < 2:
+            raise ArchiveError(ZIP_USAGE)
+        archive = operands[0]
+        if not os.path.splitext(archive)[1]:
+            archive += ".zip"
+        if level == 0:
+            method = zipfile.ZIP_STORED
+        archive_path = _output_path(archive, cwd, root, "zip")
+        sources = _resolve_sources(operands[1:], cwd, root, "zip")
+        return (yield from run_job("zip", _zip_create, archive_path, sources, method, level, recursive, quiet))
+    except ArchiveError as e:
+        yield Diagnostic(e)
+        return 1
+
+
+def _unzip(report, cancel, archive, dest, members, overwrite, quiet, list_only):
+    progress = Progress(report, cancel, "unzip")
+    with zipfile.ZipFile(archive) as zf:
+        infos = zf.infolist()
+        if members:
+            wanted = set(members)
+            infos = [i for i in infos if i.filename.rstrip("/") in wanted]
+        if list_only:
+            report("  Length      Date    Time    Name")
+            report("---------  ---------- -----   ----")
+            total = 0
+            for info in infos:
+                when = "%04d-%02d-%02d %02d:%02d" % info.date_time[:5]
+                report(f"{info.file_size:>9}  {when}   {info.filename}")
+                total += info.file_size
+            report("---------                     -------")
+            report(f"{total:>9}                     {len(infos)} files")
+            return
+        progress.total = sum(info.file_size for info in infos) or None
+        if (progress.total or 0) > ARCHIVE_MAX_EXTRACT:
+            raise ArchiveError(f"unzip: archive expands past {_format_bytes(ARCHIVE_MAX_EXTRACT)}, refusing")
+        report(f"Archive:  {os.path.basename(archive)}")
+        for info in infos:
+            target = os.path.realpath(os.path.join(dest, info.filename))
+            if not _inside(target, dest) or os.path.isabs(info.filename):
+                report(f"  skipping: {info.filename}: path escapes the extraction directory")
+                continue
+            if info.is_dir():
+                if not os.path.isdir(target):
+                    os.makedirs(target, exist_ok=True)
+                    dir_index.index.created_dir(target)
+                progress.files += 1
+                continue
+            if os.path.exists(target) and not overwrite:
+                report(f"  skipping: {info.filename} (exists; use -o to overwrite)")
+                continue
+            parent = os.path.dirname(target)
+            if not os.path.isdir(parent):
+                os.makedirs(parent, exist_ok=True)
+                dir_index.index.created_dir(parent)
+            before = os.path.getsize(target) if os.path.isfile(target) else 0
+            file_cache.cache.invalidate(target)
+            # Sizes in the central directory can lie (zip bombs), so the cap is
+            # enforced on bytes actually written too
+            with zf.open(info) as src, open(target, "wb") as dst:
+                reader = ProgressReader(src, progress)
+                while True:
+                    block = reader.read(COPY_BLOCK_SIZE)
+                    if not block:
+                        break
+                    if progress.bytes > ARCHIVE_MAX_EXTRACT:
+                        raise ArchiveError(f"unzip: archive expands past {_format_bytes(ARCHIVE_MAX_EXTRACT)}, stopped")
+                    dst.write(block)
+            mode = (info.external_attr >> 16) & 0o777
+            if mode:
+                os.chmod(target, _safe_mode(mode))
+            dir_index.index.adjust(target, os.path.getsize(target) - before)
+            progress.files += 1
+            if not quiet:
+                report(f"  inflating: {info.filename}")
+    report(f"unzip: extracted {progress.files} entries, {_format_bytes(progress.bytes)} in {progress.elapsed:.2f}s")
+
+
+def unzip(args, cwd, root):
+    # Generator behind the unzip command; returns its exit status
+    root = os.path.realpath(str(root))
+    cwd = str(cwd)
+    overwrite = quiet = list_only = False
+    directory = None
+    operands = []
+    try:
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "-d":
+                if i + 1 >= len(args):
+                    raise ArchiveError("unzip: -d requires a directory")
+                directory = args[i + 1]
+                i += 1
+            elif arg.startswith("-") and len(arg) > 1:
+                for ch in arg[1:]:
+                    if ch == "o":
+                        overwrite = True
+                    elif ch == "q":
+                        quiet = True
+                    elif ch == "l":
+                        list_only = True
+                    else:
+                        raise ArchiveError(f"unzip: invalid option -- '{ch}'")
+            else:
+                operands.append(arg)
+            i += 1
+        if not operands:
+            raise ArchiveError(UNZIP_USAGE)
+        name = operands[0]
+        archive = os.path.join(cwd, name)
+        if not os.path.isfile(archive) and os.path.isfile(archive + ".zip"):
+            archive += ".zip"
+        if not os.path.isfile(archive) or not _inside(os.path.realpath(archive), root):
+            raise ArchiveError(f"unzip: cannot find or open {name}, {name}.zip or {name}.ZIP")
+        dest = os.path.realpath(os.path.join(cwd, directory) if directory else cwd)
+        if not _inside(dest, root):
+            raise ArchiveError(f"unzip: {directory}: outside the terminal root")
+        if not os.path.isdir(dest):
+            os.makedirs(dest)
+            dir_index.index.created_dir(dest)
+        return (yield from run_job("unzip", _unzip, archive, dest, operands[1:], overwrite, quiet, list_only))
+    except ArchiveError as e:
+        yield Diagnostic(e)
+        return 1
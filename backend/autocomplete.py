@@ -0,0 +1,188 @@
+import bisect
+import os
+import threading
+from collections import OrderedDict
+
+from commands_list import COMMANDS
+
+DEFAULT_LIMIT = 10
+
+# Trie words collected per lookup before ranking, and directories whose
+# listings are kept for path completion
+MAX_CANDIDATES = 500
+PATH_CACHE_SIZE = 256
+
+
+class TrieNode:
+    __slots__ = ("children", "word")
+
+    def __init__(self):
+        self.children = {}
+        self.word = None
+
+
+class Trie:
+    def __init__(self, words=()):
+        self.root = TrieNode()
+        self.size = 0
+        for word in words:
+            self.insert(word)
+
+    def insert(self, word):
+        node = self.root
+        for ch in word:
+            node = node.children.setdefault(ch, TrieNode())
+        if node.word is None:
+            node.word = word
+            self.size += 1
+
+    def with_prefix(self, prefix, cap=MAX_CANDIDATES):
+        node = self.root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        found = []
+        stack = [node]
+        while stack and len(found) < cap:
+            node = stack.pop()
+            if node.word is not None:
+                found.append(node.word)
+            stack.extend(node.children.values())
+        return found
+
+
+def fuzzy_score(query, word):
+    # Subsequence match: higher for fewer gaps and an early first hit, 0 if
+    # query's characters don't all appear in order in word
+    pos = -1
+    first = None
+    gaps = 0
+    for ch in query:
+        nxt = word.find(ch, pos + 1)
+        if nxt == -1:
+            return 0.0
+        if first is None:
+            first = nxt
+        elif nxt != pos + 1:
+            gaps += 1
+        pos = nxt
+    return 1.0 / (1 + gaps + first * 0.5 + (len(word) - len(query)) * 0.1)
+
+
+class DirListingCache:
+    # Sorted names per directory, revalidated against the directory mtime so a
+    # completion in a huge directory is one stat plus a bisect
+
+    def __init__(self, max_dirs=PATH_CACHE_SIZE):
+        self.max_dirs = max_dirs
+        self._listings = OrderedDict()  # path -> (mtime_ns, sorted names)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def names(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._listings.get(path)
+            if cached is not None and cached[0] == mtime:
+                self._listings.move_to_end(path)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        with os.scandir(path) as entries:
+            names = sorted(entry.name + "/" if entry.is_dir() else entry.name for entry in entries)
+        with self._lock:
+            self._listings[path] = (mtime, names)
+            self._listings.move_to_end(path)
+            while len(self._listings) > self.max_dirs:
+                self._listings.popitem(last=False)
+        return names
+
+
+class Completer:
+    def __init__(self, words=COMMANDS):
+        self._lock = threading.Lock()
+        self.trie = Trie(words)
+        self.frequency = {}
+        self.listings = DirListingCache()
+
+    def add(self, word):
+        # Register an extra completion word for every session: a sandboxed
+        # program seen in the command history
+        with self._lock:
+            self.trie.insert(word)
+
+    def record(self, word, count=1):
+        # Count a use of word so it ranks higher in later suggestions
+        with self._lock:
+            self.frequency[word] = self.frequency.get(word, 0) + count
+
+    def complete_word(self, prefix, limit=DEFAULT_LIMIT, extra=()):
+        # extra holds words only the caller may see (its session's aliases),
+        # ranked alongside the shared trie's words but never added to it
+        prefix = prefix.lower()
+        with self._lock:
+            frequency = self.frequency
+            matches = set(self.trie.with_prefix(prefix))
+            matches.update(word for word in extra if word.lower().startswith(prefix))
+            ranked = sorted(matches, key=lambda w: (-frequency.get(w, 0), len(w), w))[:limit]
+            if len(ranked) < limit:
+                # Top up with fuzzy (subsequence) matches, e.g. "gp" -> "grep"
+                seen = set(ranked)
+                scored = []
+                for word in set(self.trie.with_prefix("", cap=self.trie.size)).union(extra):
+                    if word in seen:
+                        continue
+                    score = fuzzy_score(prefix, word)
+                    if score:
+                        scored.append((-score, -frequency.get(word, 0), word))
+                scored.sort()
+                ranked.extend(word for _, _, word in scored[:limit - len(ranked)])
+        return ranked
+
+    def complete_path(self, partial, cwd, root, limit=DEFAULT_LIMIT):
+        # Complete the last path component of partial relative to cwd,
+        # never listing anything outside root
+        head, _, name = partial.rpartition("/")
+        directory = os.path.realpath(os.path.join(cwd, head)) if head else os.path.realpath(cwd)
+        root = os.path.realpath(root)
+        if directory != root and not directory.startswith(root + os.sep):
+            return []
+        try:
+            names = self.listings.names(directory)
+        except OSError:
+            return []
+        base = head + "/" if head else ""
+        start = bisect.bisect_left(names, name)
+        matches = []
+        for candidate in names[start:]:
+            if not candidate.startswith(name) or len(matches) >= limit:
+                break
+            if candidate.startswith(".") and not name.startswith("."):
+                continue
+            matches.append(base + candidate)
+        return matches
+
+    def complete(self, line, cwd, root, limit=DEFAULT_LIMIT, extra=()):
+        # Suggestions are full replacement lines for the input
+        if not line.strip():
+            return []
+        if " " not in line.lstrip():
+            return self.complete_word(line.strip(), limit, extra)
+        before, _, last = line.rpartition(" ")
+        return [f"{before} {path}" for path in self.complete_path(last, cwd, root, limit)]
+
+    def stats(self):
+        with self._lock:
+            words = self.trie.size
+        return {
+            "words": words,
+            "path_cache_dirs": len(self.listings._listings),
+            "path_cache_hits": self.listings.hits,
+            "path_cache_misses": self.listings.misses,
+        }
+
+
+# Shared completer; command frequencies are pooled across sessions
+completer = Completer()
@@ -0,0 +1,1304 @@
+import math
+import re
+from functools import lru_cache
+
+from sed_engine import translate_regex, literal_text, global_sub
+
+# Compiled programs kept per script text; -F and -v are applied at run time,
+# so they don't split the cache
+PROGRAM_CACHE_SIZE = 256
+
+USAGE = "Usage: awk [-F fs] [-v var=value]... 'program' [file...]"
+
+# Loops (and the record loop) ask whether the command was cancelled once
+# every this many iterations; a power of two
+CANCEL_CHECK_INTERVAL = 16384
+
+# Separator between the parts of a multi-dimensional subscript, a[i, j]
+SUBSEP = "\x1c"
+
+KEYWORDS = {
+    "BEGIN", "END", "print", "printf", "if", "else", "while", "for", "do", "in",
+    "break", "continue", "next", "exit", "delete", "getline", "function", "func", "return",
+}
+BUILTINS = {
+    "length", "substr", "index", "split", "sub", "gsub", "sprintf",
+    "tolower", "toupper", "int", "sqrt", "log", "exp",
+}
+# Variables with their own meaning; the rest become "v_<name>" locals
+SPECIAL_VARS = {"NR": "num", "NF": "num", "FS": "any", "OFS": "any"}
+# Built-in variables this awk doesn't implement; using one is an error rather
+# than a silently ordinary variable
+UNSUPPORTED_VARS = {
+    "FNR", "RS", "ORS", "OFMT", "CONVFMT", "FILENAME", "RSTART", "RLENGTH",
+    "SUBSEP", "ENVIRON", "ARGC", "ARGV", "RT", "IGNORECASE", "PROCINFO",
+}
+
+OPERATORS = (
+    "+=", "-=", "*=", "/=", "%=", "^=", "==", "<=", ">=", "!=", "++", "--",
+    "&&", "||", ">>", "!~", "**",
+)
+SINGLE_OPERATORS = "{}()[];,+-*/%^!><|?:~$="
+
+# After one of these a "/" is division; anywhere else it starts a regex
+OPERAND_END = {"NUMBER", "STRING", "ERE", "NAME", "BUILTIN", ")", "]", "$", "++", "--"}
+
+# Tokens that can start an operand, so juxtaposition means concatenation
+CONCAT_START = {"NUMBER", "STRING", "NAME", "BUILTIN", "$", "("}
+
+STRING_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\", '"': '"', "/": "/", "a": "\a", "b": "\b", "f": "\f", "v": "\v"}
+
+NUMBER = re.compile(r"(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+NUMBER_PREFIX = re.compile(r"\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+FORMAT_SPEC = re.compile(r"%([-+ #0]*)(\*|\d+)?(?:\.(\*|\d*))?([a-zA-Z%])")
+
+
+# ---------- runtime helpers (bound into every compiled program) ----------
+
+# Values are Python numbers, plain str for input-derived strnums (fields,
+# split() elements, -v values), _Str for strings from the program (constants,
+# concatenation, string functions) and _NULL for the uninitialized value
+
+class _Str(str):
+    __slots__ = ()
+
+
+class _Null(str):
+    __slots__ = ()
+
+
+_NULL = _Null()
+
+
+def _num(value):
+    # awk's string-to-number rule: the longest numeric prefix, else 0
+    if value.__class__ is float:
+        return value
+    if isinstance(value, str):
+        if value and "_" not in value and not value[-1].isalpha():
+            try:
+                return float(value)
+            except ValueError:
+                pass
+        match = NUMBER_PREFIX.match(value)
+        return float(match.group()) if match else 0.0
+    return value
+
+
+def _str(value):
+    if isinstance(value, str):
+        return value
+    cls = value.__class__
+    if cls is float:
+        if value.is_integer() and -1e18 < value < 1e18:
+            return str(int(value))
+        return "%.6g" % value
+    if cls is bool:
+        return "1" if value else "0"
+    return str(value)
+
+
+def _strnum(value):
+    # The number a value compares as: numbers, strnums that look entirely
+    # numeric and the uninitialized value; None for anything compared as text
+    cls = value.__class__
+    if cls is float:
+        return value
+    if cls is str:
+        if not value or "_" in value or value[-1].isalpha():
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    if cls is _Str:
+        return None
+    if cls is _Null:
+        return 0.0
+    return value
+
+
+def _cmp(a, b):
+    # Numeric comparison when both sides look numeric, string otherwise
+    x, y = _strnum(a), _strnum(b)
+    if x is not None and y is not None:
+        return (x > y) - (x < y)
+    a, b = _str(a), _str(b)
+    return (a > b) - (a < b)
+
+
+def _truth(value):
+    cls = value.__class__
+    if cls is str:
+        number = _strnum(value)
+        return number != 0 if number is not None else value != ""
+    if cls is _Str:
+        return value != ""
+    if cls is _Null:
+        return False
+    return bool(value)
+
+
+class _Array(dict):
+    # Referencing a missing element creates it, as in awk
+    __slots__ = ()
+
+    def __missing__(self, key):
+        self[key] = _NULL
+        return _NULL
+
+
+def _aadd(array, key, delta):
+    value = _num(array.get(key, 0.0)) + delta
+    array[key] = value
+    return value
+
+
+def _aset(array, key, value):
+    array[key] = value
+    return value
+
+
+def _field(fields, index):
+    index = int(index)
+    if index < 0:
+        raise ValueError(f"trying to access out of range field {index}")
+    return fields[index] if index < len(fields) else _NULL
+
+
+def _fset(fields, index, value, ofs, split):
+    # Assign $index; $0 re-splits the record, any other field rebuilds $0
+    index = int(index)
+    value = str(_str(value))
+    if index < 0:
+        raise ValueError(f"trying to access out of range field {index}")
+    if index == 0:
+        fields[:] = [value, *split(value)]
+    else:
+        if index >= len(fields):
+            fields.extend([""] * (index + 1 - len(fields)))
+        fields[index] = value
+        fields[0] = ofs.join(fields[1:])
+    return value
+
+
+def _setnf(fields, nf, ofs):
+    # Assign NF: drop or add empty fields and rebuild $0
+    nf = int(_num(nf))
+    if nf < 0:
+        raise ValueError(f"NF set to negative value {nf}")
+    if nf + 1 < len(fields):
+        del fields[nf + 1:]
+    else:
+        fields.extend([""] * (nf + 1 - len(fields)))
+    fields[0] = ofs.join(fields[1:])
+    return nf
+
+
+@lru_cache(maxsize=64)
+def _splitter(fs):
+    if fs == " ":
+        # Default: runs of blanks, ignoring leading and trailing ones
+        return str.split
+    if len(fs) == 1 and fs != "\\":
+        def split(text, sep=fs):
+            return text.split(sep) if text else []
+        return split
+    regex = re.compile(translate_regex(fs, extended=True))
+
+    def split(text):
+        return regex.split(text) if text else []
+    return split
+
+
+@lru_cache(maxsize=256)
+def _dynamic_regex(pattern):
+    return re.compile(translate_regex(pattern, extended=True))
+
+
+def _match(text, pattern):
+    return _dynamic_regex(pattern).search(text) is not None
+
+
+def _split_into(text, array, split):
+    parts = split(text)
+    array.clear()
+    for i, part in enumerate(parts, 1):
+        array[str(i)] = part
+    return len(parts)
+
+
+@lru_cache(maxsize=256)
+def _sub_template(repl):
+    # awk replacement text to a Python template: & is the match, \& a
+    # literal & and \\ a literal backslash
+    out = []
+    i = 0
+    while i < len(repl):
+        ch = repl[i]
+        if ch == "\\" and i + 1 < len(repl) and repl[i + 1] in "&\\":
+            out.append("&" if repl[i + 1] == "&" else "\\\\")
+            i += 2
+            continue
+        out.append("\\g<0>" if ch == "&" else "\\\\" if ch == "\\" else ch)
+        i += 1
+    return "".join(out)
+
+
+@lru_cache(maxsize=256)
+def _matches_empty(regex):
+    return regex.search("") is not None
+
+
+def _sub(regex, repl, text, count):
+    # (new text, substitutions made) for sub (count=1) and gsub (count=0)
+    if isinstance(regex, str):
+        regex = _dynamic_regex(regex)
+    template = _sub_template(_str(repl))
+    text = _str(text)
+    if count or not _matches_empty(regex):
+        return regex.subn(template, text, count)
+    return global_sub(regex, template, text)
+
+
+def _substr(text, start, length=None):
+    # awk positions are 1-based; both arguments are rounded
+    first = int(math.floor(start + 0.5))
+    last = len(text) + 1 if length is None else first + int(math.floor(length + 0.5))
+    first = max(first, 1)
+    last = min(last, len(text) + 1)
+    return text[first - 1:last - 1] if last > first else ""
+
+
+@lru_cache(maxsize=256)
+def _parse_format(fmt):
+    # Literal text and conversion specs of a printf format
+    parts = []
+    pos = 0
+    for spec in FORMAT_SPEC.finditer(fmt):
+        if spec.start() > pos:
+            parts.append(fmt[pos:spec.start()])
+        parts.append(spec.groups())
+        pos = spec.end()
+    if pos < len(fmt):
+        parts.append(fmt[pos:])
+    return parts
+
+
+def _sprintf(fmt, args):
+    out = []
+    args = list(args)
+    for part in _parse_format(_str(fmt)):
+        if part.__class__ is str:
+            out.append(part)
+            continue
+        flags, width, precision, conv = part
+        if conv == "%":
+            out.append("%")
+            continue
+        if width == "*":
+            width = str(int(_num(args.pop(0)))) if args else ""
+        if precision == "*":
+            precision = str(int(_num(args.pop(0)))) if args else ""
+        spec = "%" + flags + (width or "") + ("." + precision if precision is not None else "")
+        value = args.pop(0) if args else ""
+        if conv in "diu":
+            out.append((spec + "d") % int(_num(value)))
+        elif conv in "oxXeEfFgG":
+            number = _num(value)
+            out.append((spec + conv) % (int(number) if conv in "oxX" else number))
+        elif conv == "c":
+            out.append((spec + "s") % (chr(int(value)) if not isinstance(value, str) else value[:1]))
+        elif conv == "s":
+            out.append((spec + "s") % _str(value))
+        else:
+            raise ValueError(f"awk: unsupported printf conversion %{conv}")
+    return "".join(out)
+
+
+class _Next(Exception):
+    pass
+
+
+class _Exit(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+def _never():
+    return False
+
+
+RUNTIME = {
+    "_num": _num, "_str": _str, "_cmp": _cmp, "_truth": _truth, "_Array": _Array,
+    "_aadd": _aadd, "_aset": _aset, "_field": _field, "_fset": _fset, "_setnf": _setnf,
+    "_Str": _Str, "_NULL": _NULL,
+    "_splitter": _splitter, "_match": _match, "_split_into": _split_into,
+    "_sub": _sub, "_substr": _substr, "_sprintf": _sprintf, "_fmod": math.fmod,
+    "_pow": math.pow, "_sqrt": math.sqrt, "_log": math.log, "_exp": math.exp,
+    "_Next": _Next, "_Exit": _Exit, "_Cancelled": Cancelled,
+}
+
+
+# ---------- lexer ----------
+
+def tokenize(script):
+    tokens = []
+    i = 0
+    n = len(script)
+    while i < n:
+        ch = script[i]
+        if ch in " \t\r":
+            i += 1
+            continue
+        if ch == "\\" and script.startswith("\n", i + 1):
+            i += 2
+            continue
+        if ch == "#":
+            while i < n and script[i] != "\n":
+                i += 1
+            continue
+        previous = tokens[-1][0] if tokens else None
+        if ch == "\n":
+            tokens.append(("NEWLINE", "\n"))
+            i += 1
+        elif ch == '"':
+            i, text = _read_string(script, i + 1)
+            tokens.append(("STRING", text))
+        elif ch == "/" and previous not in OPERAND_END:
+            i, text = _read_regex(script, i + 1)
+            tokens.append(("ERE", text))
+        elif ch.isdigit() or (ch == "." and i + 1 < n and script[i + 1].isdigit()):
+            match = NUMBER.match(script, i)
+            tokens.append(("NUMBER", float(match.group())))
+            i = match.end()
+        elif ch.isalpha() or ch == "_":
+            start = i
+            while i < n and (script[i].isalnum() or script[i] == "_"):
+                i += 1
+            word = script[start:i]
+            if word in KEYWORDS:
+                tokens.append((word, word))
+            elif word in BUILTINS:
+                tokens.append(("BUILTIN", word))
+            elif i < n and script[i] == "(":
+                raise ValueError(f"awk: calling function {word}() is not supported")
+            else:
+                tokens.append(("NAME", word))
+        else:
+            for op in OPERATORS:
+                if script.startswith(op, i):
+                    tokens.append(("^" if op == "**" else op, op))
+                    i += len(op)
+                    break
+            else:
+                if ch not in SINGLE_OPERATORS:
+                    raise ValueError(f"awk: syntax error at source line 1: unexpected character '{ch}'")
+                tokens.append((ch, ch))
+                i += 1
+    tokens.append(("EOF", None))
+    return tokens
+
+
+def _read_string(script, i):
+    out = []
+    while i < len(script):
+        ch = script[i]
+        if ch == '"':
+            return i + 1, "".join(out)
+        if ch == "\n":
+            break
+        if ch == "\\" and i + 1 < len(script):
+            nxt = script[i + 1]
+            if nxt in "01234567":
+                j = i + 1
+                while j < len(script) and j < i + 4 and script[j] in "01234567":
+                    j += 1
+                out.append(chr(int(script[i + 1:j], 8)))
+                i = j
+                continue
+            out.append(STRING_ESCAPES.get(nxt, "\\" + nxt))
+            i += 2
+            continue
+        out.append(ch)
+        i += 1
+    raise ValueError("awk: non-terminated string")
+
+
+def _read_regex(script, i):
+    out = []
+    in_bracket = False
+    while i < len(script):
+        ch = script[i]
+        if ch == "\n":
+            break
+        if ch == "\\" and i + 1 < len(script):
+            out.append("/" if script[i + 1] == "/" else script[i:i + 2])
+            i += 2
+            continue
+        if ch == "[":
+            in_bracket = True
+        elif ch == "]":
+            in_bracket = False
+        elif ch == "/" and not in_bracket:
+            return i + 1, "".join(out)
+        out.append(ch)
+        i += 1
+    raise ValueError("awk: non-terminated regular expression")
+
+
+# ---------- parser / code generator ----------
+
+class Expr:
+    # Python source for an awk expression. kind is "num" (a Python number
+    # or bool), "str" (string constant semantics; wrapped in _Str once it is
+    # stored), "strnum" (a str with awk's numeric-string rules, e.g. a field)
+    # or "any" (a variable).
+    # lvalue describes assignable expressions; stmt is a cheaper form to
+    # emit when the value isn't used.
+    __slots__ = ("code", "kind", "lvalue", "stmt")
+
+    def __init__(self, code, kind, lvalue=None, stmt=None):
+        self.code = code
+        self.kind = kind
+        self.lvalue = lvalue
+        self.stmt = stmt
+
+
+def as_num(e):
+    return e.code if e.kind == "num" else f"_num({e.code})"
+
+
+def as_str(e):
+    return e.code if e.kind in ("str", "strnum") else f"_str({e.code})"
+
+
+def as_cond(e):
+    return e.code if e.kind in ("num", "str") else f"_truth({e.code})"
+
+
+class Compiler:
+    def __init__(self, script):
+        self.tokens = tokenize(script)
+        self.pos = 0
+        self.namespace = dict(RUNTIME)
+        self.scalars = set()
+        self.arrays = set()
+        self.uses_fields = False
+        self.uses_printf = False
+        self.uses_next_in_loop = False
+        self.ranges = 0
+        self.lines = []
+        self.loops = []  # for each enclosing loop, the step to run on continue
+        self.no_gt = False  # inside a print list, > is redirection
+        self.section = None
+
+    # -- token helpers --
+
+    def peek(self, offset=0):
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)][0]
+
+    def value(self):
+        return self.tokens[self.pos][1]
+
+    def advance(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, kind):
+        if self.peek() != kind:
+            raise self.error(f"expected '{kind}'")
+        return self.advance()
+
+    def error(self, message=None):
+        found = self.tokens[self.pos][1]
+        found = "end of program" if found is None else repr(found) if found != "\n" else "newline"
+        return ValueError(f"awk: syntax error near {found}" + (f": {message}" if message else ""))
+
+    def skip_newlines(self):
+        while self.peek() == "NEWLINE":
+            self.pos += 1
+
+    def skip_terminators(self):
+        while self.peek() in ("NEWLINE", ";"):
+            self.pos += 1
+
+    def constant(self, value):
+        name = f"_k{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def regex(self, source):
+        # A literal regex: a plain substring test when it has no syntax
+        translated = translate_regex(source, extended=True)
+        literal = literal_text(translated)
+        if literal is not None:
+            return ("literal", self.constant(literal))
+        try:
+            return ("regex", self.constant(re.compile(translated)))
+        except re.error as e:
+            raise ValueError(f"awk: invalid regular expression /{source}/: {e}")
+
+    def regex_test(self, source, subject):
+        kind, name = self.regex(source)
+        if kind == "literal":
+            return f"({name} in {subject})"
+        return f"({name}.search({subject}) is not None)"
+
+    def unsupported(self, name):
+        if name in UNSUPPORTED_VARS:
+            raise ValueError(f"awk: the {name} variable is not supported")
+
+    def variable(self, name):
+        self.unsupported(name)
+        if name in SPECIAL_VARS:
+            if name == "NF":
+                self.uses_fields = True
+            return Expr(name, SPECIAL_VARS[name], ("var", name))
+        if name in self.arrays:
+            raise self.error(f"can't use array {name} in scalar context")
+        self.scalars.add(name)
+        return Expr(f"v_{name}", "any", ("var", f"v_{name}"))
+
+    def array(self, name):
+        self.unsupported(name)
+        if name in self.scalars or name in SPECIAL_VARS:
+            raise self.error(f"can't use scalar {name} as array")
+        self.arrays.add(name)
+        return f"v_{name}"
+
+    # -- assignment --
+
+    def stored(self, e):
+        # Code for e's value as kept in a variable or array element: program
+        # strings keep their string-ness there
+        if e.kind == "str" and not isinstance(self.namespace.get(e.code), _Str):
+            return f"_Str({e.code})"
+        return e.code
+
+    def assign(self, lvalue, value_code):
+        # Expression code storing value_code in lvalue and yielding it
+        kind = lvalue[0]
+        if lvalue == ("var", "NF"):
+            return f"(NF := _setnf(F, {value_code}, OFS))"
+        if kind == "var":
+            return f"({lvalue[1]} := {value_code})"
+        if kind == "elem":
+            return f"_aset({lvalue[1]}, {lvalue[2]}, {value_code})"
+        return f"(_fset(F, {lvalue[1]}, {value_code}, OFS, _split), (NF := len(F) - 1))[0]"
+
+    def assign_stmt(self, lvalue, value_code):
+        kind = lvalue[0]
+        if lvalue == ("var", "NF"):
+            return f"NF = _setnf(F, {value_code}, OFS)"
+        if kind == "var":
+            return f"{lvalue[1]} = {value_code}"
+        if kind == "elem":
+            return f"{lvalue[1]}[{lvalue[2]}] = {value_code}"
+        return f"_fset(F, {lvalue[1]}, {value_code}, OFS, _split); NF = len(F) - 1"
+
+    def lvalue_kind(self, lvalue):
+        return "num" if lvalue[0] == "var" and lvalue[1] in ("NR", "NF") else "any"
+
+    def increment(self, target, delta, post):
+        lv = target.lvalue
+        if lv is None:
+            raise self.error("++ or -- needs a variable")
+        if lv[0] == "elem":
+            code = f"_aadd({lv[1]}, {lv[2]}, {delta})"
+            return Expr(f"({code} - {delta})" if post else code, "num", stmt=code)
+        new = f"{as_num(target)} + {delta}"
+        stmt = self.assign_stmt(lv, new)
+        code = self.assign(lv, new) if lv[0] != "field" else f"_num({self.assign(lv, new)})"
+        return Expr(f"({code} - {delta})" if post else code, "num", stmt=stmt)
+
+    # -- expressions, lowest precedence first --
+
+    def expr(self):
+        left = self.ternary()
+        op = self.peek()
+        if op in ("=", "+=", "-=", "*=", "/=", "%=", "^="):
+            if left.lvalue is None:
+                return left
+            self.advance()
+            self.skip_newlines()
+            right = self.expr()
+            lv = left.lvalue
+            if op == "=":
+                value = right.code if lv[0] == "field" else self.stored(right)
+                kind = right.kind
+                if lv == ("var", "NR"):
+                    value = as_num(right)
+                    kind = "num"
+            elif op in ("+=", "-=") and lv[0] == "elem":
+                delta = as_num(right) if op == "+=" else f"-({as_num(right)})"
+                code = f"_aadd({lv[1]}, {lv[2]}, {delta})"
+                return Expr(code, "num", stmt=code)
+            else:
+                value = self.arith(op[0], left, right)
+                kind = "num"
+            if lv[0] == "field":
+                kind = "strnum"
+            return Expr(self.assign(lv, value), kind, stmt=self.assign_stmt(lv, value))
+        return left
+
+    def arith(self, op, left, right):
+        a, b = as_num(left), as_num(right)
+        if op == "%":
+            return f"_fmod({a}, {b})"
+        if op == "^":
+            return f"_pow({a}, {b})"
+        return f"({a} {op} {b})"
+
+    def ternary(self):
+        cond = self.logical_or()
+        if self.peek() != "?":
+            return cond
+        self.advance()
+        self.skip_newlines()
+        yes = self.ternary()
+        self.skip_newlines()
+        self.expect(":")
+        self.skip_newlines()
+        no = self.ternary()
+        if yes.kind == no.kind:
+            return Expr(f"({yes.code} if {as_cond(cond)} else {no.code})", yes.kind)
+        return Expr(f"({self.stored(yes)} if {as_cond(cond)} else {self.stored(no)})", "any")
+
+    def logical_or(self):
+        left = self.logical_and()
+        while self.peek() == "||":
+            self.advance()
+            self.skip_newlines()
+            right = self.logical_and()
+            left = Expr(f"({as_cond(left)} or {as_cond(right)})", "num")
+        return left
+
+    def logical_and(self):
+        left = self.membership()
+        while self.peek() == "&&":
+            self.advance()
+            self.skip_newlines()
+            right = self.membership()
+            left = Expr(f"({as_cond(left)} and {as_cond(right)})", "num")
+        return left
+
+    def membership(self):
+        left = self.matching()
+        while self.peek() == "in":
+            self.advance()
+            name = self.expect("NAME")[1]
+            left = Expr(f"({as_str(left)} in {self.array(name)})", "num")
+        return left
+
+    def matching(self):
+        left = self.relational()
+        while self.peek() in ("~", "!~"):
+            negate = self.advance()[0] == "!~"
+            if self.peek() == "ERE":
+                test = self.regex_test(self.advance()[1], as_str(left))
+            else:
+                right = self.relational()
+                test = f"_match({as_str(left)}, {as_str(right)})"
+            left = Expr(f"(not {test})" if negate else test, "num")
+        return left
+
+    def relational(self):
+        left = self.concatenation()
+        op = self.peek()
+        if op in ("<", "<=", "==", "!=", ">=") or (op == ">" and not self.no_gt):
+            self.advance()
+            right = self.concatenation()
+            if left.kind == "num" and right.kind == "num":
+                code = f"({left.code} {op} {right.code})"
+            elif left.kind == "str" or right.kind == "str":
+                code = f"({as_str(left)} {op} {as_str(right)})"
+            else:
+                code = f"(_cmp({left.code}, {right.code}) {op} 0)"
+            return Expr(code, "num")
+        return left
+
+    def concatenation(self):
+        left = self.additive()
+        parts = [left]
+        # "a -1" is subtraction, so only unambiguous operand starts concatenate
+        while self.peek() in CONCAT_START:
+            parts.append(self.additive())
+        if len(parts) == 1:
+            return left
+        return Expr("(" + " + ".join(as_str(p) for p in parts) + ")", "str")
+
+    def additive(self):
+        left = self.multiplicative()
+        while self.peek() in ("+", "-"):
+            op = self.advance()[0]
+            right = self.multiplicative()
+            left = Expr(self.arith(op, left, right), "num")
+        return left
+
+    def multiplicative(self):
+        left = self.unary()
+        while self.peek() in ("*", "/", "%"):
+            op = self.advance()[0]
+            right = self.unary()
+            left = Expr(self.arith(op, left, right), "num")
+        return left
+
+    def unary(self):
+        op = self.peek()
+        if op == "!":
+            self.advance()
+            return Expr(f"(not {as_cond(self.unary())})", "num")
+        if op == "-":
+            self.advance()
+            return Expr(f"(-{as_num(self.unary())})", "num")
+        if op == "+":
+            self.advance()
+            return Expr(as_num(self.unary()), "num")
+        return self.power()
+
+    def power(self):
+        base = self.incdec()
+        if self.peek() == "^":
+            self.advance()
+            exponent = self.unary()  # right associative, and -x binds tighter
+            return Expr(self.arith("^", base, exponent), "num")
+        return base
+
+    def incdec(self):
+        if self.peek() in ("++", "--"):
+            delta = "1.0" if self.advance()[0] == "++" else "-1.0"
+            return self.increment(self.incdec(), delta, post=False)
+        operand = self.primary()
+        if self.peek() in ("++", "--") and operand.lvalue is not None:
+            delta = "1.0" if self.advance()[0] == "++" else "-1.0"
+            return self.increment(operand, delta, post=True)
+        return operand
+
+    def primary(self):
+        kind, value = self.advance()
+        if kind == "NUMBER":
+            return Expr(repr(value), "num")
+        if kind == "STRING":
+            return Expr(self.constant(_Str(value)), "str")
+        if kind == "ERE":
+            return Expr(self.regex_test(value, "F[0]"), "num")
+        if kind == "(":
+            saved, self.no_gt = self.no_gt, False
+            inner = self.expr()
+            if self.peek() == ",":
+                # (i, j) in array
+                keys = [inner]
+                while self.peek() == ",":
+                    self.advance()
+                    keys.append(self.expr())
+                self.expect(")")
+                self.no_gt = saved
+                if self.advance()[0] != "in":
+                    raise self.error("expected 'in' after a parenthesised list")
+                name = self.expect("NAME")[1]
+                key = f" + {SUBSEP!r} + ".join(as_str(k) for k in keys)
+                return Expr(f"(({key}) in {self.array(name)})", "num")
+            self.expect(")")
+            self.no_gt = saved
+            return Expr(f"({inner.code})", inner.kind, inner.lvalue)
+        if kind == "$":
+            if self.peek() in ("++", "--"):
+                index = self.incdec()
+            else:
+                index = self.primary()
+            if index.kind == "num" and index.code.replace(".", "", 1).isdigit():
+                number = int(float(index.code))
+                if number:
+                    self.uses_fields = True
+                code = "F[0]" if number == 0 else f"(F[{number}] if len(F) > {number} else _NULL)"
+                return Expr(code, "strnum", ("field", str(number)))
+            self.uses_fields = True
+            return Expr(f"_field(F, {as_num(index)})", "strnum", ("field", as_num(index)))
+        if kind == "NAME":
+            if self.peek() == "[":
+                self.advance()
+                keys = [self.expr()]
+                while self.peek() == ",":
+                    self.advance()
+                    keys.append(self.expr())
+                self.expect("]")
+                array = self.array(value)
+                key = f" + {SUBSEP!r} + ".join(as_str(k) for k in keys)
+                return Expr(f"{array}[{key}]", "any", ("elem", array, key))
+            return self.variable(value)
+        if kind == "BUILTIN":
+            return self.builtin(value)
+        if kind == "-":
+            return Expr(f"(-{as_num(self.primary())})", "num")
+        if kind == "!":
+            return Expr(f"(not {as_cond(self.primary())})", "num")
+        if kind == "getline":
+            raise ValueError("awk: getline is not supported")
+        self.pos -= 1
+        raise self.error()
+
+    def arguments(self):
+        self.expect("(")
+        saved, self.no_gt = self.no_gt, False
+        args = []
+        self.skip_newlines()
+        if self.peek() != ")":
+            args.append(self.expr())
+            while self.peek() == ",":
+                self.advance()
+                self.skip_newlines()
+                args.append(self.expr())
+        self.expect(")")
+        self.no_gt = saved
+        return args
+
+    def builtin(self, name):
+        if name == "length" and self.peek() != "(":
+            return Expr("len(F[0])", "num")
+        if name == "length" and self.peek(1) == "NAME" and self.tokens[self.pos + 1][1] in self.arrays and self.peek(2) == ")":
+            self.pos += 3
+            return Expr(f"len(v_{self.tokens[self.pos - 2][1]})", "num")
+        if name in ("split", "sub", "gsub"):
+            return self.builtin_with_target(name)
+        args = self.arguments()
+        count = len(args)
+        if name == "length" and count <= 1:
+            return Expr(f"len({as_str(args[0])})" if args else "len(F[0])", "num")
+        if name == "substr" and count in (2, 3):
+            extra = f", {as_num(args[2])}" if count == 3 else ""
+            return Expr(f"_substr({as_str(args[0])}, {as_num(args[1])}{extra})", "str")
+        if name == "index" and count == 2:
+            return Expr(f"({as_str(args[0])}.find({as_str(args[1])}) + 1)", "num")
+        if name == "sprintf" and count >= 1:
+            rest = "".join(f"{a.code}, " for a in args[1:])
+            return Expr(f"_sprintf({as_str(args[0])}, ({rest}))", "str")
+        if name in ("tolower", "toupper") and count == 1:
+            return Expr(f"{as_str(args[0])}.{name[2:]}()", "str")
+        if name == "int" and count == 1:
+            return Expr(f"int({as_num(args[0])})", "num")
+        if name in ("sqrt", "log", "exp") and count == 1:
+            return Expr(f"_{name}({as_num(args[0])})", "num")
+        raise self.error(f"wrong number of arguments to {name}")
+
+    def builtin_with_target(self, name):
+        self.expect("(")
+        saved, self.no_gt = self.no_gt, False
+        if name == "split":
+            text = self.expr()
+            self.expect(",")
+            array = self.array(self.expect("NAME")[1])
+            if self.peek() == ",":
+                self.advance()
+                if self.peek() == "ERE":
+                    separator = f"_splitter({self.advance()[1]!r})"
+                else:
+                    separator = f"_splitter({as_str(self.expr())})"
+            else:
+                separator = "_splitter(FS)"
+            self.expect(")")
+            self.no_gt = saved
+            return Expr(f"_split_into({as_str(text)}, {array}, {separator})", "num")
+        if self.peek() == "ERE":
+            source = self.advance()[1]
+            try:
+                pattern = self.constant(re.compile(translate_regex(source, extended=True)))
+            except re.error as e:
+                raise ValueError(f"awk: invalid regular expression /{source}/: {e}")
+        else:
+            pattern = as_str(self.expr())
+        self.expect(",")
+        repl = self.expr()
+        if self.peek() == ",":
+            self.advance()
+            target = self.expr()
+            if target.lvalue is None:
+                raise self.error(f"{name} third parameter is not a changeable object")
+        else:
+            target = Expr("F[0]", "strnum", ("field", "0"))
+        self.expect(")")
+        self.no_gt = saved
+        count = 1 if name == "sub" else 0
+        result = f"_sub({pattern}, {repl.code}, {target.code}, {count})"
+        # Only store the result back when something changed, so $0 isn't re-split for nothing
+        stored = "_r[0]" if target.lvalue[0] == "field" else "_Str(_r[0])"
+        code = f"((_r := {result})[1] and ({self.assign(target.lvalue, stored)}, _r[1])[1])"
+        return Expr(code, "num")
+
+    # -- statements --
+
+    def emit(self, depth, line):
+        self.lines.append("    " * depth + line)
+
+    def loop_check(self, depth):
+        # At the top of every loop body, so a runaway loop stops once the
+        # command is cancelled or times out
+        self.emit(depth, f"if not (_ticks := _ticks + 1) & {CANCEL_CHECK_INTERVAL - 1} and _cancelled(): raise _Cancelled")
+
+    def block(self, depth):
+        self.expect("{")
+        start = len(self.lines)
+        self.skip_terminators()
+        while self.peek() != "}":
+            if self.peek() == "EOF":
+                raise self.error("missing }")
+            self.statement(depth)
+            self.skip_terminators()
+        self.advance()
+        if len(self.lines) == start:
+            self.emit(depth, "pass")
+
+    def simple_end(self):
+        if self.peek() in (";", "NEWLINE"):
+            self.advance()
+        elif self.peek() not in ("}", "EOF"):
+            raise self.error()
+
+    def body(self, depth):
+        # The statement under if/while/for; always emits at least one line
+        self.skip_newlines()
+        start = len(self.lines)
+        if self.peek() == ";":
+            self.advance()
+        else:
+            self.statement(depth)
+        if len(self.lines) == start:
+            self.emit(depth, "pass")
+
+    def statement(self, depth):
+        kind = self.peek()
+        if kind == "{":
+            self.block(depth)
+        elif kind in ("print", "printf"):
+            self.advance()
+            self.print_statement(depth, kind)
+            self.simple_end()
+        elif kind == "if":
+            self.advance()
+            self.expect("(")
+            cond = self.expr()
+            self.expect(")")
+            self.emit(depth, f"if {as_cond(cond)}:")
+            self.body(depth + 1)
+            save = self.pos
+            self.skip_terminators()
+            if self.peek() == "else":
+                self.advance()
+                self.emit(depth, "else:")
+                self.body(depth + 1)
+            else:
+                self.pos = save
+        elif kind == "while":
+            self.advance()
+            self.expect("(")
+            cond = self.expr()
+            self.expect(")")
+            self.emit(depth, f"while {as_cond(cond)}:")
+            self.loop_check(depth + 1)
+            self.loops.append(None)
+            self.body(depth + 1)
+            self.loops.pop()
+        elif kind == "do":
+            raise ValueError("awk: do-while loops are not supported")
+        elif kind == "for":
+            self.advance()
+            self.for_statement(depth)
+        elif kind in ("break", "continue"):
+            self.advance()
+            if not self.loops:
+                raise self.error(f"{kind} outside a loop")
+            if kind == "continue" and self.loops[-1]:
+                self.emit(depth, self.loops[-1])
+            self.emit(depth, kind)
+            self.simple_end()
+        elif kind == "next":
+            self.advance()
+            if self.section != "main":
+                raise ValueError("awk: next used in BEGIN or END action")
+            if self.loops:
+                self.uses_next_in_loop = True
+                self.emit(depth, "raise _Next")
+            else:
+                self.emit(depth, "continue")
+            self.simple_end()
+        elif kind == "exit":
+            self.advance()
+            if self.peek() not in (";", "NEWLINE", "}", "EOF"):
+                self.expr()  # the exit status has nowhere to go
+            self.emit(depth, "raise _Exit")
+            self.simple_end()
+        elif kind == "delete":
+            self.advance()
+            name = self.expect("NAME")[1]
+            array = self.array(name)
+            if self.peek() == "[":
+                self.advance()
+                keys = [self.expr()]
+                while self.peek() == ",":
+                    self.advance()
+                    keys.append(self.expr())
+                self.expect("]")
+                key = f" + {SUBSEP!r} + ".join(as_str(k) for k in keys)
+                self.emit(depth, f"{array}.pop({key}, None)")
+            else:
+                self.emit(depth, f"{array}.clear()")
+            self.simple_end()
+        elif kind in ("function", "func", "return"):
+            raise ValueError("awk: user-defined functions are not supported")
+        elif kind == ";":
+            self.advance()
+        else:
+            e = self.expr()
+            self.emit(depth, e.stmt or e.code)
+            self.simple_end()
+
+    def for_statement(self, depth):
+        self.expect("(")
+        if self.peek() == "NAME" and self.peek(1) == "in" and self.peek(2) == "NAME" and self.peek(3) == ")":
+            var = self.variable(self.advance()[1])
+            self.advance()
+            array = self.array(self.advance()[1])
+            self.advance()
+            # A snapshot of the keys, so the body may delete elements
+            self.emit(depth, f"for {var.code} in list({array}):")
+            self.loop_check(depth + 1)
+            self.loops.append(None)
+            self.body(depth + 1)
+            self.loops.pop()
+            return
+        if self.peek() != ";":
+            init = self.expr()
+            self.emit(depth, init.stmt or init.code)
+        self.expect(";")
+        self.skip_newlines()
+        cond = self.expr() if self.peek() != ";" else Expr("True", "num")
+        self.expect(";")
+        self.skip_newlines()
+        step = self.expr() if self.peek() != ")" else None
+        self.expect(")")
+        step_code = (step.stmt or step.code) if step else None
+        self.emit(depth, f"while {as_cond(cond)}:")
+        self.loop_check(depth + 1)
+        self.loops.append(step_code)
+        self.body(depth + 1)
+        self.loops.pop()
+        if step_code:
+            self.emit(depth + 1, step_code)
+
+    def print_statement(self, depth, kind):
+        self.no_gt = True
+        args = []
+        if self.peek() not in (";", "NEWLINE", "}", "EOF", ">", ">>", "|"):
+            if self.peek() == "(":
+                # print (a, b) - a parenthesised argument list
+                save = self.pos
+                self.advance()
+                self.no_gt = False
+                first = self.expr()
+                if self.peek() == ",":
+                    args = [first]
+                    while self.peek() == ",":
+                        self.advance()
+                        self.skip_newlines()
+                        args.append(self.expr())
+                    self.expect(")")
+                else:
+                    self.pos = save
+                self.no_gt = True
+            if not args:
+                args.append(self.expr())
+                while self.peek() == ",":
+                    self.advance()
+                    self.skip_newlines()
+                    args.append(self.expr())
+        self.no_gt = False
+        if self.peek() in (">", ">>", "|"):
+            raise ValueError("awk: output redirection is not supported; redirect the command instead")
+        if kind == "printf":
+            if not args:
+                raise self.error("printf: no format")
+            self.uses_printf = True
+            rest = "".join(f"{a.code}, " for a in args[1:])
+            self.emit(depth, f"pend += _sprintf({as_str(args[0])}, ({rest}))")
+            self.emit(depth, "if '\\n' in pend:")
+            self.emit(depth + 1, "done = pend.split('\\n')")
+            self.emit(depth + 1, "pend = done.pop()")
+            self.emit(depth + 1, "yield from done")
+            return
+        text = "F[0]" if not args else " + OFS + ".join(as_str(a) for a in args)
+        if self.uses_printf:
+            self.emit(depth, f"out = {text}")
+            self.emit(depth, "if pend:")
+            self.emit(depth + 1, "out = pend + out")
+            self.emit(depth + 1, "pend = ''")
+            self.emit(depth, "yield out")
+        else:
+            self.emit(depth, f"yield {text}")
+
+    # -- program --
+
+    def program(self):
+        # Each section is generated separately, then assembled around the
+        # record loop
+        sections = {"begin": [], "main": [], "end": []}
+        self.skip_terminators()
+        while self.peek() != "EOF":
+            kind = self.peek()
+            if kind in ("function", "func"):
+                raise ValueError("awk: user-defined functions are not supported")
+            if kind in ("BEGIN", "END"):
+                self.advance()
+                self.skip_newlines()
+                self.section = kind.lower()
+                self.lines = sections[self.section]
+                self.block(2)
+            else:
+                self.section = "main"
+                self.lines = sections["main"]
+                self.pattern_action()
+            self.skip_terminators()
+        return sections
+
+    def pattern_action(self):
+        depth = 3
+        if self.peek() == "{":
+            self.block(depth)
+            return
+        start = self.expr()
+        end = None
+        if self.peek() == ",":
+            self.advance()
+            self.skip_newlines()
+            end = self.expr()
+        if end is None:
+            self.emit(depth, f"if {as_cond(start)}:")
+        else:
+            # pattern1, pattern2: from a record matching the first through
+            # the next one matching the second
+            state = f"r{self.ranges}"
+            self.ranges += 1
+            self.emit(depth, f"if {state} or {as_cond(start)}:")
+            self.emit(depth + 1, f"{state} = not {as_cond(end)}")
+        if self.peek() == "{":
+            self.block(depth + 1)
+        else:
+            self.emit(depth + 1, f"yield {'pend + ' if self.uses_printf else ''}F[0]")
+            if self.uses_printf:
+                self.emit(depth + 1, "pend = ''")
+
+
+@lru_cache(maxsize=PROGRAM_CACHE_SIZE)
+def compile_program(script):
+    # Translate script into one Python generator function; raises
+    # ValueError for syntax errors and unsupported features
+    compiler = Compiler(script)
+    sections = compiler.program()
+    namespace = compiler.namespace
+    bound = ", ".join(f"{name}={name}" for name in namespace)
+    lines = [f"def program(lines, FS, OFS, _init, _cancelled, *, {bound}):"]
+    lines.append("    NR = 0; NF = 0; F = ['']; pend = ''; _ticks = 0")
+    lines.extend(f"    v_{name} = _init.get({name!r}, _NULL)" for name in sorted(compiler.scalars))
+    lines.extend(f"    v_{name} = _Array()" for name in sorted(compiler.arrays))
+    lines.extend(f"    r{i} = False" for i in range(compiler.ranges))
+    lines.append("    _fs = FS; _split = _splitter(FS)")
+    lines.append("    try:")
+    lines.extend(sections["begin"])
+    if sections["main"] or sections["end"]:
+        # A program that is only BEGIN doesn't read its input at all
+        lines.append("        for line in lines:")
+        lines.append("            NR += 1")
+        lines.append(f"            if not (_ticks := _ticks + 1) & {CANCEL_CHECK_INTERVAL - 1} and _cancelled(): raise _Cancelled")
+        if compiler.uses_fields:
+            lines.append("            if FS is not _fs:")
+            lines.append("                _fs = FS; _split = _splitter(FS)")
+            lines.append("            F = [line, *_split(line)]")
+            lines.append("            NF = len(F) - 1")
+        else:
+            lines.append("            F = [line]")
+        if compiler.uses_next_in_loop:
+            lines.append("            try:")
+            lines.extend("    " + line for line in sections["main"])
+            lines.append("            except _Next:")
+            lines.append("                pass")
+        else:
+            lines.extend(sections["main"])
+    lines.append("        pass")
+    lines.append("    except _Exit:")
+    lines.append("        pass")
+    if sections["end"]:
+        lines.append("    try:")
+        lines.extend(sections["end"])
+        lines.append("        pass")
+        lines.append("    except _Exit:")
+        lines.append("        pass")
+    lines.append("    if pend:")
+    lines.append("        yield pend")
+    lines.append("    return")
+    lines.append("    yield")
+    source = "\n".join(lines)
+    exec(compile(source, "<awk>", "exec"), namespace)
+    return namespace["program"]
+
+
+def _unescape(text):
+    return re.sub(r"\\(.)", lambda m: STRING_ESCAPES.get(m.group(1), m.group(0)), text)
+
+
+def parse_args(args):
+    # Returns (script, fs, assignments, operands); raises ValueError on bad usage
+    fs = " "
+    assignments = {}
+    script = None
+    operands = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if script is None and arg.startswith("-F"):
+            value = arg[2:]
+            if not value:
+                if i + 1 >= len(args):
+                    raise ValueError("awk: option requires an argument -- F")
+                i += 1
+                value = args[i]
+            # -Ft means tab, as in every awk
+            fs = "\t" if value == "t" else _unescape(value)
+        elif script is None and arg.startswith("-v"):
+            value = arg[2:]
+            if not value:
+                if i + 1 >= len(args):
+                    raise ValueError("awk: option requires an argument -- v")
+                i += 1
+                value = args[i]
+            name, sep, text = value.partition("=")
+            if not sep or not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", name):
+                raise ValueError(f"awk: invalid -v argument: {value}")
+            if name in UNSUPPORTED_VARS:
+                raise ValueError(f"awk: the {name} variable is not supported")
+            assignments[name] = _unescape(text)
+        elif script is None and arg == "--":
+            pass
+        elif script is None:
+            script = arg
+        else:
+            operands.append(arg)
+        i += 1
+    if script is None:
+        raise ValueError(USAGE)
+    return script, fs, assignments, operands
+
+
+def awk(lines, script, fs=" ", assignments=None, cancelled=None):
+    # cancelled() returning True stops the program with Cancelled
+    program = compile_program(script)
+    assignments = dict(assignments or {})
+    return program(
+        lines,
+        assignments.pop("FS", fs),
+        assignments.pop("OFS", " "),
+        assignments,
+        cancelled or _never,
+    )
@@ -0,0 +1,402 @@
+"""Load and latency benchmark for the Terminal API.
+
+Generates a synthetic terminal_root (a wide directory, a large log file and a
+deep tree), then drives /execute, /autocomplete and /stats either in-process
+through the ASGI app or over HTTP against a local uvicorn, and reports
+p50/p95/p99 latency, throughput and peak RSS per scenario.
+
+    python benchmark.py                       # in-process, temp data set
+    python benchmark.py --mode http --json bench.json
+    python benchmark.py --compare bench.json  # flag p95 regressions
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+# Marker written once a data set is complete, so reruns can reuse it
+DATASET_MARKER = ".benchmark-dataset.json"
+
+# (name, method, path, payload) - payload is the command for /execute, the
+# query string for GET routes
+SCENARIOS = [
+    ("pwd", "POST", "/execute", "pwd"),
+    ("ls_wide", "POST", "/execute", "ls wide"),
+    ("ls_wide_long", "POST", "/execute", "ls -l wide"),
+    ("head_big", "POST", "/execute", "head -n 20 big.log"),
+    ("tail_big", "POST", "/execute", "tail -n 20 big.log"),
+    ("wc_big", "POST", "/execute", "wc big.log"),
+    ("grep_big", "POST", "/execute", "grep -c ERROR big.log"),
+    ("grep_regex_big", "POST", "/execute", "grep -E -c \"user=[0-9]+7 \" big.log"),
+    ("grep_recursive", "POST", "/execute", "grep -r -l needle deep"),
+    ("sort_big", "POST", "/execute", "sort big.log | head -n 5"),
+    ("pipeline_big", "POST", "/execute", "cat big.log | grep ERROR | cut -d \" \" -f3 | sort | uniq -c | head"),
+    ("du_deep", "POST", "/execute", "du deep"),
+    ("autocomplete_command", "GET", "/autocomplete", "prefix=gr"),
+    ("autocomplete_path", "GET", "/autocomplete", "prefix=cat+wide%2Ffile_1"),
+    ("stats", "GET", "/stats", ""),
+]
+
+
+def generate_dataset(root, wide_files, file_mb, depth, fanout):
+    # Build (or reuse) the synthetic tree under root
+    spec = {"wide_files": wide_files, "file_mb": file_mb, "depth": depth, "fanout": fanout}
+    marker = os.path.join(root, DATASET_MARKER)
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == spec:
+                return
+    for name in ("wide", "deep", "home", "big.log"):
+        path = os.path.join(root, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    os.makedirs(os.path.join(root, "home"), exist_ok=True)
+
+    wide = os.path.join(root, "wide")
+    os.makedirs(wide)
+    for i in range(wide_files):
+        with open(os.path.join(wide, f"file_{i}.txt"), "w") as f:
+            f.write(f"file {i}\n")
+
+    rng = random.Random(42)
+    levels = ["INFO", "INFO", "INFO", "DEBUG", "WARN", "ERROR"]
+    target = file_mb * 1024 * 1024
+    written = 0
+    with open(os.path.join(root, "big.log"), "w") as f:
+        n = 0
+        while written < target:
+            line = f"2024-01-01T00:00:{n % 60:02d} {rng.choice(levels)} svc{rng.randint(1, 9)} user={rng.randint(1, 99999)} took {rng.randint(1, 900)}ms\n"
+            f.write(line)
+            written += len(line)
+            n += 1
+
+    def build(path, level):
+        os.makedirs(path, exist_ok=True)
+        for i in range(5):
+            with open(os.path.join(path, f"data_{i}.txt"), "w") as f:
+                f.write(("needle\n" if rng.random() < 0.05 else "hay\n") * rng.randint(1, 200))
+        if level < depth:
+            for i in range(fanout):
+                build(os.path.join(path, f"d{i}"), level + 1)
+
+    build(os.path.join(root, "deep"), 1)
+    with open(marker, "w") as f:
+        json.dump(spec, f)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class RssSampler:
+    # Tracks the peak RSS of a process while a scenario runs
+    def __init__(self, pid, interval=0.01):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.peak = max(self.peak, self.process.memory_info().rss)
+            except psutil.Error:
+                return
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def summarize(name, latencies, errors, elapsed, peak_rss):
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+    }
+
+
+# ---------- In-process driver ----------
+
+async def asgi_request(app, method, path, query="", body=b"", headers=()):
+    # Minimal ASGI client: one request, returns (status, headers, body)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(b"content-type", b"application/json")] + [(k.lower().encode(), v.encode()) for k, v in headers],
+        "client": ("127.0.0.1", 50000),
+        "server": ("benchmark", 80),
+    }
+    request_sent = False
+    never = asyncio.Event()
+    response = {"status": 0, "headers": {}, "body": bytearray()}
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await never.wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode().lower(): v.decode() for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], bytes(response["body"])
+
+
+def run_inprocess(scenarios, requests, concurrency):
+    import main
+
+    main.sampler.start()
+    results = []
+
+    async def drive():
+        session_ids = []
+        for _ in range(concurrency):
+            _, headers, _ = await asgi_request(main.app, "POST", "/execute", body=json.dumps({"command": "pwd"}).encode())
+            session_ids.append(headers.get("x-session-id", ""))
+
+        for name, method, path, payload in scenarios:
+            latencies, errors = [], 0
+            remaining = [requests]
+
+            async def worker(session_id):
+                nonlocal errors
+                while remaining[0] > 0:
+                    remaining[0] -= 1
+                    body = json.dumps({"command": payload}).encode() if method == "POST" else b""
+                    query = payload if method == "GET" else ""
+                    start = time.perf_counter()
+                    status, _, _ = await asgi_request(main.app, method, path, query, body, [("X-Session-Id", session_id)])
+                    latencies.append(time.perf_counter() - start)
+                    if status >= 400:
+                        errors += 1
+
+            with RssSampler(os.getpid()) as rss:
+                started = time.perf_counter()
+                await asyncio.gather(*(worker(sid) for sid in session_ids))
+                elapsed = time.perf_counter() - started
+            results.append(summarize(name, latencies, errors, elapsed, rss.peak))
+            print_row(results[-1])
+
+    asyncio.run(drive())
+    main.sampler.stop()
+    return results
+
+
+# ---------- HTTP driver ----------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def http_request(base, method, path, payload, session_id):
+    if method == "POST":
+        data = json.dumps({"command": payload}).encode()
+        url = f"{base}{path}"
+    else:
+        data = None
+        url = f"{base}{path}?{payload}" if payload else f"{base}{path}"
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json", "X-Session-Id": session_id})
+    try:
+        with urllib.request.urlopen(request, timeout=600) as response:
+            response.read()
+            return response.status, response.headers.get("X-Session-Id", "")
+    except urllib.error.HTTPError as e:
+        return e.code, ""
+
+
+def run_http(scenarios, requests, concurrency, root):
+    port = free_port()
+    env = dict(os.environ, TERMINAL_ROOT=root)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    results = []
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                http_request(base, "GET", "/health", "", "")
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError("uvicorn did not start")
+                time.sleep(0.1)
+
+        session_ids = [http_request(base, "POST", "/execute", "pwd", "")[1] for _ in range(concurrency)]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for name, method, path, payload in scenarios:
+                latencies, errors = [], [0]
+                lock = threading.Lock()
+
+                def one(i):
+                    start = time.perf_counter()
+                    status, _ = http_request(base, method, path, payload, session_ids[i % concurrency])
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        latencies.append(elapsed)
+                        if status >= 400:
+                            errors[0] += 1
+
+                with RssSampler(server.pid) as rss:
+                    started = time.perf_counter()
+                    list(pool.map(one, range(requests)))
+                    elapsed = time.perf_counter() - started
+                results.append(summarize(name, latencies, errors[0], elapsed, rss.peak))
+                print_row(results[-1])
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return results
+
+
+# ---------- Reporting ----------
+
+def print_row(row):
+    print(
+        f"{row['scenario']:<22} n={row['requests']:<5} err={row['errors']:<3} "
+        f"p50={row['p50_ms']:>9.2f}ms p95={row['p95_ms']:>9.2f}ms p99={row['p99_ms']:>9.2f}ms "
+        f"{row['throughput_rps']:>9.1f} req/s  rss={row['peak_rss_mb']:>7.1f}MB",
+        flush=True,
+    )
+
+
+def compare(results, baseline_path, threshold):
+    # Print p95 changes against a previous --json report; returns the number
+    # of scenarios that regressed by more than threshold percent
+    with open(baseline_path) as f:
+        baseline = {row["scenario"]: row for row in json.load(f)["results"]}
+    regressions = 0
+    print(f"\nComparison with {baseline_path} (p95):")
+    for row in results:
+        old = baseline.get(row["scenario"])
+        if not old or not old["p95_ms"]:
+            continue
+        change = (row["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+        flag = ""
+        if change > threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(f"  {row['scenario']:<22} {old['p95_ms']:>9.2f} -> {row['p95_ms']:>9.2f} ms ({change:+.1f}%){flag}")
+    return regressions
+
+
+def run(args, root):
+    print(f"Generating data set in {root} ...", flush=True)
+    generate_dataset(root, args.wide_files, args.file_mb, args.depth, args.fanout)
+
+    scenarios = SCENARIOS
+    if args.only:
+        wanted = set(args.only.split(","))
+        scenarios = [s for s in SCENARIOS if s[0] in wanted]
+
+    if args.mode == "inprocess":
+        # Must be set before main (and command_processor) are imported
+        os.environ["TERMINAL_ROOT"] = root
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        results = run_inprocess(scenarios, args.requests, args.concurrency)
+    else:
+        results = run_http(scenarios, args.requests, args.concurrency, root)
+
+    report = {
+        "timestamp": time.time(),
+        "mode": args.mode,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "dataset": {"wide_files": args.wide_files, "file_mb": args.file_mb, "depth": args.depth, "fanout": args.fanout},
+        "results": results,
+    }
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json_path}")
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Terminal API")
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--root", help="terminal_root to generate/reuse and keep (default: a temp dir, removed afterwards)")
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--wide-files", type=int, default=10000)
+    parser.add_argument("--file-mb", type=int, default=50)
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--only", help="comma-separated scenario names to run")
+    parser.add_argument("--json", dest="json_path", help="write the report as JSON to this file")
+    parser.add_argument("--compare", help="previous JSON report to compare p95 latency against")
+    parser.add_argument("--threshold", type=float, default=20.0, help="p95 regression threshold in percent")
+    args = parser.parse_args(argv)
+
+    if args.root:
+        root = os.path.abspath(args.root)
+        os.makedirs(root, exist_ok=True)
+        return run(args, root)
+    # A temp data set is tens of MB across thousands of files; don't leave it behind
+    root = tempfile.mkdtemp(prefix="terminal-bench-")
+    try:
+        return run(args, root)
+    finally:
+        print(f"Removing {root} ...", flush=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
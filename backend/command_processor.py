@@ -1,24 +1,253 @@
+import codecs
+import errno
 import os
-import shutil
 import subprocess
 import shlex
+import stat
 import psutil
 import time
 import platform
+import re
 import socket
+import threading
+from collections import deque
+from itertools import islice
 from pathlib import Path
-from commands_list import COMMANDS, COMMAND_HELP
+from commands_list import (
+    COMMAND_NAMES, HEAVY_COMMANDS, COMMAND_TIMEOUTS, CHEAP_TIMEOUT, HEAVY_TIMEOUT,
+    COMMAND_WEIGHTS, CHEAP_WEIGHT, HEAVY_WEIGHT,
+)
+from command_registry import commands, LazyModule
+import pipeline
+import dir_index
+import file_cache
+from system_snapshot import system
+from stats_sampler import sampler
+from metrics import metrics
+from history import history
+from sandbox import sandbox, WALL_TIMEOUT as SANDBOX_TIMEOUT
+from executor import current_cancel, check_cancelled
+
+# Engines only some commands need are imported on first use
+grep_engine = LazyModule("grep_engine", globals())
+sed_engine = LazyModule("sed_engine", globals())
+awk_engine = LazyModule("awk_engine", globals())
+external_sort = LazyModule("external_sort", globals())
+archives = LazyModule("archives", globals())
+file_ops = LazyModule("file_ops", globals())
+find_engine = LazyModule("find_engine", globals())
+
+# Set terminal root directory (shared by every session); TERMINAL_ROOT overrides it
+if os.environ.get("TERMINAL_ROOT"):
+    TERMINAL_ROOT = Path(os.environ["TERMINAL_ROOT"]).resolve()
+else:
+    TERMINAL_ROOT = Path("/app/terminal_root") if os.path.exists("/app") else Path.cwd().parent / "terminal_root"
+
+# Longest line the streaming readers hold in memory at once
+MAX_LINE_LENGTH = 1024 * 1024
+
+# File readers check for a cancelled command after each this many bytes
+CANCEL_CHECK_BYTES = 4 * 1024 * 1024
+
+# Line readers start with a small read so the first lines come out at once,
+# then read in larger blocks
+FIRST_READ_SIZE = 64 * 1024
+READ_BLOCK_SIZE = 1024 * 1024
+
+# tail reads backwards in blocks of this size; tail -f polls at this interval
+TAIL_BLOCK_SIZE = 64 * 1024
+TAIL_FOLLOW_INTERVAL = 0.25
+TAIL_FOLLOW_LIMIT = 600
+
+# History references expanded before a line runs: !!, !n, !-n and !prefix.
+# Like bash, a ! followed by a space, = or ( is left alone.
+HISTORY_EVENT = re.compile(r"(?<!\S)!(!|-?\d+|[^\s!=(]+)")
+SINGLE_QUOTED = re.compile(r"('[^']*')")
+
+# Names accepted by alias and export
+ALIAS_NAME = re.compile(r"[A-Za-z0-9_.:+-]+")
+ENV_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Environment every session starts with; export adds to it
+BASE_ENV = {"PATH": "/usr/bin:/bin", "HOME": "/home/terminal_user", "USER": "terminal_user"}
+
+# Process state letters as ps and top print them
+PROCESS_STATES = {
+    "running": "R", "sleeping": "S", "disk-sleep": "D", "stopped": "T",
+    "tracing-stop": "t", "zombie": "Z", "dead": "X", "idle": "I",
+    "wake-kill": "K", "waking": "W", "parked": "P",
+}
+
+# top -o fields: (process row key, sort descending)
+TOP_SORT_KEYS = {
+    "cpu": ("cpu", True), "mem": ("mem", True), "rss": ("rss", True),
+    "time": ("time", True), "pid": ("pid", False), "name": ("name", False),
+}
+
+
+def _format_table(rows, left=()):
+    # Align columns; columns in left are left-aligned, the rest right-aligned.
+    # The last column is never padded so long command lines don't widen rows.
+    last = max(len(row) for row in rows) - 1
+    widths = {}
+    for row in rows:
+        for i, cell in enumerate(row[:last]):
+            widths[i] = max(widths.get(i, 0), len(cell))
+    lines = []
+    for row in rows:
+        cells = []
+        for i, cell in enumerate(row):
+            if i == last:
+                cells.append(cell)
+            elif i in left:
+                cells.append(cell.ljust(widths[i]))
+            else:
+                cells.append(cell.rjust(widths[i]))
+        lines.append(" ".join(cells).rstrip())
+    return "\n".join(lines)
+
+
+def _human_size(n):
+    for unit in ("B", "K", "M", "G", "T"):
+        if n < 1024 or unit == "T":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+
+
+def _format_duration(seconds):
+    # "3 days,  2:01" style, as uptime prints it
+    minutes = int(seconds // 60)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    clock = f"{hours:2d}:{minutes:02d}" if hours else f"{minutes} min"
+    if days:
+        return f"{days} day{'s' if days != 1 else ''}, {clock}"
+    return clock
+
+
+def _format_cpu_time(seconds, clock=False):
+    # ps TIME (HH:MM:SS) or top TIME+ (M:SS.hh)
+    if clock:
+        whole = int(seconds)
+        return f"{whole // 3600:02d}:{whole // 60 % 60:02d}:{whole % 60:02d}"
+    return f"{int(seconds // 60)}:{seconds % 60:05.2f}"
+
+
+def _format_start(timestamp):
+    # Start time of day for processes started today, the date otherwise
+    if time.time() - timestamp < 24 * 3600:
+        return time.strftime("%H:%M", time.localtime(timestamp))
+    return time.strftime("%b%d", time.localtime(timestamp))
+
+
+# Whether the line running on this thread has failed. A session can run
+# several commands at once on different threads, so the status belongs to
+# the thread running the line rather than to the shared processor.
+_line = threading.local()
+
+
+def _data_lines(lines, diagnostics):
+    # A stage's output as the next stage's input: diagnostics are set aside
+    # for the client, the way stderr bypasses a pipe
+    for line in lines:
+        if isinstance(line, pipeline.Diagnostic):
+            diagnostics.append(line)
+        else:
+            yield line
+
 
 class CommandProcessor:
-    def __init__(self):
-        # Set terminal root directory
-        self.terminal_root = Path("/app/terminal_root") if os.path.exists("/app") else Path.cwd().parent / "terminal_root"
+    # One processor per session, so keep the per-instance footprint small
+    __slots__ = ("terminal_root", "current_dir", "session_id", "aliases", "env")
+
+    def __init__(self, terminal_root=None, session_id=None):
+        self.terminal_root = terminal_root or TERMINAL_ROOT
         self.current_dir = self.terminal_root
-        print(f"Command processor initialized in: {self.current_dir}")
+        # Lines are only recorded in the history store for a named session
+        self.session_id = session_id
+        self.aliases = {}
+        self.env = {}
+
+    @property
+    def failed(self):
+        # Whether the last line run on this thread failed, the exit status
+        # && and || test; read it on the thread that ran the line
+        return getattr(_line, "failed", False)
+
+    @failed.setter
+    def failed(self, value):
+        _line.failed = value
+
+    def _fail(self, message=None):
+        # Mark the running line as failed; returns message so handlers can
+        # write return self._fail("...") or yield self._fail("...")
+        self.failed = True
+        return message if message is None else pipeline.Diagnostic(message)
+
+    def _status(self, status):
+        # Record the exit status an engine generator returned
+        if status:
+            self.failed = True
+
+    def _expand_history(self, line):
+        # Replace history references outside single quotes; returns
+        # (line, error) where error names the first unknown event
+        if "!" not in line or self.session_id is None:
+            return line, None
+        missing = []
+
+        def recall(match):
+            command = history.event(self.session_id, match.group(1))
+            if command is None:
+                missing.append(match.group(0))
+                return match.group(0)
+            return command
+
+        parts = SINGLE_QUOTED.split(line)
+        for i in range(0, len(parts), 2):
+            parts[i] = HISTORY_EVENT.sub(recall, parts[i])
+            if missing:
+                return line, f"{missing[0]}: event not found"
+        return "".join(parts), None
+
+    def _expand_alias(self, line):
+        word, sep, rest = line.partition(" ")
+        if word in self.aliases:
+            return self.aliases[word] + sep + rest
+        return line
+
+    def _prepare(self, cmd):
+        # Expand history references and record the line in the session's
+        # history, as bash does before running it. Returns (line, notice):
+        # line is None when the line can't run, and notice is a message to
+        # print first (the error, or the recalled line being run).
+        line = cmd.strip()
+        expanded, error = self._expand_history(line)
+        if error:
+            return None, error
+        if self.session_id is not None:
+            history.append(self.session_id, expanded, self.cmd_pwd([]))
+        return self._expand_alias(expanded), expanded if expanded != line else None
 
     def execute(self, cmd: str) -> str:
+        self.failed = False
         if not cmd or not cmd.strip():
             return ""
+        line, notice = self._prepare(cmd)
+        if line is None:
+            return self._fail(notice)
+        output = self._execute_line(line)
+        return f"{notice}\n{output}" if notice else output
+
+    def _execute_line(self, cmd):
+        # Pipelines and redirections run as a lazy chain of stream stages
+        if pipeline.has_operators(cmd):
+            try:
+                parsed = pipeline.parse(cmd.strip())
+            except pipeline.PipelineError as e:
+                return self._fail(f"Error: {e}")
+            if parsed is not None:
+                return "\n".join(self._run_pipeline(parsed, allow_follow=False))
         
         parts = shlex.split(cmd.strip())
         if not parts:
@@ -26,48 +255,344 @@ class CommandProcessor:
             
         command = parts[0].lower()
         args = parts[1:] if len(parts) > 1 else []
+        return self._dispatch(command, args)
 
-        # Check if command is supported
-        if command not in COMMANDS:
-            return f"Command not found: {command}. Type 'help' for available commands."
+    def _dispatch(self, command, args):
+        # One registry lookup finds both whether the command exists and its handler
+        entry = commands.get(command)
+        if entry is None:
+            if sandbox.allowed(command):
+                return "\n".join(self._sandboxed(command, args))
+            return self._fail(f"Command not found: {command}. Type 'help' for available commands.")
 
-        # Try to find the command handler
-        handler_method = getattr(self, f"cmd_{command}", None)
-        if handler_method:
+        if entry.handler is not None:
             try:
-                result = handler_method(args)
+                result = metrics.call(command, entry.handler, self, args)
                 return result if result is not None else ""
             except Exception as e:
                 print(f"Error in {command}: {e}")  # Debug logging
-                return f"Error running {command}: {str(e)}"
+                return self._fail(f"Error running {command}: {str(e)}")
         else:
-            return f"Handler for '{command}' not implemented yet."
+            return self._fail(f"Handler for '{command}' not implemented yet.")
+
+    def _stages(self, cmd):
+        # argv of every pipeline stage in cmd, after history and alias expansion
+        cmd = self._expand_alias(self._expand_history(cmd.strip())[0])
+        try:
+            parsed = pipeline.parse(cmd.strip()) if pipeline.has_operators(cmd) else None
+            return parsed.stages if parsed is not None else [shlex.split(cmd)]
+        except ValueError:
+            return []
+
+    def command_names(self, cmd):
+        # Names of every command in cmd (one per pipeline stage)
+        return {argv[0].lower() for argv in self._stages(cmd) if argv}
+
+    def _sandboxed_names(self, names):
+        # Names that will run as real processes rather than natively
+        return {name for name in names if name not in COMMAND_NAMES and sandbox.allowed(name)}
+
+    def classify(self, cmd: str) -> str:
+        # "heavy" commands scale with file or tree size and get a bounded
+        # executor, as do real processes run by the sandbox
+        names = self.command_names(cmd)
+        return "heavy" if names & HEAVY_COMMANDS or self._sandboxed_names(names) else "cheap"
+
+    def weight_for(self, cmd: str) -> int:
+        # Expected cost of cmd, summed over its pipeline stages
+        names = self.command_names(cmd)
+        sandboxed = self._sandboxed_names(names)
+        return max(1, sum(
+            COMMAND_WEIGHTS.get(name, HEAVY_WEIGHT if name in HEAVY_COMMANDS or name in sandboxed else CHEAP_WEIGHT)
+            for name in names
+        ))
+
+    def timeout_for(self, cmd: str, follow=False) -> float:
+        stages = [argv for argv in self._stages(cmd) if argv]
+        names = {argv[0].lower() for argv in stages}
+        default = HEAVY_TIMEOUT if names & HEAVY_COMMANDS else CHEAP_TIMEOUT
+        timeouts = [COMMAND_TIMEOUTS.get(name, default) for name in names]
+        if self._sandboxed_names(names):
+            # A little past the sandbox's own limit, so it reports the kill
+            timeouts.append(SANDBOX_TIMEOUT + 2)
+        if follow and any(argv[0].lower() == "tail" and "-f" in argv[1:] for argv in stages):
+            # tail -f on a streaming endpoint keeps going until its own limit
+            timeouts.append(TAIL_FOLLOW_LIMIT + 2)
+        return max(timeouts or [default])
+
+    def stream(self, cmd: str, allow_follow=True):
+        # Yield output line by line. Commands without a stream_* handler fall
+        # back to execute() and yield their whole output as a single chunk.
+        self.failed = False
+        if not cmd or not cmd.strip():
+            return
+        cmd, notice = self._prepare(cmd)
+        if cmd is None:
+            yield self._fail(notice)
+            return
+        if notice:
+            yield notice
+
+        if pipeline.has_operators(cmd):
+            try:
+                parsed = pipeline.parse(cmd.strip())
+            except pipeline.PipelineError as e:
+                yield self._fail(f"Error: {e}")
+                return
+            if parsed is not None:
+                yield from self._run_pipeline(parsed, allow_follow)
+                return
+
+        parts = shlex.split(cmd.strip())
+        if not parts:
+            return
+
+        command = parts[0].lower()
+        args = parts[1:] if len(parts) > 1 else []
+
+        entry = commands.get(command)
+        sandboxed = entry is None and sandbox.allowed(command)
+        if not sandboxed and (entry is None or entry.stream is None):
+            output = self._dispatch(command, args)
+            if output:
+                yield output
+            return
+
+        yield from self._stage(command, args, None, allow_follow)
+
+    def _stage(self, command, args, stdin, allow_follow=True):
+        # One pipeline stage: a stream_* generator fed by the previous stage,
+        # or a plain cmd_* handler whose output is split into lines
+        entry = commands.get(command)
+        sandboxed = entry is None and sandbox.allowed(command)
+        if not sandboxed and (entry is None or entry.stream is None):
+            output = self._dispatch(command, args)
+            if isinstance(output, pipeline.Diagnostic):
+                yield from map(pipeline.Diagnostic, output.splitlines())
+            else:
+                yield from output.splitlines()
+            return
+        try:
+            if sandboxed:
+                yield from self._sandboxed(command, args, stdin)
+            elif command == "tail":
+                # tail -f only makes sense when the output is being streamed
+                yield from metrics.measure(command, entry.stream(self, args, stdin=stdin, allow_follow=allow_follow))
+            else:
+                yield from metrics.measure(command, entry.stream(self, args, stdin=stdin))
+        except Exception as e:
+            print(f"Error in {command}: {e}")  # Debug logging
+            yield self._fail(f"Error running {command}: {str(e)}")
+
+    def _sandboxed(self, command, args, stdin=None):
+        # An allow-listed binary with no native handler, run for real in the
+        # session's directory (see sandbox.py)
+        return metrics.measure(command, self._sandboxed_lines(command, args, stdin))
+
+    def _sandboxed_lines(self, command, args, stdin):
+        self._status((yield from sandbox.run([command] + args, self.current_dir, self.terminal_root, self.env, stdin)))
+
+    def _run_pipeline(self, parsed, allow_follow=True):
+        # Chain the stages as generators: nothing runs until the last stage is
+        # pulled, and when it stops early (e.g. head) the upstream reads stop too.
+        # Diagnostics from any stage go to the client as they turn up; only
+        # data lines reach the next stage or the redirect target.
+        diagnostics = deque()
+        stdin = None
+        if parsed.stdin_path is not None:
+            source = self.current_dir / parsed.stdin_path
+            if not self._opens_within_root(source):
+                yield self._fail(f"Error: cannot read '{parsed.stdin_path}': outside the terminal root")
+                return
+            if not source.is_file():
+                yield self._fail(f"No such file: {parsed.stdin_path}")
+                return
+            stdin = self._iter_lines(source)
+        stages = []
+        for i, argv in enumerate(parsed.stages):
+            if i and argv[0] in self.aliases and not pipeline.has_operators(self.aliases[argv[0]]):
+                # The first stage was expanded with the whole line; later
+                # stages only take aliases for a single command
+                try:
+                    argv = shlex.split(self.aliases[argv[0]]) + argv[1:]
+                except ValueError:
+                    pass
+            if i:
+                stdin = _data_lines(stdin, diagnostics)
+            stdin = self._stage(argv[0].lower(), argv[1:], stdin, allow_follow)
+            stages.append(stdin)
+        try:
+            if parsed.stdout_path is None:
+                for line in stdin:
+                    while diagnostics:
+                        yield diagnostics.popleft()
+                    yield line
+                while diagnostics:
+                    yield diagnostics.popleft()
+                return
+            target = self.current_dir / parsed.stdout_path
+            if not self._opens_within_root(target):
+                yield self._fail(f"Error: cannot write '{parsed.stdout_path}': outside the terminal root")
+                return
+            before = target.stat().st_size if target.is_file() else 0
+            file_cache.cache.invalidate(target)
+            try:
+                with open(target, "a" if parsed.append else "w") as f:
+                    for line in stdin:
+                        while diagnostics:
+                            yield diagnostics.popleft()
+                        if isinstance(line, pipeline.Diagnostic):
+                            yield line
+                        else:
+                            f.write(line)
+                            f.write("\n")
+                while diagnostics:
+                    yield diagnostics.popleft()
+            except OSError as e:
+                yield self._fail(f"Error: cannot write '{parsed.stdout_path}': {e.strerror or e}")
+                return
+            finally:
+                if target.is_file():
+                    dir_index.index.adjust(target, target.stat().st_size - before)
+        finally:
+            for stage in reversed(stages):
+                stage.close()
+
+    def _iter_lines(self, file, load=True):
+        # Lazily read a text file line by line; overlong lines are split at
+        # MAX_LINE_LENGTH so a file without newlines can't exhaust memory.
+        # Lines end at "\n" with any trailing "\r" dropped, exactly as the
+        # shared read cache splits them. Cached files are served from memory;
+        # otherwise the file is streamed, and a small file read to the end is
+        # added to the cache unless load is off.
+        cached = file_cache.cache.get(file, load=False)
+        if cached is not None:
+            yield from cached.iter_lines(max_length=MAX_LINE_LENGTH)
+            return
+        owner = None
+        read = 0
+        next_check = CANCEL_CHECK_BYTES
+        try:
+            with open(file, "rb") as f:
+                owner = metrics.current_command()
+                st = os.fstat(f.fileno())
+                keep = [] if load and file_cache.cache.fits(st.st_size) else None
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                pending = ""
+                size = FIRST_READ_SIZE
+                while True:
+                    block = f.read(size)
+                    size = READ_BLOCK_SIZE
+                    read += len(block)
+                    if read >= next_check:
+                        # A consumer that filters out most lines may not
+                        # yield for a long time
+                        check_cancelled()
+                        next_check += CANCEL_CHECK_BYTES
+                    if keep is not None:
+                        keep.append(block)
+                    pending += decoder.decode(block, final=not block)
+                    if not block:
+                        break
+                    parts = pending.split("\n")
+                    pending = parts.pop()
+                    for line in parts:
+                        line = line.rstrip("\r")
+                        for k in range(0, len(line), MAX_LINE_LENGTH):
+                            yield line[k:k + MAX_LINE_LENGTH]
+                        if not line:
+                            yield line
+                    # A line still without its newline gives up whole pieces
+                    # that more text follows; trailing "\r"s may yet end the
+                    # line, so they only count once more than a line's worth
+                    # of them pile up
+                    text = len(pending.rstrip("\r"))
+                    if len(pending) - text > MAX_LINE_LENGTH:
+                        text = len(pending)
+                    cut = text - text % MAX_LINE_LENGTH
+                    if cut == text:
+                        cut -= MAX_LINE_LENGTH
+                    if cut > 0:
+                        for k in range(0, cut, MAX_LINE_LENGTH):
+                            yield pending[k:k + MAX_LINE_LENGTH]
+                        pending = pending[cut:]
+                line = pending.rstrip("\r")
+                for k in range(0, len(line), MAX_LINE_LENGTH):
+                    yield line[k:k + MAX_LINE_LENGTH]
+                if pending and not line:
+                    yield line
+            if keep is not None:
+                file_cache.cache.add(file, file_cache.file_key(st), b"".join(keep))
+        finally:
+            metrics.add_read(read, owner)
+
+    def _input_lines(self, operand, stdin, load=True):
+        # Lines from the named file, or from the previous pipeline stage when
+        # no file is given; returns None if the file does not exist
+        if operand is None:
+            return stdin
+        file = self.current_dir / operand
+        if self._readable_file(file):
+            return self._iter_lines(file, load)
+        return None
+
+    def _readable_file(self, file):
+        # A regular file the text commands may read: outside the terminal
+        # root (symlinks followed) counts as missing, as it does for grep
+        return self._opens_within_root(file) and file.is_file()
 
     # ---------- File and Directory Operations ----------
 
+    @commands.register
     def cmd_ls(self, args):
+        show_all = long_format = False
+        operands = []
+        for arg in args:
+            if arg.startswith("-") and len(arg) > 1:
+                for flag in arg[1:]:
+                    if flag == "a":
+                        show_all = True
+                    elif flag == "l":
+                        long_format = True
+                    else:
+                        return self._fail(f"ls: invalid option -- '{flag}'")
+            else:
+                operands.append(arg)
+        target = self.current_dir / operands[0] if operands else self.current_dir
+        if operands and not self._opens_within_root(target):
+            return self._fail(f"ls: cannot access '{operands[0]}': outside the terminal root")
+        if target.is_file():
+            return operands[0]
         try:
-            items = os.listdir(self.current_dir)
-            if not items:
+            # One scandir pass: DirEntry caches the file type from readdir, so
+            # only -l needs a stat per entry
+            with os.scandir(target) as it:
+                entries = sorted(
+                    (entry for entry in it if show_all or not entry.name.startswith(".")),
+                    key=lambda entry: entry.name,
+                )
+            if not entries:
                 return "(empty directory)"
             
             # Add file type indicators
             formatted_items = []
-            for item in sorted(items):
-                item_path = self.current_dir / item
-                if item_path.is_dir():
-                    formatted_items.append(f"{item}/")
-                elif item_path.is_file():
-                    formatted_items.append(item)
-                else:
-                    formatted_items.append(item)
+            for entry in entries:
+                name = f"{entry.name}/" if entry.is_dir() else entry.name
+                if long_format:
+                    info = entry.stat(follow_symlinks=False)
+                    modified = time.strftime("%b %d %H:%M", time.localtime(info.st_mtime))
+                    name = f"{stat.filemode(info.st_mode)} {info.st_size:>10} {modified} {name}"
+                formatted_items.append(name)
             
             return "\n".join(formatted_items)
+        except FileNotFoundError:
+            return self._fail(f"ls: cannot access '{operands[0]}': No such file or directory")
         except PermissionError:
-            return "Permission denied"
+            return self._fail("Permission denied")
         except Exception as e:
-            return f"Error listing directory: {e}"
+            return self._fail(f"Error listing directory: {e}")
 
+    @commands.register
     def cmd_cd(self, args):
         if not args:
             # Go to home directory if no args
@@ -90,126 +615,341 @@ class CommandProcessor:
             self.current_dir = new_path
             return f"Changed to: {self.current_dir.relative_to(self.terminal_root)}"
         else:
-            return f"Directory not found: {target}"
+            return self._fail(f"Directory not found: {target}")
 
+    @commands.register
     def cmd_pwd(self, args):
         return str(self.current_dir.relative_to(self.terminal_root))
 
+    @commands.register
     def cmd_mkdir(self, args):
+        # Parent directories are always created, so -p is accepted and ignored
+        args = [arg for arg in args if arg != "-p"]
         if not args:
-            return "mkdir: missing operand"
+            return self._fail("mkdir: missing operand")
         
         dirname = args[0]
         try:
             new_dir = self.current_dir / dirname
             new_dir.mkdir(parents=True, exist_ok=False)
+            dir_index.index.created_dir(new_dir)
             return f"Created directory: {dirname}"
         except FileExistsError:
-            return f"Directory already exists: {dirname}"
+            return self._fail(f"Directory already exists: {dirname}")
         except PermissionError:
-            return f"Permission denied: cannot create directory {dirname}"
-
-    def cmd_rm(self, args):
-        if not args:
-            return "rm: missing operand"
-        
-        filename = args[0]
-        target = self.current_dir / filename
-        try:
-            if target.is_file():
-                target.unlink()
-                return f"Removed file: {filename}"
-            elif target.is_dir():
-                return f"rm: {filename} is a directory (use rmdir or rm -r)"
+            return self._fail(f"Permission denied: cannot create directory {dirname}")
+
+    def _split_flags(self, args):
+        # Single-letter flags (bundled like -rf) and the remaining operands
+        flags, operands = set(), []
+        for i, arg in enumerate(args):
+            if arg == "--":
+                operands.extend(args[i + 1:])
+                break
+            if arg.startswith("-") and len(arg) > 1:
+                flags.update(arg[1:])
             else:
-                return f"rm: cannot remove '{filename}': No such file or directory"
-        except PermissionError:
-            return f"rm: cannot remove '{filename}': Permission denied"
-
+                operands.append(arg)
+        return flags, operands
+
+    def _invalid_flag(self, args, known):
+        # The first single-letter flag not in known, in the order given
+        for arg in args:
+            if arg == "--":
+                break
+            if arg.startswith("-") and len(arg) > 1:
+                for flag in arg[1:]:
+                    if flag not in known:
+                        return flag
+        return None
+
+    def _within_root(self, path):
+        # True if path (not following a final symlink) lies under terminal_root;
+        # ".." is collapsed first so "../.." can't slip through as a basename
+        root = os.path.realpath(self.terminal_root)
+        path = os.path.abspath(path)
+        real = os.path.join(os.path.realpath(os.path.dirname(path)), os.path.basename(path))
+        return real == root or real.startswith(root + os.sep)
+
+    def _opens_within_root(self, path):
+        # Like _within_root but following symlinks all the way, for paths
+        # that get opened (redirections) rather than renamed or removed
+        root = os.path.realpath(self.terminal_root)
+        real = os.path.realpath(path)
+        return real == root or real.startswith(root + os.sep)
+
+    @commands.register
+    def cmd_rm(self, args):
+        return "\n".join(self.stream_rm(args))
+
+    @commands.register
+    def stream_rm(self, args, stdin=None):
+        flags, operands = self._split_flags(args)
+        if not operands:
+            yield self._fail("rm: missing operand")
+            return
+        recursive = "r" in flags or "R" in flags
+        force = "f" in flags
+        root = os.path.realpath(self.terminal_root)
+        for filename in operands:
+            if os.path.basename(filename.rstrip("/")) in (".", ".."):
+                yield self._fail(f"rm: refusing to remove '.' or '..' directory: skipping '{filename}'")
+                continue
+            target = self.current_dir / filename
+            if not os.path.lexists(target):
+                if not force:
+                    yield self._fail(f"rm: cannot remove '{filename}': No such file or directory")
+                continue
+            if not self._within_root(target) or os.path.realpath(target) == root:
+                yield self._fail(f"rm: refusing to remove '{filename}'")
+                continue
+            try:
+                if target.is_dir() and not target.is_symlink():
+                    if not recursive:
+                        yield self._fail(f"rm: cannot remove '{filename}': Is a directory")
+                        continue
+                    # Files are unlinked across the file-op pool, then the
+                    # directories bottom-up
+                    stats = file_ops.OpStats()
+                    file_cache.cache.invalidate(target)
+                    yield from file_ops.remove_tree(os.path.realpath(target), stats)
+                    yield from (self._fail(f"rm: {error}") for error in stats.errors)
+                    dir_index.index.forget(target)
+                    dir_index.index.adjust(target, -stats.bytes)
+                    yield f"Removed directory: {filename} ({stats.summary()})"
+                else:
+                    size = target.lstat().st_size
+                    file_cache.cache.invalidate(target)
+                    target.unlink()
+                    dir_index.index.adjust(target, -size)
+                    yield f"Removed file: {filename}"
+            except OSError as e:
+                yield self._fail(f"rm: cannot remove '{filename}': {e.strerror or e}")
+
+    @commands.register
     def cmd_rmdir(self, args):
         if not args:
-            return "rmdir: missing operand"
+            return self._fail("rmdir: missing operand")
         
         dirname = args[0]
         target = self.current_dir / dirname
         try:
             if target.is_dir():
                 os.rmdir(target)  # Only removes empty directories
+                dir_index.index.forget(target)
                 return f"Removed directory: {dirname}"
             else:
-                return f"rmdir: failed to remove '{dirname}': Not a directory"
+                return self._fail(f"rmdir: failed to remove '{dirname}': Not a directory")
         except OSError as e:
-            return f"rmdir: failed to remove '{dirname}': {e}"
+            return self._fail(f"rmdir: failed to remove '{dirname}': {e}")
 
+    @commands.register
     def cmd_touch(self, args):
         if not args:
-            return "touch: missing operand"
+            return self._fail("touch: missing operand")
         
         filename = args[0]
         try:
+            file_cache.cache.invalidate(self.current_dir / filename)
             (self.current_dir / filename).touch(exist_ok=True)
+            dir_index.index.changed(self.current_dir / filename)
             return f"Created/updated file: {filename}"
         except PermissionError:
-            return f"touch: cannot touch '{filename}': Permission denied"
+            return self._fail(f"touch: cannot touch '{filename}': Permission denied")
 
+    @commands.register
     def cmd_cat(self, args):
+        return "\n".join(self.stream_cat(args))
+
+    @commands.register
+    def stream_cat(self, args, stdin=None):
         if not args:
-            return "Usage: cat <file>"
-        file = self.current_dir / args[0]
-        if file.is_file():
-            return file.read_text()
-        return f"No such file: {args[0]}"
+            if stdin is None:
+                yield self._fail("Usage: cat <file>")
+            else:
+                yield from stdin
+            return
+        for name in args:
+            file = self.current_dir / name
+            if self._readable_file(file):
+                yield from self._iter_lines(file)
+            else:
+                yield self._fail(f"No such file: {name}")
 
+    @commands.register
     def cmd_echo(self, args):
         return " ".join(args)
 
+    @commands.register
     def cmd_clear(self, args):
         return "<CLEAR_SCREEN>"
 
+    @commands.register
     def cmd_mv(self, args):
-        if len(args) != 2:
-            return "Usage: mv <src> <dest>"
-        src = self.current_dir / args[0]
-        dst = self.current_dir / args[1]
-        shutil.move(src, dst)
-        return f"Moved '{args[0]}' to '{args[1]}'"
+        return "\n".join(self.stream_mv(args))
+
+    @commands.register
+    def stream_mv(self, args, stdin=None):
+        # mv always replaces an existing target, so -f is accepted and ignored
+        flag = self._invalid_flag(args, "f")
+        if flag is not None:
+            yield self._fail(f"mv: invalid option -- '{flag}'")
+            return
+        _, operands = self._split_flags(args)
+        if len(operands) < 2:
+            yield self._fail("Usage: mv <src>... <dest>")
+            return
+        dst = self.current_dir / operands[-1]
+        if len(operands) > 2 and not dst.is_dir():
+            yield self._fail(f"mv: target '{operands[-1]}' is not a directory")
+            return
+        root = os.path.realpath(self.terminal_root)
+        for name in operands[:-1]:
+            src = self.current_dir / name
+            if not os.path.lexists(src):
+                yield self._fail(f"mv: cannot stat '{name}': No such file or directory")
+                continue
+            final = dst / src.name if dst.is_dir() else dst
+            if not self._within_root(src) or not self._within_root(final) or os.path.realpath(src) == root:
+                yield self._fail(f"mv: cannot move '{name}': outside the terminal root")
+                continue
+            is_dir = src.is_dir() and not src.is_symlink()
+            if is_dir and (os.path.realpath(final) + os.sep).startswith(os.path.realpath(src) + os.sep):
+                yield self._fail(f"mv: cannot move '{name}' to a subdirectory of itself")
+                continue
+            # A rename is O(1) whatever the size, so a directory's size is only
+            # used when du already knows it; otherwise nothing walks the tree
+            size = dir_index.index.cached_size(src) if is_dir else src.lstat().st_size
+            replaced = final.lstat().st_size if final.is_file() else 0
+            file_cache.cache.invalidate(src)
+            file_cache.cache.invalidate(final)
+            started = time.monotonic()
+            try:
+                # Same filesystem: a single rename, whatever the size
+                os.rename(src, final)
+                took = f"{time.monotonic() - started:.2f}s"
+                detail = f"{file_ops.format_bytes(size)} in {took}" if size is not None else f"renamed in {took}"
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    yield self._fail(f"mv: cannot move '{name}': {e.strerror or e}")
+                    continue
+                # Across filesystems: copy, then remove the source
+                stats = file_ops.OpStats()
+                if is_dir:
+                    yield from file_ops.copy_tree(os.path.realpath(src), os.path.abspath(final), stats)
+                    if stats.errors:
+                        yield from (self._fail(f"mv: {error}") for error in stats.errors)
+                        yield self._fail(f"mv: '{name}' left in place after copy errors")
+                        dir_index.index.forget(final)
+                        dir_index.index.adjust(final, stats.bytes - stats.replaced)
+                        continue
+                    yield from file_ops.remove_tree(os.path.realpath(src), file_ops.OpStats())
+                    size, replaced = stats.bytes, stats.replaced
+                else:
+                    stats.bytes = file_ops.copy_file(src, final)
+                    stats.files = 1
+                    os.unlink(src)
+                detail = stats.summary()
+            # Keep cached du totals exact: the bytes leave src's ancestors and
+            # arrive at final's, or those totals are dropped when the size isn't known
+            dir_index.index.forget(src)
+            dir_index.index.forget(final)
+            if size is None:
+                dir_index.index.resized(src)
+                dir_index.index.resized(final)
+            else:
+                dir_index.index.adjust(src, -size)
+                dir_index.index.adjust(final, size - replaced)
+            yield f"Moved '{name}' to '{operands[-1]}' ({detail})"
 
+    @commands.register
     def cmd_cp(self, args):
-        if len(args) != 2:
-            return "Usage: cp <src> <dest>"
-        src = self.current_dir / args[0]
-        dst = self.current_dir / args[1]
-        if src.is_dir():
-            shutil.copytree(src, dst)
-        else:
-            shutil.copy(src, dst)
-        return f"Copied '{args[0]}' to '{args[1]}'"
-
+        return "\n".join(self.stream_cp(args))
+
+    @commands.register
+    def stream_cp(self, args, stdin=None):
+        # cp always replaces an existing target, so -f is accepted and ignored
+        flag = self._invalid_flag(args, "rRf")
+        if flag is not None:
+            yield self._fail(f"cp: invalid option -- '{flag}'")
+            return
+        flags, operands = self._split_flags(args)
+        if len(operands) < 2:
+            yield self._fail("Usage: cp [-r] <src>... <dest>")
+            return
+        recursive = "r" in flags or "R" in flags
+        dst = self.current_dir / operands[-1]
+        if len(operands) > 2 and not dst.is_dir():
+            yield self._fail(f"cp: target '{operands[-1]}' is not a directory")
+            return
+        for name in operands[:-1]:
+            src = self.current_dir / name
+            if not src.exists():
+                yield self._fail(f"cp: cannot stat '{name}': No such file or directory")
+                continue
+            final = dst / src.name if dst.is_dir() else dst
+            if not self._within_root(src) or not self._within_root(final):
+                yield self._fail(f"cp: cannot copy '{name}': outside the terminal root")
+                continue
+            stats = file_ops.OpStats()
+            file_cache.cache.invalidate(final)
+            if src.is_dir():
+                if not recursive:
+                    yield self._fail(f"cp: -r not specified; omitting directory '{name}'")
+                    continue
+                if (os.path.realpath(final) + os.sep).startswith(os.path.realpath(src) + os.sep):
+                    yield self._fail(f"cp: cannot copy a directory, '{name}', into itself")
+                    continue
+                # Directories are scanned and files copied across the file-op pool
+                yield from file_ops.copy_tree(os.path.realpath(src), os.path.abspath(final), stats)
+                yield from (self._fail(f"cp: {error}") for error in stats.errors)
+                dir_index.index.forget(final)
+            else:
+                if final.exists() and os.path.samefile(src, final):
+                    yield self._fail(f"cp: '{name}' and '{operands[-1]}' are the same file")
+                    continue
+                stats.replaced = final.stat().st_size if final.is_file() else 0
+                try:
+                    stats.bytes = file_ops.copy_file(src, final)
+                except OSError as e:
+                    # A partial copy may be left behind at an unknown size
+                    if os.path.lexists(final):
+                        dir_index.index.resized(final)
+                    yield self._fail(f"cp: cannot copy '{name}': {e.strerror or e}")
+                    continue
+                stats.files = 1
+            dir_index.index.adjust(final, stats.bytes - stats.replaced)
+            yield f"Copied '{name}' to '{operands[-1]}' ({stats.summary()})"
+
+    @commands.register
     def cmd_ln(self, args):
         if len(args) < 2:
-            return "Usage: ln <target> <link_name>"
+            return self._fail("Usage: ln <target> <link_name>")
         target = self.current_dir / args[0]
         link_name = self.current_dir / args[1]
         try:
             link_name.symlink_to(target)
+            dir_index.index.adjust(link_name, link_name.lstat().st_size)
             return f"Created symbolic link: {args[1]} -> {args[0]}"
         except Exception as e:
-            return f"Error creating link: {e}"
+            return self._fail(f"Error creating link: {e}")
 
+    @commands.register
     def cmd_chmod(self, args):
         if len(args) < 2:
-            return "Usage: chmod <mode> <file>"
+            return self._fail("Usage: chmod <mode> <file>")
         mode, filename = args[0], args[1]
         file_path = self.current_dir / filename
         try:
             os.chmod(file_path, int(mode, 8))
             return f"Changed permissions of {filename} to {mode}"
         except Exception as e:
-            return f"Error changing permissions: {e}"
+            return self._fail(f"Error changing permissions: {e}")
 
+    @commands.register
     def cmd_file(self, args):
         if not args:
-            return "Usage: file <filename>"
+            return self._fail("Usage: file <filename>")
         file_path = self.current_dir / args[0]
         if file_path.exists():
             if file_path.is_dir():
@@ -220,270 +960,766 @@ class CommandProcessor:
                 return f"{args[0]}: special file"
         return f"{args[0]}: cannot open"
 
+    @commands.register
     def cmd_stat(self, args):
         if not args:
-            return "Usage: stat <file>"
+            return self._fail("Usage: stat <file>")
         file_path = self.current_dir / args[0]
         if file_path.exists():
             stat_info = file_path.stat()
             return f"File: {args[0]}\nSize: {stat_info.st_size} bytes\nModified: {time.ctime(stat_info.st_mtime)}"
-        return f"stat: cannot stat '{args[0]}': No such file or directory"
+        return self._fail(f"stat: cannot stat '{args[0]}': No such file or directory")
+
+    @commands.register
+    def cmd_find(self, args):
+        return "\n".join(self.stream_find(args))
+
+    @commands.register
+    def stream_find(self, args, stdin=None):
+        # Directories are listed across a thread pool, or -name is answered
+        # from the filename index when TERMINAL_FIND_INDEX is on
+        self._status((yield from find_engine.find(args, self.current_dir, self.terminal_root)))
 
     # ---------- Text Processing ----------
 
+    def _parse_line_count(self, args):
+        # Parse "-n N", "-nN", "-N" and "-f"; returns (count, follow, operands)
+        count, follow, operands = 10, False, []
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "-n" and i + 1 < len(args):
+                value = args[i + 1]
+                i += 1
+            elif arg.startswith("-n"):
+                value = arg[2:]
+            elif arg.startswith("-") and arg[1:].isdigit():
+                value = arg[1:]
+            elif arg == "-f":
+                follow = True
+                value = None
+            else:
+                operands.append(arg)
+                value = None
+            if value is not None:
+                if not value.isdigit():
+                    raise ValueError(f"invalid number of lines: '{value}'")
+                count = int(value)
+            i += 1
+        return count, follow, operands
+
+    @commands.register
     def cmd_head(self, args):
-        if not args:
-            return "Usage: head <file>"
-        file = self.current_dir / args[0]
-        if file.is_file():
-            lines = file.read_text().splitlines()
-            return "\n".join(lines[:10])
-        return f"No such file: {args[0]}"
-
+        return "\n".join(self.stream_head(args))
+
+    @commands.register
+    def stream_head(self, args, stdin=None):
+        count, _, operands = self._parse_line_count(args)
+        if not operands and stdin is None:
+            yield self._fail("Usage: head [-n N] <file>")
+            return
+        # Only reuse a cached copy: loading the whole file would cost more than head
+        lines = self._input_lines(operands[0] if operands else None, stdin, load=False)
+        if lines is None:
+            yield self._fail(f"No such file: {operands[0]}")
+            return
+        # islice stops pulling after N lines, so the rest of the input is never read
+        yield from islice(lines, count)
+
+    @commands.register
     def cmd_tail(self, args):
-        if not args:
-            return "Usage: tail <file>"
-        file = self.current_dir / args[0]
-        if file.is_file():
-            lines = file.read_text().splitlines()
-            return "\n".join(lines[-10:])
-        return f"No such file: {args[0]}"
+        # Following only makes sense on the streaming endpoint
+        return "\n".join(self.stream_tail(args, allow_follow=False))
+
+    @commands.register
+    def stream_tail(self, args, stdin=None, allow_follow=True):
+        count, follow, operands = self._parse_line_count(args)
+        if not operands:
+            if stdin is None:
+                yield self._fail("Usage: tail [-n N] [-f] <file>")
+            elif count > 0:
+                yield from deque(stdin, maxlen=count)
+            return
+        file = self.current_dir / operands[0]
+        if not self._readable_file(file):
+            yield self._fail(f"No such file: {operands[0]}")
+            return
+        end = file.stat().st_size
+        cached = file_cache.cache.get(file, load=False)
+        if cached is not None and cached.key[1] == end:
+            total = cached.line_count
+            yield from cached.iter_lines(max(0, total - count), total) if count > 0 else ()
+        else:
+            yield from self._tail_lines(file, count, end)
+        if follow and allow_follow:
+            yield from self._follow(file, end)
+
+    def _tail_lines(self, file, count, end):
+        # Read backwards from EOF in blocks until we've seen count+1 newlines,
+        # so the cost is proportional to the output rather than the file
+        if count <= 0:
+            return []
+        blocks = []
+        newlines = 0
+        pos = end
+        with open(file, "rb") as f:
+            while pos > 0 and newlines <= count:
+                size = min(TAIL_BLOCK_SIZE, pos)
+                pos -= size
+                f.seek(pos)
+                block = f.read(size)
+                blocks.append(block)
+                newlines += block.count(b"\n")
+        metrics.add_read(end - pos)
+        data = b"".join(reversed(blocks))
+        lines = data.split(b"\n")
+        if data.endswith(b"\n"):
+            lines.pop()
+        return [line.decode(errors="replace").rstrip("\r") for line in lines[-count:]]
+
+    def _follow(self, file, pos):
+        # Poll for appended data, like tail -f; gives up after TAIL_FOLLOW_LIMIT
+        # seconds so a forgotten follow can't hold a worker forever
+        deadline = time.monotonic() + TAIL_FOLLOW_LIMIT
+        pending = b""
+        while time.monotonic() < deadline:
+            try:
+                size = file.stat().st_size
+            except FileNotFoundError:
+                yield pipeline.Diagnostic(f"tail: {file.name}: file removed")
+                return
+            if size < pos:
+                yield pipeline.Diagnostic(f"tail: {file.name}: file truncated")
+                pos, pending = 0, b""
+            if size > pos:
+                with open(file, "rb") as f:
+                    f.seek(pos)
+                    data = f.read(size - pos)
+                pos += len(data)
+                pending += data
+                *complete, pending = pending.split(b"\n")
+                for line in complete:
+                    yield line.decode(errors="replace").rstrip("\r")
+            else:
+                time.sleep(TAIL_FOLLOW_INTERVAL)
 
+    @commands.register
     def cmd_grep(self, args):
-        if len(args) < 2:
-            return "Usage: grep <pattern> <file>"
-        pattern, filename = args[0], args[1]
-        file = self.current_dir / filename
-        if file.is_file():
-            lines = file.read_text().splitlines()
-            matches = [f"{i+1}:{line}" for i, line in enumerate(lines) if pattern in line]
-            return "\n".join(matches) if matches else "(no matches)"
-        return f"No such file: {filename}"
+        return "\n".join(self.stream_grep(args))
 
+    @commands.register
+    def stream_grep(self, args, stdin=None):
+        # Exit status 1 when nothing matched, as in grep
+        self._status((yield from grep_engine.grep(args, self.current_dir, self.terminal_root, stdin=stdin)))
+
+    @commands.register
     def cmd_sort(self, args):
-        if not args:
-            return "Usage: sort <file>"
-        file = self.current_dir / args[0]
-        if file.is_file():
-            lines = file.read_text().splitlines()
-            return "\n".join(sorted(lines))
-        return f"No such file: {args[0]}"
+        return "\n".join(self.stream_sort(args))
 
+    @commands.register
+    def stream_sort(self, args, stdin=None):
+        try:
+            options, operands = external_sort.parse_args(args)
+        except ValueError as e:
+            yield self._fail(str(e))
+            return
+        if not operands and stdin is None:
+            yield self._fail(external_sort.USAGE)
+            return
+        lines = self._input_lines(operands[0] if operands else None, stdin)
+        if lines is None:
+            yield self._fail(f"No such file: {operands[0]}")
+            return
+        # Spills to temp files beyond the memory budget, so peak memory stays flat
+        yield from external_sort.sort_lines(lines, options)
+
+    @commands.register
     def cmd_uniq(self, args):
-        if not args:
-            return "Usage: uniq <file>"
-        file = self.current_dir / args[0]
-        if file.is_file():
-            lines = file.read_text().splitlines()
-            unique_lines = []
-            prev_line = None
-            for line in lines:
-                if line != prev_line:
-                    unique_lines.append(line)
-                    prev_line = line
-            return "\n".join(unique_lines)
-        return f"No such file: {args[0]}"
+        return "\n".join(self.stream_uniq(args))
+
+    @commands.register
+    def stream_uniq(self, args, stdin=None):
+        count = duplicates = uniques = False
+        operands = []
+        for arg in args:
+            if arg.startswith("-") and len(arg) > 1:
+                for flag in arg[1:]:
+                    if flag == "c":
+                        count = True
+                    elif flag == "d":
+                        duplicates = True
+                    elif flag == "u":
+                        uniques = True
+                    else:
+                        yield self._fail(f"uniq: invalid option -- '{flag}'")
+                        return
+            else:
+                operands.append(arg)
+        if not operands and stdin is None:
+            yield self._fail("Usage: uniq [-c] [-d] [-u] <file>")
+            return
+        lines = self._input_lines(operands[0] if operands else None, stdin)
+        if lines is None:
+            yield self._fail(f"No such file: {operands[0]}")
+            return
+        # Only the current run of equal lines is tracked
+        for line, n in self._runs(lines):
+            if duplicates and n < 2 or uniques and n > 1:
+                continue
+            yield f"{n:>7} {line}" if count else line
+
+    def _runs(self, lines):
+        # Collapse adjacent equal lines into (line, run_length)
+        previous, n = None, 0
+        for line in lines:
+            if n and line == previous:
+                n += 1
+                continue
+            if n:
+                yield previous, n
+            previous, n = line, 1
+        if n:
+            yield previous, n
 
+    @commands.register
     def cmd_wc(self, args):
+        return "\n".join(self.stream_wc(args))
+
+    @commands.register
+    def stream_wc(self, args, stdin=None):
         if not args:
-            return "Usage: wc <file>"
+            if stdin is None:
+                yield self._fail("Usage: wc <file>")
+                return
+            lines = words = chars = 0
+            for line in stdin:
+                lines += 1
+                words += len(line.split())
+                chars += len(line) + 1
+            yield f"{lines} {words} {chars}"
+            return
         file = self.current_dir / args[0]
-        if file.is_file():
-            content = file.read_text()
-            lines = len(content.splitlines())
-            words = len(content.split())
-            chars = len(content)
-            return f"{lines} {words} {chars} {args[0]}"
-        return f"No such file: {args[0]}"
-
+        readable = self._readable_file(file)
+        cached = file_cache.cache.get(file) if readable else None
+        if cached is not None:
+            lines, words, chars = cached.counts()
+            yield f"{lines} {words} {chars} {args[0]}"
+            return
+        if readable:
+            lines = words = chars = 0
+            next_check = CANCEL_CHECK_BYTES
+            # Lines end at "\n" only, as in the cached counts
+            with open(file, "r", encoding="utf-8", errors="replace", newline="\n") as f:
+                for line in iter(lambda: f.readline(MAX_LINE_LENGTH), ""):
+                    if chars >= next_check:
+                        check_cancelled()
+                        next_check += CANCEL_CHECK_BYTES
+                    if line.endswith("\n"):
+                        lines += 1
+                    words += len(line.split())
+                    chars += len(line)
+            # A final line without a trailing newline still counts as a line
+            if chars and not line.endswith("\n"):
+                lines += 1
+            metrics.add_read(chars)
+            yield f"{lines} {words} {chars} {args[0]}"
+            return
+        yield self._fail(f"No such file: {args[0]}")
+
+    @commands.register
     def cmd_cut(self, args):
-        if len(args) < 2:
-            return "Usage: cut -d<delimiter> -f<field> <file>"
-        # Simple implementation - cut by spaces
-        file = self.current_dir / args[-1]
-        if file.is_file():
-            lines = file.read_text().splitlines()
-            result = []
-            for line in lines:
-                fields = line.split()
-                if len(fields) > 0:
-                    result.append(fields[0])  # First field
-            return "\n".join(result)
-        return f"No such file: {args[-1]}"
+        return "\n".join(self.stream_cut(args))
+
+    @commands.register
+    def stream_cut(self, args, stdin=None):
+        delimiter, fields, operands = "\t", None, []
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg[:2] in ("-d", "-f"):
+                value = arg[2:]
+                if not value and i + 1 < len(args):
+                    i += 1
+                    value = args[i]
+                if arg[:2] == "-d":
+                    delimiter = value
+                else:
+                    fields = value
+            else:
+                operands.append(arg)
+            i += 1
+        if fields is None or (not operands and stdin is None):
+            yield self._fail("Usage: cut -d<delimiter> -f<field> <file>")
+            return
+        if len(delimiter) != 1:
+            yield self._fail("cut: the delimiter must be a single character")
+            return
+        try:
+            selected = self._parse_field_list(fields)
+        except ValueError:
+            yield self._fail(f"cut: invalid field list: '{fields}'")
+            return
+        lines = self._input_lines(operands[0] if operands else None, stdin)
+        if lines is None:
+            yield self._fail(f"No such file: {operands[0]}")
+            return
+        for line in lines:
+            if delimiter not in line:
+                # Like GNU cut, lines without the delimiter pass through untouched
+                yield line
+                continue
+            parts = line.split(delimiter)
+            yield delimiter.join(parts[i] for i in selected(len(parts)))
+
+    def _parse_field_list(self, spec):
+        # "1,3-5,7-" -> function mapping a field count to the 0-based indexes to keep
+        ranges = []
+        for item in spec.split(","):
+            start, dash, end = item.partition("-")
+            low = int(start) if start else 1
+            high = int(end) if end else (None if dash else low)
+            if low < 1 or (high is not None and high < low):
+                raise ValueError(spec)
+            ranges.append((low, high))
+
+        # Lines usually share a field count, so memoise the index list per count
+        cache = {}
+
+        def selected(n):
+            if n not in cache:
+                keep = set()
+                for low, high in ranges:
+                    keep.update(range(low - 1, min(high if high is not None else n, n)))
+                cache[n] = sorted(keep)
+            return cache[n]
+
+        return selected
+
+    def _operand_files(self, command, operands):
+        # Split operands into readable files and error lines for the rest
+        files, errors = [], []
+        for operand in operands:
+            file = self.current_dir / operand
+            if not self._opens_within_root(file):
+                errors.append(self._fail(f"{command}: can't read {operand}: outside the terminal root"))
+            elif file.is_file():
+                files.append(file)
+            else:
+                errors.append(self._fail(f"{command}: can't read {operand}: No such file or directory"))
+        return files, errors
+
+    def _chain_lines(self, files):
+        for file in files:
+            yield from self._iter_lines(file)
+
+    @commands.register
+    def cmd_sed(self, args):
+        return "\n".join(self.stream_sed(args))
+
+    @commands.register
+    def stream_sed(self, args, stdin=None):
+        try:
+            script, quiet, extended, operands = sed_engine.parse_args(args)
+            # Compiled once per distinct script, then reused from the cache
+            program = sed_engine.compile_script(script, quiet, extended)
+        except ValueError as e:
+            yield self._fail(str(e))
+            return
+        if not operands and stdin is None:
+            yield self._fail(sed_engine.USAGE)
+            return
+        files, errors = self._operand_files("sed", operands)
+        yield from errors
+        if operands and not files:
+            return
+        yield from program(self._chain_lines(files) if operands else stdin)
+
+    @commands.register
+    def cmd_awk(self, args):
+        return "\n".join(self.stream_awk(args))
+
+    @commands.register
+    def stream_awk(self, args, stdin=None):
+        try:
+            script, fs, assignments, operands = awk_engine.parse_args(args)
+            awk_engine.compile_program(script)
+        except ValueError as e:
+            yield self._fail(str(e))
+            return
+        files, errors = self._operand_files("awk", operands)
+        yield from errors
+        if operands and not files:
+            return
+        if operands:
+            lines = self._chain_lines(files)
+        else:
+            # A BEGIN-only program needs no input at all
+            lines = stdin if stdin is not None else iter(())
+        try:
+            cancel = current_cancel()
+            yield from awk_engine.awk(lines, script, fs, assignments, cancel.is_set if cancel else None)
+        except awk_engine.Cancelled:
+            # The executor has already given up on this command
+            return
+        except ZeroDivisionError:
+            yield self._fail("awk: division by zero")
+        except (ValueError, OverflowError) as e:
+            yield self._fail(f"awk: {e}")
 
     # ---------- System Information ----------
 
+    @commands.register
     def cmd_whoami(self, args):
         return "terminal_user"
 
+    @commands.register
     def cmd_date(self, args):
         return time.strftime("%a %b %d %H:%M:%S %Z %Y")
 
+    @commands.register
     def cmd_uptime(self, args):
-        return f"up {int(time.time() / 3600)} hours"
-
+        snap = system.get(self.terminal_root)
+        up = _format_duration(snap["timestamp"] - snap["boot_time"])
+        if "-p" in args:
+            return f"up {up}"
+        users = snap["users"]
+        load = ", ".join(f"{value:.2f}" for value in snap["load"])
+        clock = time.strftime("%H:%M:%S", time.localtime(snap["timestamp"]))
+        return f" {clock} up {up},  {users} user{'s' if users != 1 else ''},  load average: {load}"
+
+    @commands.register
     def cmd_uname(self, args):
         return f"{platform.system()} {platform.release()} {platform.machine()}"
 
+    @commands.register
     def cmd_df(self, args):
-        return "Filesystem     1K-blocks    Used Available Use% Mounted on\n/dev/root       1000000   500000    500000  50% /"
+        # Usage of the filesystem holding terminal_root
+        snap = system.get(self.terminal_root)
+        disk = snap["disk"]
+        human = "-h" in args
+        size = _human_size if human else (lambda n: str(n // 1024))
+        header = "Size" if human else "1K-blocks"
+        rows = [
+            ["Filesystem", header, "Used", "Available", "Use%", "Mounted on"],
+            [snap["device"], size(disk.total), size(disk.used), size(disk.free), f"{disk.percent:.0f}%", snap["mount"]],
+        ]
+        return _format_table(rows, left={0, 5})
 
+    @commands.register
     def cmd_du(self, args):
         if not args:
-            return "Usage: du <directory>"
+            return self._fail("Usage: du <directory>")
         dir_path = self.current_dir / args[0]
         if dir_path.is_dir():
-            total_size = sum(f.stat().st_size for f in dir_path.rglob('*') if f.is_file())
+            # Answered from the shared size index once the tree has been walked
+            total_size = dir_index.index.dir_size(dir_path, check=check_cancelled)
             return f"{total_size // 1024}\t{args[0]}"
-        return f"du: cannot access '{args[0]}': No such file or directory"
+        return self._fail(f"du: cannot access '{args[0]}': No such file or directory")
 
+    @commands.register
     def cmd_free(self, args):
-        return "              total        used        free      shared  buff/cache   available\nMem:        8000000     4000000     2000000          0     2000000     4000000\nSwap:       2000000           0     2000000"
+        snap = system.get(self.terminal_root)
+        mem, swap = snap["memory"], snap["swap"]
+        if "-h" in args:
+            fmt = _human_size
+        else:
+            unit = {"-b": 1, "-k": 1024, "-m": 1024 ** 2, "-g": 1024 ** 3}.get(next((a for a in args if a in ("-b", "-k", "-m", "-g")), "-k"))
+            fmt = lambda n: str(n // unit)
+        cache = getattr(mem, "buffers", 0) + getattr(mem, "cached", 0)
+        rows = [
+            ["", "total", "used", "free", "shared", "buff/cache", "available"],
+            ["Mem:", fmt(mem.total), fmt(mem.used), fmt(mem.free), fmt(getattr(mem, "shared", 0)), fmt(cache), fmt(mem.available)],
+            ["Swap:", fmt(swap.total), fmt(swap.used), fmt(swap.free)],
+        ]
+        return _format_table(rows, left={0})
 
+    @commands.register
     def cmd_top(self, args):
-        return "PID USER      PR  NI    VIRT    RES    SHR S  %CPU  %MEM     TIME+ COMMAND\n1 root      20   0   12345    1234    1234 S   0.0   0.1   0:00.01 init"
-
+        # One batch-mode frame: top [-o cpu|mem|rss|time|pid|name] [-n N] [-u user] [-r]
+        sort_key, limit, user, reverse = "cpu", 20, None, False
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg in ("-o", "-n", "-u") and i + 1 < len(args):
+                value = args[i + 1]
+                i += 1
+                if arg == "-o":
+                    sort_key = value.lstrip("%").lower()
+                    if sort_key not in TOP_SORT_KEYS:
+                        return self._fail(f"top: unknown sort field '{value}' (use {', '.join(TOP_SORT_KEYS)})")
+                elif arg == "-n":
+                    if not value.isdigit():
+                        return self._fail(f"top: invalid number of processes: '{value}'")
+                    limit = int(value)
+                else:
+                    user = value
+            elif arg == "-r":
+                reverse = True
+            else:
+                return self._fail("Usage: top [-o cpu|mem|rss|time|pid|name] [-n N] [-u user] [-r]")
+            i += 1
+
+        snap = system.get(self.terminal_root)
+        processes = self._own_processes(snap)
+        tasks = len(processes)
+        if user is not None:
+            processes = [p for p in processes if p["user"] == user]
+        field, descending = TOP_SORT_KEYS[sort_key]
+        processes = sorted(processes, key=lambda p: p[field], reverse=descending != reverse)[:limit]
+
+        states = {}
+        for proc in self._own_processes(snap):
+            states[proc["status"]] = states.get(proc["status"], 0) + 1
+        mem, swap = snap["memory"], snap["swap"]
+        mib = 1024 * 1024
+        clock = time.strftime("%H:%M:%S", time.localtime(snap["timestamp"]))
+        load = ", ".join(f"{value:.2f}" for value in snap["load"])
+        lines = [
+            f"top - {clock} up {_format_duration(snap['timestamp'] - snap['boot_time'])},  load average: {load}",
+            f"Tasks: {tasks} total, {states.get('running', 0)} running, "
+            f"{states.get('sleeping', 0) + states.get('idle', 0) + states.get('disk-sleep', 0)} sleeping, "
+            f"{states.get('stopped', 0)} stopped, {states.get('zombie', 0)} zombie",
+            f"%Cpu(s): {sampler.latest()['cpu']:.1f} used",
+            f"MiB Mem : {mem.total / mib:.1f} total, {mem.free / mib:.1f} free, {mem.used / mib:.1f} used, {mem.available / mib:.1f} avail",
+            f"MiB Swap: {swap.total / mib:.1f} total, {swap.free / mib:.1f} free, {swap.used / mib:.1f} used",
+            "",
+        ]
+        rows = [["PID", "USER", "PR", "NI", "VIRT", "RES", "SHR", "S", "%CPU", "%MEM", "TIME+", "COMMAND"]]
+        for p in processes:
+            rows.append([
+                str(p["pid"]), p["user"][:8], str(20 + p["nice"]), str(p["nice"]),
+                str(p["vms"] // 1024), str(p["rss"] // 1024), str(p["shared"] // 1024),
+                PROCESS_STATES.get(p["status"], "?"), f"{p['cpu']:.1f}", f"{p['mem']:.1f}",
+                _format_cpu_time(p["time"]), p["name"],
+            ])
+        return "\n".join(lines + [_format_table(rows, left={1, 11})])
+
+    def _own_processes(self, snap):
+        # The server and its descendants; ps and top never show the rest of
+        # the host, whose command lines may carry other users' arguments
+        children = {}
+        for p in snap["processes"]:
+            children.setdefault(p["ppid"], []).append(p)
+        mine = [p for p in snap["processes"] if p["pid"] == snap["self_pid"]]
+        stack = [snap["self_pid"]]
+        while stack:
+            for child in children.get(stack.pop(), ()):
+                mine.append(child)
+                stack.append(child["pid"])
+        return mine
+
+    @commands.register
     def cmd_ps(self, args):
-        return "PID TTY          TIME CMD\n1 ?        00:00:00 init\n2 ?        00:00:00 kthreadd"
-
+        # ps: this server's process tree; ps aux and ps -ef: BSD and System V
+        # full listings of it. -e, -A, a and x are accepted but never widen
+        # the listing to the rest of the host
+        snap = system.get(self.terminal_root)
+        flags = "".join(arg.lstrip("-") for arg in args)
+        processes = sorted(self._own_processes(snap), key=lambda p: p["pid"])
+
+        if "u" in flags:
+            rows = [["USER", "PID", "%CPU", "%MEM", "VSZ", "RSS", "TTY", "STAT", "START", "TIME", "COMMAND"]]
+            for p in processes:
+                rows.append([
+                    p["user"][:8], str(p["pid"]), f"{p['cpu']:.1f}", f"{p['mem']:.1f}",
+                    str(p["vms"] // 1024), str(p["rss"] // 1024), p["tty"],
+                    PROCESS_STATES.get(p["status"], "?"), _format_start(p["started"]),
+                    _format_cpu_time(p["time"], clock=True), p["command"],
+                ])
+            return _format_table(rows, left={0, 6, 7, 10})
+        if "f" in flags:
+            rows = [["UID", "PID", "PPID", "C", "STIME", "TTY", "TIME", "CMD"]]
+            for p in processes:
+                rows.append([
+                    p["user"][:8], str(p["pid"]), str(p["ppid"]), str(int(p["cpu"])),
+                    _format_start(p["started"]), p["tty"], _format_cpu_time(p["time"], clock=True), p["command"],
+                ])
+            return _format_table(rows, left={0, 5, 7})
+        rows = [["PID", "TTY", "TIME", "CMD"]]
+        for p in processes:
+            rows.append([str(p["pid"]), p["tty"], _format_cpu_time(p["time"], clock=True), p["name"]])
+        return _format_table(rows, left={1, 3})
+
+    @commands.register
     def cmd_kill(self, args):
         if not args:
-            return "kill: missing operand"
+            return self._fail("kill: missing operand")
         return f"Process {args[0]} terminated"
 
+    @commands.register
     def cmd_killall(self, args):
         if not args:
-            return "killall: missing operand"
+            return self._fail("killall: missing operand")
         return f"Process {args[0]} terminated"
 
+    @commands.register
     def cmd_jobs(self, args):
         return "No jobs running"
 
+    @commands.register
     def cmd_bg(self, args):
-        return "No jobs to run in background"
+        return self._fail("No jobs to run in background")
 
+    @commands.register
     def cmd_fg(self, args):
-        return "No jobs to bring to foreground"
+        return self._fail("No jobs to bring to foreground")
 
     # ---------- Network and Utilities ----------
 
+    @commands.register
     def cmd_ping(self, args):
         if not args:
-            return "Usage: ping <host>"
+            return self._fail("Usage: ping <host>")
         return f"PING {args[0]} (127.0.0.1): 56 data bytes\n64 bytes from 127.0.0.1: icmp_seq=0 ttl=64 time=0.1 ms"
 
+    @commands.register
     def cmd_curl(self, args):
         if not args:
-            return "Usage: curl <url>"
-        return f"curl: (6) Could not resolve host: {args[0]}"
+            return self._fail("Usage: curl <url>")
+        return self._fail(f"curl: (6) Could not resolve host: {args[0]}")
 
+    @commands.register
     def cmd_wget(self, args):
         if not args:
-            return "Usage: wget <url>"
-        return f"wget: unable to resolve host address '{args[0]}'"
+            return self._fail("Usage: wget <url>")
+        return self._fail(f"wget: unable to resolve host address '{args[0]}'")
 
+    @commands.register
     def cmd_ssh(self, args):
-        return "ssh: connect to host: Connection refused"
+        return self._fail("ssh: connect to host: Connection refused")
 
+    @commands.register
     def cmd_scp(self, args):
-        return "scp: connect to host: Connection refused"
+        return self._fail("scp: connect to host: Connection refused")
 
+    @commands.register
     def cmd_tar(self, args):
-        if not args:
-            return "Usage: tar [options] <archive>"
-        return f"tar: {args[-1]}: Cannot open: No such file or directory"
+        return "\n".join(self.stream_tar(args))
 
+    @commands.register
+    def stream_tar(self, args, stdin=None):
+        # Archive work runs on the archive pool; this yields its progress lines
+        self._status((yield from archives.tar(args, self.current_dir, self.terminal_root)))
+
+    @commands.register
     def cmd_zip(self, args):
-        if len(args) < 2:
-            return "Usage: zip <archive> <files...>"
-        return f"zip: {args[0]}: No such file or directory"
+        return "\n".join(self.stream_zip(args))
 
+    @commands.register
+    def stream_zip(self, args, stdin=None):
+        self._status((yield from archives.zip_files(args, self.current_dir, self.terminal_root)))
+
+    @commands.register
     def cmd_unzip(self, args):
-        if not args:
-            return "Usage: unzip <archive>"
-        return f"unzip: cannot find or open {args[0]}, {args[0]}.zip or {args[0]}.ZIP"
+        return "\n".join(self.stream_unzip(args))
+
+    @commands.register
+    def stream_unzip(self, args, stdin=None):
+        self._status((yield from archives.unzip(args, self.current_dir, self.terminal_root)))
 
     # ---------- Terminal Control ----------
 
+    @commands.register
     def cmd_history(self, args):
-        return "No history available"
+        return "\n".join(self.stream_history(args))
+
+    @commands.register
+    def stream_history(self, args, stdin=None):
+        # history [N] | history -c; entries are numbered per session
+        if self.session_id is None:
+            yield "No history available"
+            return
+        if args and args[0] == "-c":
+            history.clear(self.session_id)
+            return
+        if args:
+            if not args[0].isdigit():
+                yield self._fail(f"history: {args[0]}: numeric argument required")
+                return
+            entries = history.last(self.session_id, int(args[0]))
+        else:
+            entries = history.iter_session(self.session_id)
+        for entry in entries:
+            yield f"{entry['number']:5d}  {entry['command']}"
 
+    @commands.register
     def cmd_alias(self, args):
         if not args:
-            return "No aliases defined"
-        return f"Alias '{args[0]}' created"
+            if not self.aliases:
+                return "No aliases defined"
+            return "\n".join(f"alias {name}='{value}'" for name, value in sorted(self.aliases.items()))
+        output = []
+        for arg in args:
+            name, sep, value = arg.partition("=")
+            if not ALIAS_NAME.fullmatch(name):
+                output.append(self._fail(f"alias: '{name}': invalid alias name"))
+            elif sep:
+                self.aliases[name] = value
+                output.append(f"Alias '{name}' created")
+            elif name in self.aliases:
+                output.append(f"alias {name}='{self.aliases[name]}'")
+            else:
+                output.append(self._fail(f"alias: {name}: not found"))
+        return "\n".join(output)
 
+    @commands.register
     def cmd_export(self, args):
         if not args:
-            return "No environment variables to export"
-        return f"Exported {args[0]}"
+            if not self.env:
+                return "No environment variables to export"
+            return "\n".join(f'declare -x {name}="{value}"' for name, value in sorted(self.env.items()))
+        output = []
+        for arg in args:
+            name, sep, value = arg.partition("=")
+            if not ENV_NAME.fullmatch(name):
+                output.append(self._fail(f"export: '{arg}': not a valid identifier"))
+                continue
+            if sep:
+                self.env[name] = value
+            else:
+                # Exporting an unset name gives it an empty value
+                self.env.setdefault(name, BASE_ENV.get(name, ""))
+            output.append(f"Exported {name}")
+        return "\n".join(output)
 
+    @commands.register
     def cmd_env(self, args):
-        return "PATH=/usr/bin:/bin\nHOME=/home/terminal_user\nUSER=terminal_user"
+        return "\n".join(f"{name}={value}" for name, value in {**BASE_ENV, **self.env}.items())
 
+    @commands.register
     def cmd_which(self, args):
         if not args:
-            return "Usage: which <command>"
-        if args[0] in COMMANDS:
+            return self._fail("Usage: which <command>")
+        if args[0] in COMMAND_NAMES or sandbox.allowed(args[0]):
             return f"/usr/bin/{args[0]}"
-        return f"which: no {args[0]} in (/usr/bin:/bin)"
+        return self._fail(f"which: no {args[0]} in (/usr/bin:/bin)")
 
+    @commands.register
     def cmd_whereis(self, args):
         if not args:
-            return "Usage: whereis <command>"
-        if args[0] in COMMANDS:
+            return self._fail("Usage: whereis <command>")
+        if args[0] in COMMAND_NAMES or sandbox.allowed(args[0]):
             return f"{args[0]}: /usr/bin/{args[0]}"
         return f"{args[0]}:"
 
     # ---------- Help and Documentation ----------
 
+    @commands.register
     def cmd_help(self, args):
-        help_text = "Available commands:\n\n"
-        
-        # Group commands by category
-        categories = {
-            "File & Directory Operations": ["ls", "cd", "pwd", "mkdir", "rm", "rmdir", "touch", "cat", "echo", "mv", "cp", "ln", "chmod", "chown", "file", "stat"],
-            "Text Processing": ["head", "tail", "grep", "sed", "awk", "sort", "uniq", "wc", "cut"],
-            "System Information": ["whoami", "date", "uptime", "uname", "df", "du", "free", "top", "ps", "kill", "killall", "jobs", "bg", "fg"],
-            "Network & Utilities": ["ping", "curl", "wget", "ssh", "scp", "tar", "zip", "unzip"],
-            "Terminal Control": ["clear", "history", "alias", "export", "env", "which", "whereis"],
-            "Help & Documentation": ["help", "man", "info"]
-        }
-        
-        order = [
-            "File & Directory Operations",
-            "Text Processing",
-            "System Information",
-            "Network & Utilities",
-            "Terminal Control",
-            "Help & Documentation"
-        ]
-
-        for category in order:
-            cmds = categories.get(category, [])
-            if not cmds:
-                continue
-            help_text += f"{category}:\n"
-            # Sort commands alphabetically for readability
-            for cmd in sorted(cmds):
-                if cmd in COMMAND_HELP:
-                    help_text += f"  {cmd:<10} - {COMMAND_HELP[cmd]}\n"
-            help_text += "\n"
-        
+        # The command table is rendered once; only the footer changes
+        help_text = commands.help_text()
         help_text += f"Current directory: {self.current_dir.relative_to(self.terminal_root)}\n"
         help_text += "Tip: Use 'cd ..' to go up one directory level"
         return help_text
 
+    @commands.register
     def cmd_man(self, args):
         if not args:
-            return "Usage: man <command>"
-        if args[0] in COMMAND_HELP:
-            return f"Manual page for {args[0]}\n\n{COMMAND_HELP[args[0]]}"
-        return f"No manual entry for {args[0]}"
+            return self._fail("Usage: man <command>")
+        return commands.page("man", args[0]) or self._fail(f"No manual entry for {args[0]}")
 
+    @commands.register
     def cmd_info(self, args):
         if not args:
-            return "Usage: info <command>"
-        if args[0] in COMMAND_HELP:
-            return f"Info: {args[0]}\n\n{COMMAND_HELP[args[0]]}"
-        return f"No info entry for {args[0]}"
\ No newline at end of file
+            return self._fail("Usage: info <command>")
+        return commands.page("info", args[0]) or self._fail(f"No info entry for {args[0]}")
\ No newline at end of file
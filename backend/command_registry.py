@@ -0,0 +1,91 @@
+import importlib
+import threading
+
+from commands_list import COMMAND_CATEGORIES, COMMAND_HELP
+
+
+class Command:
+    __slots__ = ("name", "category", "handler", "stream")
+
+    def __init__(self, name, category):
+        self.name = name
+        self.category = category
+        # Plain functions taking (processor, args) / (processor, args, stdin=...)
+        self.handler = None
+        self.stream = None
+
+
+class CommandRegistry:
+    # Name -> Command table for CommandProcessor. Handlers register with
+    # @commands.register while the class body runs, so dispatch is a single
+    # dict lookup with no per-call getattr or string formatting. help, man and
+    # info text is rendered once and reused.
+
+    def __init__(self, categories=COMMAND_CATEGORIES):
+        self.commands = {
+            name: Command(name, category) for category, names in categories.items() for name in names
+        }
+        self._help = None
+        self._pages = {}
+
+    def register(self, func):
+        # Decorator for cmd_<name> and stream_<name> methods
+        kind, _, name = func.__name__.partition("_")
+        entry = self.commands.get(name)
+        if entry is None or kind not in ("cmd", "stream"):
+            raise ValueError(f"{func.__name__} does not name a command in COMMAND_CATEGORIES")
+        if kind == "cmd":
+            entry.handler = func
+        else:
+            entry.stream = func
+        return func
+
+    def get(self, name):
+        return self.commands.get(name)
+
+    def help_text(self):
+        # The category table help prints, commands sorted within each category
+        if self._help is None:
+            sections = []
+            for category in COMMAND_CATEGORIES:
+                names = sorted(name for name, entry in self.commands.items() if entry.category == category)
+                rows = [f"  {name:<10} - {COMMAND_HELP[name]}\n" for name in names if name in COMMAND_HELP]
+                if rows:
+                    sections.append(f"{category}:\n" + "".join(rows) + "\n")
+            self._help = "Available commands:\n\n" + "".join(sections)
+        return self._help
+
+    def page(self, kind, name):
+        # "man" or "info" page for name, or None when it has no help entry
+        key = (kind, name)
+        text = self._pages.get(key)
+        if text is None and name in COMMAND_HELP:
+            title = f"Manual page for {name}" if kind == "man" else f"Info: {name}"
+            text = self._pages[key] = f"{title}\n\n{COMMAND_HELP[name]}"
+        return text
+
+
+class LazyModule:
+    # Stands in for a module-level import until the first attribute read,
+    # then imports the module and rebinds the importer's global to it, so
+    # later uses are plain module attribute lookups. Keeps rarely used
+    # engines (archives, sed/awk, grep) out of worker start-up.
+    __slots__ = ("_name", "_namespace", "_lock")
+
+    def __init__(self, name, namespace):
+        self._name = name
+        self._namespace = namespace
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            module = importlib.import_module(self._name)
+            self._namespace[self._name] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+# The table CommandProcessor registers into
+commands = CommandRegistry()
@@ -1,67 +1,66 @@
-# List of supported terminal commands (30+ popular OS commands)
-COMMANDS = [
-    # File and Directory Operations
-    "ls", "cd", "pwd", "mkdir", "rm", "rmdir", "touch", "cat", "echo",
-    "mv", "cp", "ln", "chmod", "chown", "file", "stat",
-    
-    # Text Processing
-    "head", "tail", "grep", "sed", "awk", "sort", "uniq", "wc", "cut",
-    
-    # System Information
-    "whoami", "date", "uptime", "uname", "df", "du", "free", "top", "ps",
-    "kill", "killall", "jobs", "bg", "fg",
-    
-    # Network and Utilities
-    "ping", "curl", "wget", "ssh", "scp", "tar", "zip", "unzip",
-    
-    # Terminal Control
-    "clear", "history", "alias", "export", "env", "which", "whereis",
-    
-    # Help and Documentation
-    "help", "man", "info"
-]
+# Supported terminal commands (30+ popular OS commands) by help category,
+# in the order help prints them
+COMMAND_CATEGORIES = {
+    "File & Directory Operations": [
+        "ls", "cd", "pwd", "mkdir", "rm", "rmdir", "touch", "cat", "echo",
+        "mv", "cp", "ln", "chmod", "chown", "file", "stat", "find",
+    ],
+    "Text Processing": ["head", "tail", "grep", "sed", "awk", "sort", "uniq", "wc", "cut"],
+    "System Information": [
+        "whoami", "date", "uptime", "uname", "df", "du", "free", "top", "ps",
+        "kill", "killall", "jobs", "bg", "fg",
+    ],
+    "Network & Utilities": ["ping", "curl", "wget", "ssh", "scp", "tar", "zip", "unzip"],
+    "Terminal Control": ["clear", "history", "alias", "export", "env", "which", "whereis"],
+    "Help & Documentation": ["help", "man", "info"],
+}
+
+# Every command in category order, and as a set for membership tests
+COMMANDS = [name for names in COMMAND_CATEGORIES.values() for name in names]
+COMMAND_NAMES = frozenset(COMMANDS)
 
 # Command descriptions for help
 COMMAND_HELP = {
     # File and Directory Operations
-    "ls": "List directory contents (use -la for detailed view)",
+    "ls": "List directory contents (-l for details, -a to include hidden files)",
     "cd": "Change directory (cd .. to go up, cd ~ for home)",
     "pwd": "Print working directory",
     "mkdir": "Create a new directory (mkdir -p for nested dirs)",
-    "rm": "Remove a file (rm -rf for recursive force)",
+    "rm": "Remove files (rm -r for directories, -f to ignore missing files)",
     "rmdir": "Remove an empty directory",
     "touch": "Create or update a file timestamp",
     "cat": "Display file contents",
     "echo": "Print text to terminal",
-    "mv": "Move or rename files/directories",
-    "cp": "Copy files (cp -r for directories)",
+    "mv": "Move or rename files/directories (several sources into a directory)",
+    "cp": "Copy files (cp -r for directories; several sources into a directory)",
     "ln": "Create symbolic or hard links",
     "chmod": "Change file permissions",
     "chown": "Change file ownership",
     "file": "Determine file type",
     "stat": "Display file or filesystem status",
+    "find": "Search a directory tree (-name, -iname, -type f|d|l, -size, -mtime, -maxdepth, -mindepth)",
     
     # Text Processing
-    "head": "Show first 10 lines of a file",
-    "tail": "Show last 10 lines of a file",
-    "grep": "Search for text patterns in files",
-    "sed": "Stream editor for filtering and transforming text",
-    "awk": "Pattern scanning and processing language",
-    "sort": "Sort lines of text files",
-    "uniq": "Report or omit repeated lines",
+    "head": "Show first 10 lines of a file (head -n N for N lines)",
+    "tail": "Show last 10 lines of a file (tail -n N, tail -f to follow)",
+    "grep": "Search for text patterns in files (-E regex, -i, -c, -l, -r)",
+    "sed": "Stream editor (-n, -E, -e; s, d, p, q, =, y and {} with line, $ and /re/ addresses)",
+    "awk": "Pattern scanning language (-F, -v; patterns, ranges, arrays, printf, sub/gsub/split)",
+    "sort": "Sort lines of text files (-n, -r, -u, -k N)",
+    "uniq": "Report or omit repeated lines (-c to count, -d duplicates only)",
     "wc": "Print word, line, and byte counts",
     "cut": "Remove sections from each line of files",
     
     # System Information
     "whoami": "Show current username",
     "date": "Show current date and time",
-    "uptime": "Show system uptime and load",
+    "uptime": "Show system uptime and load (-p for pretty format)",
     "uname": "Show system information",
-    "df": "Show disk space usage",
+    "df": "Show disk space usage of the terminal filesystem (-h for human-readable sizes)",
     "du": "Show directory space usage",
-    "free": "Show memory usage",
-    "top": "Show running processes (interactive)",
-    "ps": "Show running processes",
+    "free": "Show memory usage (-b, -k, -m, -g or -h for units)",
+    "top": "Show this server's busiest processes (-o cpu|mem|rss|time|pid|name, -n N, -u user, -r)",
+    "ps": "Show this server's processes (aux or -ef for full listings)",
     "kill": "Terminate a process by PID",
     "killall": "Terminate processes by name",
     "jobs": "Show active jobs",
@@ -74,15 +73,15 @@ COMMAND_HELP = {
     "wget": "Download files from the web",
     "ssh": "Secure shell remote login",
     "scp": "Secure copy files over network",
-    "tar": "Archive files (tar -czf to compress)",
-    "zip": "Create zip archives",
-    "unzip": "Extract zip archives",
+    "tar": "Create, list or extract tar archives (tar -czf out.tgz dir, tar -xf in.tar -C dir, -j bzip2, -J xz)",
+    "zip": "Create zip archives (zip -r out.zip dir, -0..-9 level, -Z method)",
+    "unzip": "Extract zip archives (-d dir, -o overwrite, -l list)",
     
     # Terminal Control
     "clear": "Clear the terminal screen",
-    "history": "Show command history",
-    "alias": "Create command aliases",
-    "export": "Set environment variables",
+    "history": "Show command history (history [N], history -c; recall with !!, !n, !-n, !prefix)",
+    "alias": "Create or list command aliases (alias name='command')",
+    "export": "Set environment variables for this session (export NAME=value)",
     "env": "Show environment variables",
     "which": "Locate a command",
     "whereis": "Locate binary, source, and manual files",
@@ -91,4 +90,45 @@ COMMAND_HELP = {
     "help": "Show this help message",
     "man": "Show manual pages",
     "info": "Show info documentation"
-}
\ No newline at end of file
+}
+
+# Commands whose cost grows with file or tree size. These run on the bounded
+# heavy-command executor instead of the shared request threadpool.
+HEAVY_COMMANDS = {
+    "cat", "grep", "sed", "awk", "sort", "uniq", "wc", "cut",
+    "du", "find", "cp", "mv", "rm", "tar", "zip", "unzip"
+}
+
+# Per-command timeouts in seconds; anything not listed gets the default for its class
+COMMAND_TIMEOUTS = {
+    "du": 60,
+    "find": 60,
+    "cp": 300,
+    "mv": 300,
+    "rm": 120,
+    "sort": 120,
+    "grep": 60,
+    "tar": 600,
+    "zip": 600,
+    "unzip": 600
+}
+CHEAP_TIMEOUT = 10
+HEAVY_TIMEOUT = 30
+
+# Relative cost of one run, charged against the caller's rate limit and used
+# to order the fair scheduler's queue; anything not listed costs the weight
+# for its class
+COMMAND_WEIGHTS = {
+    "du": 10,
+    "find": 8,
+    "cp": 10,
+    "mv": 5,
+    "rm": 5,
+    "sort": 8,
+    "grep": 4,
+    "tar": 20,
+    "zip": 20,
+    "unzip": 20
+}
+CHEAP_WEIGHT = 1
+HEAVY_WEIGHT = 4
@@ -0,0 +1,217 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Cached directory totals kept at most this long (catches changes made outside
+# the terminal), and the most directories remembered at once
+DU_INDEX_TTL = float(os.environ.get("TERMINAL_DU_TTL", "300"))
+DU_INDEX_MAX = 200000
+
+
+def _key(path):
+    return os.path.abspath(path)
+
+
+class DirSizeIndex:
+    # Recursive byte totals per directory. Mutating commands report size
+    # changes through adjust()/forget(), which update every cached ancestor,
+    # so a warm du answers from the dict without touching the disk.
+
+    def __init__(self, ttl=DU_INDEX_TTL, max_entries=DU_INDEX_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._sizes = OrderedDict()  # path -> (total_bytes, computed_at)
+        # directory -> paths below it that are cached or lead to one, so a
+        # subtree can be dropped without scanning every key
+        self._children = {}
+        self._lock = threading.Lock()
+        self._watchers = []
+        self.hits = 0
+        self.misses = 0
+
+    def watch(self, callback):
+        # callback(path, tree) runs for every change reported here; tree is
+        # True when everything below path may have changed (forget, mkdir)
+        self._watchers.append(callback)
+
+    def _notify(self, path, tree):
+        for callback in self._watchers:
+            callback(path, tree)
+
+    def _lookup(self, key, now):
+        entry = self._sizes.get(key)
+        if entry is None or now - entry[1] > self.ttl:
+            return None
+        self._sizes.move_to_end(key)
+        return entry[0]
+
+    def _link(self, key):
+        # File key under its parent, and the parent under its own, until an
+        # ancestor that is already in the tree
+        while True:
+            parent = os.path.dirname(key)
+            if parent == key:
+                return
+            siblings = self._children.get(parent)
+            if siblings is not None:
+                siblings.add(key)
+                return
+            self._children[parent] = {key}
+            key = parent
+
+    def _unlink(self, key):
+        # Prune key, and then its ancestors, once nothing cached is left at
+        # or below them
+        while key not in self._sizes and not self._children.get(key):
+            self._children.pop(key, None)
+            parent = os.path.dirname(key)
+            siblings = self._children.get(parent)
+            if parent == key or siblings is None:
+                return
+            siblings.discard(key)
+            key = parent
+
+    def _drop(self, key):
+        if self._sizes.pop(key, None) is not None:
+            self._unlink(key)
+
+    def _store(self, key, total, now):
+        if key not in self._sizes:
+            self._link(key)
+        self._sizes[key] = (total, now)
+        self._sizes.move_to_end(key)
+        while len(self._sizes) > self.max_entries:
+            evicted, _ = self._sizes.popitem(last=False)
+            self._unlink(evicted)
+
+    def dir_size(self, path, check=None):
+        # check, if given, is called between directories and may raise to
+        # abandon the walk (totals found so far stay cached)
+        key = _key(path)
+        now = time.time()
+        with self._lock:
+            total = self._lookup(key, now)
+            if total is not None:
+                self.hits += 1
+                return total
+            self.misses += 1
+        return self._compute(key, now, check)
+
+    def cached_size(self, path):
+        # Bytes held by a file or symlink, or by a directory tree whose total
+        # is cached; None for a directory that would have to be walked
+        if os.path.isdir(path) and not os.path.islink(path):
+            with self._lock:
+                return self._lookup(_key(path), time.time())
+        try:
+            return os.lstat(path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def _compute(self, root, now, check=None):
+        # Iterative post-order walk with os.scandir; subdirectories that are
+        # already cached are not descended into, and every total found on the
+        # way is cached so later du calls on subtrees are O(1) as well
+        own = {}
+        children = {}
+        result = 0
+        stack = [(root, False)]
+        while stack:
+            path, expanded = stack.pop()
+            if expanded:
+                total = own.pop(path) + sum(children.pop(path))
+                with self._lock:
+                    self._store(path, total, now)
+                if path == root:
+                    result = total
+                else:
+                    children[os.path.dirname(path)].append(total)
+                continue
+            if path != root:
+                with self._lock:
+                    cached = self._lookup(path, now)
+                if cached is not None:
+                    children[os.path.dirname(path)].append(cached)
+                    continue
+            if check is not None:
+                check()
+            files = 0
+            subdirs = []
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.path)
+                            else:
+                                files += entry.stat(follow_symlinks=False).st_size
+                        except OSError:
+                            continue
+            except OSError:
+                pass
+            own[path] = files
+            children[path] = []
+            stack.append((path, True))
+            stack.extend((sub, False) for sub in subdirs)
+        return result
+
+    def adjust(self, path, delta):
+        # path gained (or lost, if negative) delta bytes: update cached ancestors
+        self._notify(path, False)
+        if not delta:
+            return
+        key = _key(path)
+        with self._lock:
+            parent = os.path.dirname(key)
+            while True:
+                entry = self._sizes.get(parent)
+                if entry is not None:
+                    self._sizes[parent] = (entry[0] + delta, entry[1])
+                grandparent = os.path.dirname(parent)
+                if grandparent == parent:
+                    break
+                parent = grandparent
+
+    def resized(self, path):
+        # path changed size by an amount nobody measured: drop the totals of
+        # its ancestors, which the next du recomputes from the cached subtrees
+        self._notify(path, False)
+        key = _key(path)
+        with self._lock:
+            parent = os.path.dirname(key)
+            while True:
+                self._drop(parent)
+                grandparent = os.path.dirname(parent)
+                if grandparent == parent:
+                    break
+                parent = grandparent
+
+    def created_dir(self, path):
+        with self._lock:
+            self._store(_key(path), 0, time.time())
+        self._notify(path, True)
+
+    def changed(self, path):
+        # path was created or modified without changing any totals (touch)
+        self._notify(path, False)
+
+    def forget(self, path):
+        # Drop cached totals for path and everything below it
+        key = _key(path)
+        with self._lock:
+            stack = [key]
+            while stack:
+                cached = stack.pop()
+                self._sizes.pop(cached, None)
+                stack.extend(self._children.pop(cached, ()))
+            self._unlink(key)
+        self._notify(path, True)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._sizes), "hits": self.hits, "misses": self.misses}
+
+
+# Shared by every session, since they all work under the same terminal_root
+index = DirSizeIndex()
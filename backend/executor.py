@@ -0,0 +1,245 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.concurrency import run_in_threadpool
+
+from metrics import metrics
+from results import results, StoredResult
+
+# Threads for heavy commands, and how many heavy commands may wait for one
+# before new ones are turned away
+HEAVY_WORKERS = int(os.environ.get("TERMINAL_HEAVY_WORKERS", str(min(8, (os.cpu_count() or 1) + 2))))
+HEAVY_QUEUE_LIMIT = int(os.environ.get("TERMINAL_HEAVY_QUEUE", "64"))
+
+# How often a running command checks whether its client went away
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Batching for streamed output (/execute/stream and /ws)
+STREAM_BATCH_LINES = 1000
+STREAM_BATCH_BYTES = 64 * 1024
+
+
+def batch_lines(lines, max_lines=STREAM_BATCH_LINES, max_bytes=STREAM_BATCH_BYTES):
+    # Group streamed lines into batches; the first line is flushed on its own
+    # so the client sees output immediately
+    batch, size, first = [], 0, True
+    for line in lines:
+        batch.append(line)
+        size += len(line)
+        if first or len(batch) >= max_lines or size >= max_bytes:
+            yield batch
+            batch, size, first = [], 0, False
+    if batch:
+        yield batch
+
+
+class ExecutorBusy(Exception):
+    pass
+
+
+class CommandTimeout(Exception):
+    # job is the abandoned worker, which runs on until its next cancellation
+    # check; it is done once the command has really stopped
+    def __init__(self, timeout, job=None):
+        super().__init__(f"command timed out after {timeout:g}s")
+        self.timeout = timeout
+        self.job = job
+
+
+class CommandCancelled(Exception):
+    def __init__(self, job=None):
+        super().__init__()
+        self.job = job
+
+
+# The cancel event of the command this thread is running, for handlers that
+# can spend a long time between output lines (an awk loop)
+_current = threading.local()
+
+
+def current_cancel():
+    return getattr(_current, "cancel", None)
+
+
+def check_cancelled():
+    # For handlers that do a lot of work per output line: raise if the
+    # command running on this thread has been given up on
+    cancel = getattr(_current, "cancel", None)
+    if cancel is not None and cancel.is_set():
+        raise CommandCancelled()
+
+
+class CommandExecutor:
+    # Cheap commands run on Starlette's request threadpool; heavy ones on a
+    # dedicated bounded pool so a big du/cp/sort can't starve /health or
+    # /autocomplete. Both are driven through processor.stream(), which lets a
+    # timeout or client disconnect stop the work between output lines;
+    # handlers that work long between lines call check_cancelled().
+
+    def __init__(self, workers=HEAVY_WORKERS, max_queue=HEAVY_QUEUE_LIMIT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="heavy")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    def _collect(self, processor, cmd, cancel, sink=None, budget=None, owner=None):
+        # Gather the whole output, or hand it to sink batch by batch (the
+        # sink may block, which throttles the command to the client's pace).
+        # Output past budget bytes is spooled to the result cache instead,
+        # and the StoredResult is returned in place of the text. Returns
+        # (output, failed), the status read on this thread as the line ends.
+        _current.cancel = cancel
+        # A sampled profile covers the whole line and is stopped on this
+        # same thread, however the stages hand lines to each other
+        profile = metrics.profiler.start(processor.command_names(cmd)) if metrics.profiler.wanted() else None
+        try:
+            if sink is not None:
+                for batch in batch_lines(processor.stream(cmd)):
+                    if cancel.is_set():
+                        raise CommandCancelled()
+                    sink(batch)
+                return "", processor.failed
+            output = self._gather(processor, cmd, cancel, budget, owner)
+            return output, processor.failed
+        finally:
+            metrics.profiler.stop(profile)
+            _current.cancel = None
+
+    def _gather(self, processor, cmd, cancel, budget, owner):
+        chunks = []
+        size = 0
+        stored = None
+        lines = processor.stream(cmd, allow_follow=False)
+        try:
+            for chunk in lines:
+                if cancel.is_set():
+                    raise CommandCancelled()
+                if stored is not None:
+                    if not stored.write(chunk):
+                        break
+                    continue
+                chunks.append(chunk)
+                size += len(chunk) + 1
+                if budget is not None and size > budget:
+                    stored = StoredResult(owner)
+                    for pending in chunks:
+                        stored.write(pending)
+                    chunks = None
+        except BaseException:
+            if stored is not None:
+                stored.close()
+            raise
+        finally:
+            lines.close()
+        if stored is not None:
+            return results.add(stored)
+        return "\n".join(chunks)
+
+    def _run_heavy(self, processor, cmd, cancel, sink, budget, owner):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            if cancel.is_set():
+                raise CommandCancelled()
+            return self._collect(processor, cmd, cancel, sink, budget, owner)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    async def _wait_for_disconnect(self, request):
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+    async def run(self, processor, cmd, request=None, sink=None, budget=None, owner=None):
+        # Returns (output, failed) for cmd; failed is its own exit status,
+        # unaffected by other commands running on the same processor
+        cancel = threading.Event()
+        timeout = processor.timeout_for(cmd, follow=sink is not None)
+        pending = None
+        if processor.classify(cmd) == "heavy":
+            with self._lock:
+                if self.queued >= self.max_queue:
+                    self.rejected += 1
+                    raise ExecutorBusy("too many heavy commands queued, try again shortly")
+                self.queued += 1
+            pending = self._pool.submit(self._run_heavy, processor, cmd, cancel, sink, budget, owner)
+            job = asyncio.wrap_future(pending)
+        else:
+            job = asyncio.ensure_future(run_in_threadpool(self._collect, processor, cmd, cancel, sink, budget, owner))
+
+        waiters = {job}
+        watcher = None
+        if request is not None:
+            watcher = asyncio.ensure_future(self._wait_for_disconnect(request))
+            waiters.add(watcher)
+        try:
+            try:
+                done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError as e:
+                # The caller itself went away (a closed stream or socket). The
+                # worker runs on until its next cancellation check, so the job
+                # rides along for the caller to hold its slot until then
+                cancel.set()
+                job.add_done_callback(lambda f: f.cancelled() or f.exception())
+                if pending is not None and pending.cancel():
+                    with self._lock:
+                        self.queued -= 1
+                e.job = job
+                raise
+            if job in done:
+                try:
+                    result = job.result()
+                except Exception:
+                    with self._lock:
+                        self.failed += 1
+                    raise
+                with self._lock:
+                    self.completed += 1
+                return result
+
+            # Timed out or the client left: tell the worker to stop, and drop
+            # the job outright if it never left the queue
+            cancel.set()
+            # The abandoned job still finishes (or raises) later; consume its result
+            job.add_done_callback(lambda f: f.cancelled() or f.exception())
+            if pending is not None and pending.cancel():
+                with self._lock:
+                    self.queued -= 1
+            if watcher is not None and watcher in done:
+                with self._lock:
+                    self.cancelled += 1
+                raise CommandCancelled(job)
+            with self._lock:
+                self.timed_out += 1
+            raise CommandTimeout(timeout, job)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "timed_out": self.timed_out,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+            }
+
+
+# Shared executor used by the API
+executor = CommandExecutor()
@@ -0,0 +1,186 @@
+import heapq
+import os
+import re
+import tempfile
+
+# In-memory budget for one sort before runs are spilled to temp files
+SORT_MEMORY_BUDGET = int(os.environ.get("TERMINAL_SORT_MEMORY", str(64 * 1024 * 1024)))
+
+# Most runs merged in a single pass; more than this are merged in rounds
+SORT_MAX_MERGE = 64
+
+# Rough per-line overhead of a Python str in a list, used to estimate memory
+LINE_OVERHEAD = 64
+
+SIZE_SUFFIXES = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+NUMBER_RE = re.compile(r"\s*([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)")
+
+USAGE = "Usage: sort [-n] [-r] [-u] [-k N[,M]] [-t SEP] [-S SIZE] <file>"
+
+
+class SortOptions:
+    __slots__ = ("numeric", "reverse", "unique", "key_start", "key_end", "separator", "memory")
+
+    def __init__(self):
+        self.numeric = False
+        self.reverse = False
+        self.unique = False
+        self.key_start = None
+        self.key_end = None
+        self.separator = None
+        self.memory = SORT_MEMORY_BUDGET
+
+
+def parse_size(value):
+    value = value.strip().lower()
+    unit = 1
+    if value and value[-1] in SIZE_SUFFIXES:
+        unit = SIZE_SUFFIXES[value[-1]]
+        value = value[:-1]
+    if not value.isdigit() or int(value) <= 0:
+        raise ValueError(f"sort: invalid buffer size: '{value}'")
+    return int(value) * unit
+
+
+def parse_args(args):
+    # Returns (options, operands); raises ValueError on bad usage
+    options = SortOptions()
+    operands = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "-" or not arg.startswith("-"):
+            operands.append(arg)
+            i += 1
+            continue
+        flag, value = arg[1], arg[2:]
+        if flag in ("k", "t", "S"):
+            if not value:
+                if i + 1 >= len(args):
+                    raise ValueError(f"sort: option requires an argument -- '{flag}'")
+                value = args[i + 1]
+                i += 1
+            if flag == "k":
+                start, _, end = value.partition(",")
+                if not start.isdigit() or int(start) < 1 or (end and (not end.isdigit() or int(end) < int(start))):
+                    raise ValueError(f"sort: invalid key: '{value}'")
+                options.key_start = int(start)
+                options.key_end = int(end) if end else None
+            elif flag == "t":
+                options.separator = value
+            else:
+                # -S can only shrink the budget, never switch spilling off
+                options.memory = min(parse_size(value), SORT_MEMORY_BUDGET)
+        else:
+            for flag in arg[1:]:
+                if flag == "n":
+                    options.numeric = True
+                elif flag == "r":
+                    options.reverse = True
+                elif flag == "u":
+                    options.unique = True
+                else:
+                    raise ValueError(f"sort: invalid option -- '{flag}'")
+        i += 1
+    return options, operands
+
+
+def make_key(options):
+    start, end, sep = options.key_start, options.key_end, options.separator
+
+    def field_key(line):
+        if start is None:
+            return line
+        fields = line.split(sep) if sep is not None else line.split()
+        selected = fields[start - 1:end]
+        joiner = sep if sep is not None else " "
+        return joiner.join(selected)
+
+    if not options.numeric:
+        return field_key
+
+    def numeric_key(line):
+        # Like sort -n: use the leading number, anything else sorts as 0
+        match = NUMBER_RE.match(field_key(line))
+        return float(match.group(1)) if match else 0.0
+
+    return numeric_key
+
+
+def make_order(options, key):
+    # Sort order: lines with equal keys fall back to comparing the whole
+    # line, as sort does, so in-memory and merged output agree. With -u the
+    # key alone decides and the first line of each run of equals is kept.
+    if options.unique or (options.key_start is None and not options.numeric):
+        return key
+    return lambda line: (key(line), line)
+
+
+def _write_run(lines):
+    # newline="\n" so a "\r" inside a line doesn't split it when read back
+    run = tempfile.TemporaryFile(
+        mode="w+", encoding="utf-8", errors="surrogateescape", newline="\n", prefix="sort-",
+    )
+    for line in lines:
+        run.write(line)
+        run.write("\n")
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    for line in run:
+        yield line[:-1]
+
+
+def _merge(runs, key, reverse):
+    return heapq.merge(*(_read_run(run) for run in runs), key=key, reverse=reverse)
+
+
+def sort_lines(lines, options):
+    # Sort an iterable of lines within options.memory bytes, spilling sorted
+    # runs to temp files and k-way merging them when the input is larger
+    key = make_key(options)
+    order = make_order(options, key)
+    runs = []
+    try:
+        chunk, used = [], 0
+        for line in lines:
+            chunk.append(line)
+            used += len(line) + LINE_OVERHEAD
+            if used >= options.memory:
+                chunk.sort(key=order, reverse=options.reverse)
+                runs.append(_write_run(chunk))
+                chunk, used = [], 0
+        chunk.sort(key=order, reverse=options.reverse)
+
+        if not runs:
+            merged = iter(chunk)
+        else:
+            if chunk:
+                runs.append(_write_run(chunk))
+            chunk = None
+            # Cap the fan-in so a huge input can't exhaust file descriptors.
+            # A merged batch takes the place of its runs, keeping runs in
+            # input order so equal lines stay in order too
+            while len(runs) > SORT_MAX_MERGE:
+                batch = runs[:SORT_MAX_MERGE]
+                runs = [_write_run(_merge(batch, order, options.reverse))] + runs[SORT_MAX_MERGE:]
+                for run in batch:
+                    run.close()
+            merged = _merge(runs, order, options.reverse)
+
+        if not options.unique:
+            yield from merged
+            return
+        previous = object()
+        for line in merged:
+            current = key(line)
+            if current != previous:
+                yield line
+                previous = current
+    finally:
+        for run in runs:
+            run.close()
+
@@ -0,0 +1,173 @@
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+from metrics import metrics
+
+# Memory for cached file contents plus line indexes, and the largest file
+# that is cached at all (bigger files keep streaming from disk)
+FILE_CACHE_BYTES = int(os.environ.get("TERMINAL_FILE_CACHE", str(256 * 1024 * 1024)))
+FILE_CACHE_MAX_FILE = int(os.environ.get("TERMINAL_FILE_CACHE_MAX_FILE", str(32 * 1024 * 1024)))
+
+# Lines decoded per slice when iterating; starts small so head stays cheap
+FIRST_SLICE_LINES = 64
+MAX_SLICE_LINES = 8192
+
+
+def file_key(st):
+    # The version of a file that a cached copy belongs to
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class CachedFile:
+    # A file's bytes plus the offset of every line start (and a final end
+    # sentinel), so line ranges are a slice away. key is
+    # (mtime_ns, size, inode); any change to the file makes it stale.
+    __slots__ = ("key", "data", "offsets", "_counts")
+
+    def __init__(self, key, data):
+        self.key = key
+        self.data = data
+        offsets = array("I", [0])
+        pos = data.find(b"\n")
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = data.find(b"\n", pos + 1)
+        if offsets[-1] != len(data):
+            offsets.append(len(data))
+        self.offsets = offsets
+        self._counts = None
+
+    @property
+    def line_count(self):
+        return len(self.offsets) - 1
+
+    @property
+    def memory(self):
+        return len(self.data) + self.offsets.itemsize * len(self.offsets)
+
+    def iter_lines(self, start=0, stop=None, max_length=None):
+        # Decoded lines start..stop-1 without line endings; lines longer than
+        # max_length are split, like a bounded readline()
+        total = self.line_count
+        stop = total if stop is None else min(stop, total)
+        data, offsets = self.data, self.offsets
+        i = max(0, start)
+        step = FIRST_SLICE_LINES
+        while i < stop:
+            j = min(stop, i + step)
+            text = data[offsets[i]:offsets[j]].decode("utf-8", errors="replace")
+            parts = text.split("\n")
+            if text.endswith("\n"):
+                parts.pop()
+            for line in parts:
+                line = line.rstrip("\r")
+                if max_length is not None and len(line) > max_length:
+                    for k in range(0, len(line), max_length):
+                        yield line[k:k + max_length]
+                else:
+                    yield line
+            i = j
+            step = min(step * 2, MAX_SLICE_LINES)
+
+    def counts(self):
+        # (lines, words, chars) as wc reports them; computed once per version
+        if self._counts is None:
+            text = self.data.decode("utf-8", errors="replace")
+            self._counts = (self.line_count, len(text.split()), len(text))
+        return self._counts
+
+
+class FileCache:
+    # LRU of CachedFile by real path, bounded by total memory. Entries are
+    # revalidated with one stat per lookup, and mutating commands call
+    # invalidate() so replaced files free their memory straight away.
+
+    def __init__(self, max_bytes=FILE_CACHE_BYTES, max_file=FILE_CACHE_MAX_FILE):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, path, load=True, command=None):
+        # The cached file, loading it if load is set and it's small enough;
+        # None if the file is missing, too big, or uncached and load is off
+        path = os.path.realpath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = file_key(st)
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is not None and entry.key == key:
+                self._files.move_to_end(path)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        if not load or not self.fits(st.st_size):
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        metrics.add_read(len(data), command)
+        return self.add(path, key, data)
+
+    def fits(self, size):
+        # Whether a file of size bytes is small enough to cache
+        return size <= self.max_file and size <= self.max_bytes
+
+    def add(self, path, key, data):
+        # Cache data, read from path at version key; for readers that stream
+        # the file anyway and keep its bytes as they go. Returns the entry,
+        # or None if the file changed while it was read.
+        if len(data) != key[1]:
+            return None
+        path = os.path.realpath(path)
+        entry = CachedFile(key, data)
+        with self._lock:
+            old = self._files.pop(path, None)
+            if old is not None:
+                self.memory -= old.memory
+            self._files[path] = entry
+            self.memory += entry.memory
+            self.loads += 1
+            while self.memory > self.max_bytes and len(self._files) > 1:
+                _, evicted = self._files.popitem(last=False)
+                self.memory -= evicted.memory
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, path):
+        # Drop path, or everything under it if it's a directory
+        path = os.path.realpath(path)
+        prefix = path + os.sep
+        with self._lock:
+            for cached in [p for p in self._files if p == path or p.startswith(prefix)]:
+                self.memory -= self._files.pop(cached).memory
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self._files),
+                "memory": self.memory,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+# Shared by every session, since they all read the same terminal_root
+cache = FileCache()
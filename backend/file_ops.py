@@ -0,0 +1,267 @@
+import errno
+import os
+import shutil
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Threads shared by cp -r / mv / rm -r; the work is mostly syscalls waiting
+# on the disk, so this can exceed the core count
+FILE_OP_WORKERS = int(os.environ.get("TERMINAL_FILE_OP_WORKERS", str(min(16, (os.cpu_count() or 1) * 4))))
+
+# Small files are handed to workers in batches to keep per-task overhead down
+FILE_BATCH_COUNT = 64
+FILE_BATCH_BYTES = 64 * 1024 * 1024
+
+# Largest single kernel copy call and userspace read, and how often a long
+# operation reports
+KERNEL_COPY_CHUNK = 64 * 1024 * 1024
+USER_COPY_CHUNK = 1024 * 1024
+PROGRESS_INTERVAL = 5.0
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Set once copy_file_range/sendfile turn out to be unsupported here
+_no_copy_file_range = not hasattr(os, "copy_file_range")
+_no_sendfile = not hasattr(os, "sendfile")
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=FILE_OP_WORKERS, thread_name_prefix="fileop")
+        return _executor
+
+
+def format_bytes(n):
+    for unit in ("B", "K", "M", "G", "T"):
+        if n < 1024 or unit == "T":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+
+
+class OpStats:
+    __slots__ = ("files", "dirs", "bytes", "replaced", "errors", "started")
+
+    def __init__(self):
+        self.files = 0
+        self.dirs = 0
+        self.bytes = 0
+        self.replaced = 0  # bytes of destination files that were overwritten
+        self.errors = []
+        self.started = time.monotonic()
+
+    def merge(self, other):
+        self.files += other.files
+        self.dirs += other.dirs
+        self.bytes += other.bytes
+        self.replaced += other.replaced
+        self.errors.extend(other.errors)
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        dirs = f", {self.dirs} directories" if self.dirs else ""
+        return f"{self.files} files{dirs}, {format_bytes(self.bytes)} in {elapsed:.2f}s"
+
+
+def _kernel_copy(src_fd, dst_fd, size):
+    # copy_file_range keeps data in the kernel (and can reflink on btrfs/xfs);
+    # sendfile picks up where it stops. Returns bytes copied, which is short
+    # of size when neither works here or both give up early (some
+    # filesystems answer 0 for files they can't copy); the caller copies the
+    # rest in userspace. Both leave dst_fd's offset at the bytes copied.
+    global _no_copy_file_range, _no_sendfile
+    copied = 0
+    if not _no_copy_file_range:
+        try:
+            while copied < size:
+                n = os.copy_file_range(src_fd, dst_fd, min(KERNEL_COPY_CHUNK, size - copied))
+                if n == 0:
+                    break
+                copied += n
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP) or copied:
+                raise
+            if e.errno in (errno.ENOSYS, errno.EOPNOTSUPP):
+                _no_copy_file_range = True
+    if copied < size and not _no_sendfile:
+        start = copied
+        try:
+            while copied < size:
+                n = os.sendfile(dst_fd, src_fd, copied, min(KERNEL_COPY_CHUNK, size - copied))
+                if n == 0:
+                    break
+                copied += n
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EINVAL) or copied > start:
+                raise
+            _no_sendfile = True
+    return copied
+
+
+def copy_file(src, dst):
+    # Copy contents and permission bits; returns bytes copied
+    with open(src, "rb") as fsrc:
+        st = os.fstat(fsrc.fileno())
+        with open(dst, "wb") as fdst:
+            copied = _kernel_copy(fsrc.fileno(), fdst.fileno(), st.st_size) if st.st_size else 0
+            if copied < st.st_size or not st.st_size:
+                # Whatever the kernel didn't copy (and files like /proc's that
+                # report no size), read through to EOF
+                fsrc.seek(copied)
+                for chunk in iter(lambda: fsrc.read(USER_COPY_CHUNK), b""):
+                    fdst.write(chunk)
+                    copied += len(chunk)
+    os.chmod(dst, stat.S_IMODE(st.st_mode))
+    return copied
+
+
+def _scan(path):
+    # (subdirectory names, [(name, size, is_symlink)]) for one directory
+    dirs, files = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.name)
+            else:
+                # lstat sizes, matching how dir_index totals count symlinks
+                files.append((entry.name, entry.stat(follow_symlinks=False).st_size, entry.is_symlink()))
+    return dirs, files
+
+
+def _batches(files):
+    batch, size = [], 0
+    for item in files:
+        batch.append(item)
+        size += item[1]
+        if len(batch) >= FILE_BATCH_COUNT or size >= FILE_BATCH_BYTES:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def _drive(first, stats, cancel, verb):
+    # Run tasks on the pool; each task returns (OpStats, [follow-up tasks]).
+    # Yields a progress line every PROGRESS_INTERVAL seconds so the caller
+    # can be stopped; closing the generator stops new tasks from starting.
+    pool = _get_executor()
+    futures = {pool.submit(*first)}
+    last = time.monotonic()
+    try:
+        while futures:
+            done, futures = wait(futures, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                result, follow_ups = future.result()
+                stats.merge(result)
+                for task in follow_ups:
+                    futures.add(pool.submit(*task))
+            if time.monotonic() - last >= PROGRESS_INTERVAL:
+                last = time.monotonic()
+                yield f"{verb} {stats.files} files, {format_bytes(stats.bytes)} so far..."
+    finally:
+        cancel.set()
+        for future in futures:
+            future.cancel()
+
+
+# ---------- copy ----------
+
+def _copy_batch(src_dir, dst_dir, batch, cancel):
+    result = OpStats()
+    for name, size, is_link in batch:
+        if cancel.is_set():
+            break
+        src, dst = os.path.join(src_dir, name), os.path.join(dst_dir, name)
+        try:
+            if os.path.lexists(dst):
+                if os.path.isfile(dst) and not os.path.islink(dst):
+                    result.replaced += os.path.getsize(dst)
+                if is_link:
+                    os.unlink(dst)
+            if is_link:
+                os.symlink(os.readlink(src), dst)
+                result.bytes += os.lstat(dst).st_size
+            else:
+                result.bytes += copy_file(src, dst)
+            result.files += 1
+        except OSError as e:
+            result.errors.append(f"cannot copy '{src}': {e.strerror or e}")
+    return result, []
+
+
+def _copy_dir(src, dst, cancel):
+    result = OpStats()
+    if cancel.is_set():
+        return result, []
+    try:
+        if not os.path.isdir(dst):
+            os.mkdir(dst)
+            shutil.copymode(src, dst)
+        result.dirs += 1
+        dirs, files = _scan(src)
+    except OSError as e:
+        result.errors.append(f"cannot copy '{src}': {e.strerror or e}")
+        return result, []
+    tasks = [(_copy_dir, os.path.join(src, name), os.path.join(dst, name), cancel) for name in dirs]
+    tasks.extend((_copy_batch, src, dst, batch, cancel) for batch in _batches(files))
+    return result, tasks
+
+
+def copy_tree(src, dst, stats):
+    # Generator: copy directory src to dst (merging into dst if it exists)
+    # across the pool; progress lines are yielded, totals land in stats
+    cancel = threading.Event()
+    yield from _drive((_copy_dir, src, dst, cancel), stats, cancel, "copied")
+
+
+# ---------- remove ----------
+
+def _remove_batch(directory, batch, cancel):
+    result = OpStats()
+    for name, size, _ in batch:
+        if cancel.is_set():
+            break
+        path = os.path.join(directory, name)
+        try:
+            os.unlink(path)
+            result.files += 1
+            result.bytes += size
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            result.errors.append(f"cannot remove '{path}': {e.strerror or e}")
+    return result, []
+
+
+def _remove_dir(path, found, cancel):
+    # Unlink this directory's files (in batches) and queue its subdirectories;
+    # the directories themselves are removed afterwards, deepest first
+    result = OpStats()
+    if cancel.is_set():
+        return result, []
+    try:
+        dirs, files = _scan(path)
+    except OSError as e:
+        result.errors.append(f"cannot remove '{path}': {e.strerror or e}")
+        return result, []
+    found.append(path)
+    tasks = [(_remove_dir, os.path.join(path, name), found, cancel) for name in dirs]
+    tasks.extend((_remove_batch, path, batch, cancel) for batch in _batches(files))
+    return result, tasks
+
+
+def remove_tree(path, stats):
+    # Generator: rm -r path using the pool for the file unlinks
+    cancel = threading.Event()
+    found = []
+    yield from _drive((_remove_dir, path, found, cancel), stats, cancel, "removed")
+    for directory in sorted(found, key=lambda p: p.count(os.sep), reverse=True):
+        try:
+            os.rmdir(directory)
+            stats.dirs += 1
+        except OSError as e:
+            stats.errors.append(f"cannot remove '{directory}': {e.strerror or e}")
@@ -0,0 +1,198 @@
+import fnmatch
+import os
+import re
+import time
+
+import name_index
+from pipeline import Diagnostic
+
+# -size units in bytes; a bare number counts 512-byte blocks, as in find
+SIZE_UNITS = {"c": 1, "w": 2, "b": 512, "k": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+SIZE_ARG = re.compile(r"([+-]?)(\d+)([cwbkMG]?)$")
+NUMERIC_ARG = re.compile(r"([+-]?)(\d+)$")
+
+# Tests that take a value; -print is accepted and ignored
+VALUE_TESTS = frozenset({"-name", "-iname", "-type", "-size", "-mtime", "-maxdepth", "-mindepth"})
+
+
+class FindQuery:
+    # The tests of one find command, all of which must hold (find's implicit -a)
+    __slots__ = ("names", "types", "sizes", "mtimes", "maxdepth", "mindepth", "now")
+
+    def __init__(self):
+        self.names = []  # (pattern, regex, ignore_case)
+        self.types = None
+        self.sizes = []  # (sign, amount, unit bytes)
+        self.mtimes = []  # (sign, days)
+        self.maxdepth = None
+        self.mindepth = 0
+        self.now = time.time()
+
+    def needs_stat(self):
+        return bool(self.sizes or self.mtimes)
+
+    def cheap_match(self, name, kind):
+        # The tests answered from a directory listing alone
+        if self.types is not None and kind not in self.types:
+            return False
+        for _, regex, _ in self.names:
+            if not regex.match(name):
+                return False
+        return True
+
+    def stat_match(self, st):
+        for sign, amount, unit in self.sizes:
+            if not _compare(sign, -(-st.st_size // unit), amount):
+                return False
+        for sign, days in self.mtimes:
+            if not _compare(sign, int((self.now - st.st_mtime) // 86400), days):
+                return False
+        return True
+
+
+def _compare(sign, value, amount):
+    if sign == "+":
+        return value > amount
+    if sign == "-":
+        return value < amount
+    return value == amount
+
+
+def parse_args(args):
+    # Returns (starting points, FindQuery); raises ValueError on bad usage
+    starts = []
+    i = 0
+    while i < len(args) and not args[i].startswith("-"):
+        starts.append(args[i])
+        i += 1
+    query = FindQuery()
+    while i < len(args):
+        arg = args[i]
+        if arg == "-print":
+            i += 1
+            continue
+        if arg not in VALUE_TESTS:
+            if not arg.startswith("-"):
+                raise ValueError(f"find: paths must precede expression: '{arg}'")
+            raise ValueError(f"find: unknown predicate '{arg}'")
+        if i + 1 >= len(args):
+            raise ValueError(f"find: missing argument to '{arg}'")
+        value = args[i + 1]
+        i += 2
+        if arg in ("-name", "-iname"):
+            ignore_case = arg == "-iname"
+            regex = re.compile(fnmatch.translate(value), re.IGNORECASE if ignore_case else 0)
+            query.names.append((value, regex, ignore_case))
+        elif arg == "-type":
+            types = set(value.split(","))
+            for kind in types:
+                if kind not in ("f", "d", "l"):
+                    raise ValueError(f"find: unknown argument to -type: {kind}")
+            query.types = types if query.types is None else query.types & types
+        elif arg == "-size":
+            match = SIZE_ARG.match(value)
+            if match is None:
+                raise ValueError(f"find: invalid argument '{value}' to '-size'")
+            sign, amount, unit = match.groups()
+            query.sizes.append((sign, int(amount), SIZE_UNITS[unit or "b"]))
+        elif arg == "-mtime":
+            match = NUMERIC_ARG.match(value)
+            if match is None:
+                raise ValueError(f"find: invalid argument '{value}' to '-mtime'")
+            query.mtimes.append((match.group(1), int(match.group(2))))
+        else:
+            if not value.isdigit():
+                raise ValueError(f"find: invalid argument '{value}' to '{arg}'")
+            if arg == "-maxdepth":
+                query.maxdepth = int(value)
+            else:
+                query.mindepth = int(value)
+    return starts or ["."], query
+
+
+def _inside(path, root):
+    real = os.path.realpath(path)
+    return real == root or real.startswith(root + os.sep)
+
+
+def _indexed(top, root, query):
+    # Matches below top from the filename index, in walk order, or None if
+    # the index is off, still building, or doesn't cover top
+    if not query.names or not name_index.index.ready(root):
+        return None
+    pattern, regex, ignore_case = query.names[0]
+    found = name_index.index.search(top, pattern, regex, ignore_case)
+    if found is None:
+        return None
+    # Breadth-first and sorted within each directory, like walk(); only the
+    # directories holding a match need ordering
+    matches = []
+    for directory in sorted(found, key=lambda d: (d.count(os.sep), d.split(os.sep))):
+        depth = directory[len(top):].count(os.sep) + 1
+        if depth < query.mindepth or (query.maxdepth is not None and depth > query.maxdepth):
+            continue
+        for name, kind in sorted(found[directory]):
+            if not query.cheap_match(name, kind):
+                continue
+            path = directory + os.sep + name
+            if query.needs_stat():
+                try:
+                    if not query.stat_match(os.lstat(path)):
+                        continue
+                except OSError:
+                    continue
+            matches.append((path, name, kind, depth, None))
+    return matches
+
+
+def _walked(top, query):
+    needs_stat = query.needs_stat()
+    for path, name, kind, depth, st in name_index.walk(top, query.maxdepth, query.cheap_match, needs_stat):
+        if name is None:
+            yield path, None, None, depth, st
+        elif depth >= query.mindepth and (not needs_stat or query.stat_match(st)):
+            yield path, name, kind, depth, None
+
+
+def find(args, cwd, root):
+    # Generator of output lines; returns find's exit status, 1 if any
+    # operand or directory could not be read
+    try:
+        starts, query = parse_args(args)
+    except ValueError as e:
+        yield Diagnostic(str(e))
+        return 1
+    root = os.path.realpath(root)
+    status = 0
+    for operand in starts:
+        top = os.path.join(cwd, operand)
+        try:
+            st = os.lstat(top)
+        except OSError:
+            yield Diagnostic(f"find: '{operand}': No such file or directory")
+            status = 1
+            continue
+        if not _inside(top, root):
+            yield Diagnostic(f"find: '{operand}': outside the terminal root")
+            status = 1
+            continue
+        kind = name_index.mode_kind(st.st_mode)
+        base = os.path.basename(operand.rstrip("/")) or operand
+        if query.mindepth == 0 and query.cheap_match(base, kind) and (not query.needs_stat() or query.stat_match(st)):
+            yield operand
+        if kind != "d" or query.maxdepth == 0:
+            continue
+        # Paths below are shown under the operand as typed
+        top = os.path.realpath(top)
+        prefix = operand if operand.endswith("/") else operand + "/"
+        results = _indexed(top, root, query)
+        if results is None:
+            results = _walked(top, query)
+        for path, name, _, _, error in results:
+            shown = prefix + path[len(top) + 1:] if path != top else operand
+            if error is not None:
+                yield Diagnostic(f"find: '{shown}': {error.strerror or error}")
+                status = 1
+            else:
+                yield shown
+    return status
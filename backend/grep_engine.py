@@ -0,0 +1,299 @@
+import mmap
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+from pipeline import Diagnostic
+import file_cache
+
+# Files at least this large are scanned through mmap instead of being read into memory
+MMAP_THRESHOLD = 1024 * 1024
+
+# Total matching lines a single grep may return before output is truncated
+MAX_RESULTS = 10000
+
+# Worker threads shared by all recursive searches, and how many files each
+# search keeps in flight at once
+GREP_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+GREP_INFLIGHT = GREP_WORKERS * 4
+
+# Lookaround can see past the end of a line even when the match itself doesn't
+LOOKAROUND = (b"(?=", b"(?!", b"(?<")
+
+USAGE = "Usage: grep [-E] [-i] [-c] [-l] [-r] [-m N] <pattern> [file...]"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=GREP_WORKERS, thread_name_prefix="grep")
+        return _executor
+
+
+class GrepOptions:
+    __slots__ = ("regex", "ignore_case", "count", "files_only", "recursive", "max_count", "line_numbers")
+
+    def __init__(self):
+        self.regex = False
+        self.ignore_case = False
+        self.count = False
+        self.files_only = False
+        self.recursive = False
+        self.max_count = None
+        self.line_numbers = False
+
+
+def parse_args(args):
+    # Returns (options, pattern, operands); raises ValueError on bad usage
+    options = GrepOptions()
+    positional = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "--":
+            positional.extend(args[i + 1:])
+            break
+        if positional or arg == "-" or not arg.startswith("-"):
+            positional.append(arg)
+        elif arg.startswith("-m"):
+            value = arg[2:] or (args[i + 1] if i + 1 < len(args) else "")
+            if not arg[2:]:
+                i += 1
+            if not value.isdigit():
+                raise ValueError(f"grep: invalid max count: '{value}'")
+            options.max_count = int(value)
+        else:
+            for flag in arg[1:]:
+                if flag == "E":
+                    options.regex = True
+                elif flag == "i":
+                    options.ignore_case = True
+                elif flag == "c":
+                    options.count = True
+                elif flag == "l":
+                    options.files_only = True
+                elif flag in ("r", "R"):
+                    options.recursive = True
+                elif flag == "n":
+                    options.line_numbers = True
+                else:
+                    raise ValueError(f"grep: invalid option -- '{flag}'")
+        i += 1
+    if not positional:
+        raise ValueError(USAGE)
+    return options, positional[0], positional[1:]
+
+
+def compile_pattern(pattern, options, text=False):
+    # Byte patterns for scanning files; text=True for lines from a pipeline
+    source = pattern if text else pattern.encode()
+    if not options.regex:
+        source = re.escape(source)
+    flags = re.MULTILINE
+    if options.ignore_case:
+        flags |= re.IGNORECASE
+    return re.compile(source, flags)
+
+
+def scan_buffer(buffer, regex, limit, stop=None):
+    # Yield (line_number, line_bytes) for each matching line. Line numbers are
+    # counted incrementally between matches so the buffer is never split.
+    # \s, \W or [^x] can match a newline, so a match running into the next
+    # line is re-checked against its own line alone, as grep sees it.
+    pos = 0
+    line_no = 1
+    counted_to = 0
+    found = 0
+    size = len(buffer)
+    # A final newline ends the last line rather than starting an empty one
+    last = size - 1 if size and buffer[-1:] == b"\n" else size
+    lookaround = any(token in regex.pattern for token in LOOKAROUND)
+    while pos <= last and found < limit:
+        if stop is not None and stop.is_set():
+            return
+        match = regex.search(buffer, pos, last)
+        if match is None:
+            return
+        start = buffer.rfind(b"\n", 0, match.start()) + 1
+        end = buffer.find(b"\n", match.start(), last)
+        if end == -1:
+            end = last
+        if (lookaround or match.end() > end) and regex.search(buffer[start:end]) is None:
+            pos = end + 1
+            continue
+        line_no += buffer[counted_to:start].count(b"\n")
+        counted_to = start
+        found += 1
+        yield line_no, buffer[start:end]
+        pos = end + 1
+
+
+def _collect_matches(buffer, regex, options, limit, stop):
+    matches = []
+    count = 0
+    for line_no, line in scan_buffer(buffer, regex, limit, stop):
+        count += 1
+        if not options.count and not options.files_only:
+            matches.append((line_no, line.decode(errors="replace").rstrip("\r")))
+    return count, matches
+
+
+def scan_file(path, regex, options, limit, stop=None):
+    # Returns (match_count, [(line_number, text)]) for one file
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0, []
+    if options.count:
+        # Counts aren't output lines, so the result cap doesn't apply
+        limit = float("inf")
+    if options.max_count is not None:
+        limit = min(limit, options.max_count)
+    if options.files_only:
+        limit = min(limit, 1)
+    # Scans run on worker threads, so reads are attributed to grep explicitly
+    cached = file_cache.cache.get(path, command="grep")
+    if cached is not None:
+        return _collect_matches(cached.data, regex, options, limit, stop)
+    metrics.add_read(size, "grep")
+    with open(path, "rb") as f:
+        if size >= MMAP_THRESHOLD:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buffer = f.read()
+        try:
+            return _collect_matches(buffer, regex, options, limit, stop)
+        finally:
+            if isinstance(buffer, mmap.mmap):
+                buffer.close()
+
+
+def _inside(path, root):
+    try:
+        return os.path.commonpath([os.path.realpath(path), root]) == root
+    except ValueError:
+        return False
+
+
+def iter_targets(operands, cwd, root, recursive, errors):
+    # Yield (display_name, path) for every file to search, confined to root
+    root = os.path.realpath(root)
+    for operand in operands or ["."]:
+        path = os.path.join(cwd, operand)
+        if not os.path.exists(path) or not _inside(path, root):
+            errors.append(f"grep: {operand}: No such file or directory")
+            continue
+        if os.path.isdir(path):
+            if not recursive:
+                errors.append(f"grep: {operand}: Is a directory")
+                continue
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    full = os.path.join(dirpath, name)
+                    if os.path.isfile(full) and _inside(full, root):
+                        yield os.path.relpath(full, cwd), full
+        else:
+            yield operand, path
+
+
+def grep_lines(lines, regex, options, max_results=MAX_RESULTS):
+    # Filter lines coming from a pipeline; numbered only with -n, like grep.
+    # Returns grep's exit status: 0 if a line matched, 1 if none did
+    # -c counts every match; the cap is only on lines printed
+    limit = float("inf") if options.count else max_results
+    if options.max_count is not None:
+        limit = min(limit, options.max_count)
+    count = 0
+    for line_no, line in enumerate(lines, 1):
+        if count >= limit:
+            break
+        if regex.search(line):
+            count += 1
+            if options.files_only:
+                yield "(standard input)"
+                return 0
+            if not options.count:
+                yield f"{line_no}:{line}" if options.line_numbers else line
+    if options.count:
+        yield str(count)
+    return 0 if count else 1
+
+
+def grep(args, cwd, root, stdin=None, max_results=MAX_RESULTS):
+    # Generator of output lines; returns grep's exit status (0 matched,
+    # 1 nothing matched, 2 an error)
+    try:
+        options, pattern, operands = parse_args(args)
+        regex = compile_pattern(pattern, options, text=stdin is not None and not operands)
+    except (ValueError, re.error) as e:
+        yield Diagnostic(str(e) if isinstance(e, ValueError) else f"grep: invalid pattern: {e}")
+        return 2
+    if not operands and not options.recursive:
+        if stdin is None:
+            yield Diagnostic(USAGE)
+            return 2
+        return (yield from grep_lines(stdin, regex, options, max_results))
+
+    errors = []
+    targets = iter_targets(operands, str(cwd), str(root), options.recursive, errors)
+    show_names = options.recursive or len(operands) > 1
+    stop = threading.Event()
+    executor = _get_executor()
+    pending = deque()
+    emitted = 0
+    matched_any = False
+    truncated = False
+
+    def submit_next():
+        for name, path in targets:
+            pending.append((name, executor.submit(scan_file, path, regex, options, max_results, stop)))
+            return True
+        return False
+
+    try:
+        while len(pending) < GREP_INFLIGHT and submit_next():
+            pass
+        # Futures are consumed in submission order so output is deterministic
+        while pending:
+            name, future = pending.popleft()
+            submit_next()
+            try:
+                count, matches = future.result()
+            except OSError as e:
+                errors.append(f"grep: {name}: {e.strerror or e}")
+                continue
+            if count:
+                matched_any = True
+            if options.files_only:
+                if count:
+                    yield name
+                continue
+            if options.count:
+                yield f"{name}:{count}" if show_names else str(count)
+                continue
+            for line_no, text in matches:
+                if emitted >= max_results:
+                    truncated = True
+                    break
+                emitted += 1
+                yield f"{name}:{line_no}:{text}" if show_names else f"{line_no}:{text}"
+            if truncated:
+                break
+    finally:
+        stop.set()
+        for _, future in pending:
+            future.cancel()
+
+    yield from map(Diagnostic, errors)
+    if truncated:
+        yield Diagnostic(f"grep: output truncated after {max_results} matches")
+    if errors:
+        return 2
+    return 0 if matched_any else 1
@@ -0,0 +1,235 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Command history for every session, appended to one SQLite database outside
+# the terminal root. TERMINAL_HISTORY_DB=":memory:" keeps it in memory only.
+HISTORY_DB = os.environ.get("TERMINAL_HISTORY_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.db"))
+
+# Oldest entries beyond this many are pruned (checked every PRUNE_EVERY appends)
+HISTORY_MAX_ENTRIES = int(os.environ.get("TERMINAL_HISTORY_MAX", "10000000"))
+PRUNE_EVERY = 10000
+
+# Largest page of entries or search results returned at once
+MAX_HISTORY_PAGE = 1000
+
+# Searching every session uses the trigram index for queries this long;
+# shorter ones scan backwards from the newest entry until the page is full
+TRIGRAM_MIN = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    session TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    command TEXT NOT NULL,
+    cwd TEXT,
+    ts REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS history_session_seq ON history (session, seq);
+CREATE TABLE IF NOT EXISTS command_counts (
+    word TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# External-content FTS5 index over history.command, kept in step by triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+    command, content='history', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts (rowid, command) VALUES (new.id, new.command);
+END;
+CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+    INSERT INTO history_fts (history_fts, rowid, command) VALUES ('delete', old.id, old.command);
+END;
+"""
+
+
+def _entry(row):
+    # The session id is the only credential a session has, so it is never returned
+    return {"id": row[0], "number": row[2], "command": row[3], "cwd": row[4], "time": row[5]}
+
+
+class HistoryStore:
+    # Append-only log of entered command lines. Entries are numbered per
+    # session (what `history` prints and `!n` refers to) and carry a global
+    # id, so reverse search can step back through every session at once.
+    # One connection serialised by a lock; WAL keeps each append a single
+    # sequential write with no fsync.
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = self._connect(path)
+        self.fts = self._create_fts()
+        self.appends = 0
+        self.searches = 0
+
+    def _connect(self, path):
+        try:
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.Error as e:
+            print(f"History database {path} unavailable ({e}); keeping history in memory")
+            self.path = ":memory:"
+            conn = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _create_fts(self):
+        # Older SQLite builds lack FTS5 or the trigram tokenizer; search then
+        # falls back to a backwards scan
+        try:
+            self._conn.executescript(FTS_SCHEMA)
+            return True
+        except sqlite3.Error as e:
+            print(f"History search index unavailable ({e}); searches will scan")
+            return False
+
+    def append(self, session, command, cwd=None):
+        # Record one command line; returns its per-session number
+        word = command.strip().split(" ", 1)[0].lower()
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN")
+            try:
+                row = conn.execute("SELECT max(seq) FROM history WHERE session = ?", (session,)).fetchone()
+                seq = (row[0] or 0) + 1
+                conn.execute(
+                    "INSERT INTO history (session, seq, command, cwd, ts) VALUES (?, ?, ?, ?, ?)",
+                    (session, seq, command, cwd, time.time()),
+                )
+                if word:
+                    conn.execute(
+                        "INSERT INTO command_counts (word, count) VALUES (?, 1) "
+                        "ON CONFLICT (word) DO UPDATE SET count = count + 1",
+                        (word,),
+                    )
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            self.appends += 1
+            if self.appends % PRUNE_EVERY == 0:
+                self._prune()
+        return seq
+
+    def _prune(self):
+        self._conn.execute(
+            "DELETE FROM history WHERE id <= (SELECT max(id) FROM history) - ?", (HISTORY_MAX_ENTRIES,)
+        )
+
+    def last(self, session, count):
+        # The session's most recent count entries, oldest first
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, session, seq, command, cwd, ts FROM history WHERE session = ? ORDER BY seq DESC LIMIT ?",
+                (session, max(0, count)),
+            ).fetchall()
+        rows.reverse()
+        return [_entry(row) for row in rows]
+
+    def iter_session(self, session, batch=MAX_HISTORY_PAGE):
+        # Every entry of a session, oldest first, fetched a page at a time so
+        # `history | grep` on a long history streams
+        after = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, session, seq, command, cwd, ts FROM history WHERE session = ? AND seq > ? ORDER BY seq LIMIT ?",
+                    (session, after, batch),
+                ).fetchall()
+            for row in rows:
+                yield _entry(row)
+            if len(rows) < batch:
+                return
+            after = rows[-1][2]
+
+    def event(self, session, ref):
+        # Resolve a history reference for `!` expansion: "!" (last), a number,
+        # a negative offset, or a command prefix. Returns the command or None.
+        with self._lock:
+            conn = self._conn
+            if ref == "!":
+                row = conn.execute(
+                    "SELECT command FROM history WHERE session = ? ORDER BY seq DESC LIMIT 1", (session,)
+                ).fetchone()
+            elif ref.lstrip("-").isdigit():
+                number = int(ref)
+                if number < 0:
+                    row = conn.execute(
+                        "SELECT command FROM history WHERE session = ? ORDER BY seq DESC LIMIT 1 OFFSET ?",
+                        (session, -number - 1),
+                    ).fetchone()
+                else:
+                    row = conn.execute(
+                        "SELECT command FROM history WHERE session = ? AND seq = ?", (session, number)
+                    ).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT command FROM history WHERE session = ? AND substr(command, 1, ?) = ? ORDER BY seq DESC LIMIT 1",
+                    (session, len(ref), ref),
+                ).fetchone()
+        return row[0] if row else None
+
+    def search(self, query, session=None, before=None, limit=20):
+        # Entries containing query, newest first; session=None searches every
+        # session. Pass the last id seen as before to continue (Ctrl-R).
+        limit = max(1, min(limit, MAX_HISTORY_PAGE))
+        if session is not None:
+            # One session's entries come off the (session, seq) index newest
+            # first, so this stops as soon as the page is full
+            sql = "SELECT id, session, seq, command, cwd, ts FROM history WHERE session = ? AND instr(command, ?) > 0"
+            params = [session, query]
+            column, order = "id", "seq"
+        elif self.fts and len(query) >= TRIGRAM_MIN:
+            # Driving the join from the index in descending rowid order lets
+            # a common term stop after limit matches instead of sorting all
+            sql = (
+                "SELECT h.id, h.session, h.seq, h.command, h.cwd, h.ts FROM history_fts f "
+                "JOIN history h ON h.id = f.rowid WHERE history_fts MATCH ?"
+            )
+            # A quoted phrase matches the substring literally
+            params = ['"' + query.replace('"', '""') + '"']
+            column = order = "f.rowid"
+        else:
+            sql = "SELECT id, session, seq, command, cwd, ts FROM history WHERE instr(command, ?) > 0"
+            params = [query]
+            column = order = "id"
+        if before is not None:
+            sql += f" AND {column} < ?"
+            params.append(before)
+        sql += f" ORDER BY {order} DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            self.searches += 1
+        return [_entry(row) for row in rows]
+
+    def clear(self, session):
+        with self._lock:
+            self._conn.execute("DELETE FROM history WHERE session = ?", (session,))
+
+    def frequencies(self):
+        # First-word use counts across all sessions, for autocomplete ranking
+        with self._lock:
+            return dict(self._conn.execute("SELECT word, count FROM command_counts").fetchall())
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT max(id) FROM history").fetchone()[0] or 0
+        return {
+            "path": self.path,
+            "indexed": self.fts,
+            "last_id": entries,
+            "appends": self.appends,
+            "searches": self.searches,
+        }
+
+
+# Shared by every session
+history = HistoryStore()
@@ -1,10 +1,31 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-import psutil
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import asyncio
+import hmac
+import os
+import json
+import sys
+import threading
 import time
-from command_processor import CommandProcessor
-from commands_list import COMMANDS
+from typing import List, Optional
+from command_processor import TERMINAL_ROOT
+from commands_list import COMMAND_NAMES
+from stats_sampler import sampler, parse_window
+from executor import executor, ExecutorBusy, CommandTimeout, CommandCancelled
+from autocomplete import completer, DEFAULT_LIMIT
+from sessions import registry, session_id_from, SESSION_HEADER, SESSION_COOKIE
+from metrics import metrics
+from results import results, StoredResult, OUTPUT_BUDGET, MAX_PAGE_LINES
+from history import history, MAX_HISTORY_PAGE
+from sandbox import sandbox
+from admission import limiter, scheduler, client_ip, Overloaded
+import pipeline
+import dir_index
+import name_index
+import file_cache
 
 # Initialize FastAPI app
 app = FastAPI(title="Terminal API", version="1.0.0")
@@ -16,55 +37,678 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[SESSION_HEADER],
 )
 
-# Global command processor instance
-processor = CommandProcessor()
+print(f"Terminal root: {TERMINAL_ROOT}")
+
+class RouteTimingMiddleware:
+    # Per-route latency for /metrics, timed until the response has been sent.
+    # Routes are labelled by template to keep label cardinality bounded. Plain
+    # ASGI rather than @app.middleware so streaming and disconnects pass through.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            metrics.record_route(scope["method"], path, status, time.perf_counter() - start)
+
+app.add_middleware(RouteTimingMiddleware)
+
+# How often /ws pushes stats changes to connected terminals
+WS_STATS_INTERVAL = 2.0
+
+# Output batches /execute/stream buffers ahead of a slow reader
+STREAM_QUEUE_BATCHES = 4
+
+# Most commands one /execute/batch request may run
+MAX_BATCH_COMMANDS = int(os.environ.get("TERMINAL_BATCH_MAX", "500"))
+
+# Searching every session's history needs this token in X-Admin-Token;
+# unset, only the caller's own session can be searched
+ADMIN_TOKEN = os.environ.get("TERMINAL_ADMIN_TOKEN", "")
 
 class CommandRequest(BaseModel):
     command: str
 
+class BatchRequest(BaseModel):
+    # Either a list of commands run one after another, or a script whose
+    # commands are joined by &&, ||, ; or newlines
+    commands: Optional[List[str]] = None
+    script: Optional[str] = None
+    stop_on_error: bool = False
+
+def attach_session(response: Response, session):
+    # Hand the session id back to the client as both a header and a cookie
+    response.headers[SESSION_HEADER] = session.id
+    response.set_cookie(SESSION_COOKIE, session.id, max_age=int(registry.idle_ttl), httponly=True, samesite="lax")
+
+def bind_session(request: Request, response: Response):
+    # Resolve (or create) the caller's session
+    session = registry.get(session_id_from(request))
+    attach_session(response, session)
+    return session
+
+def record_usage(command: str):
+    # Feed command frequencies into autocomplete ranking
+    word = command.strip().split(" ", 1)[0].lower()
+    if word in COMMAND_NAMES:
+        completer.record(word)
+    elif sandbox.allowed(word):
+        # Sandboxed programs aren't in the command table; one completes for
+        # everyone once it has been run
+        completer.add(word)
+        completer.record(word)
+
+async def admit(session, request, commands, charge=None):
+    # Charge the caller's rate limit with the commands' weight (or with
+    # charge, for a batch that pays step by step), then wait for a
+    # fair-scheduler slot. Returns the ticket to release when they finish.
+    processor = session.processor
+    cost = sum(processor.weight_for(command) for command in commands)
+    heavy = any(processor.classify(command) == "heavy" for command in commands)
+    limiter.check(session.id, client_ip(request), cost if charge is None else charge)
+    return await scheduler.acquire(session.id, cost, "heavy" if heavy else "cheap")
+
+def release_when_stopped(ticket, jobs):
+    # Give the scheduler slot back once every command run under the ticket
+    # has stopped. One that timed out keeps its worker busy until its next
+    # cancellation check, and the slot stays counted until then.
+    running = [job for job in jobs if job is not None and not job.done()]
+    if not running:
+        scheduler.release(ticket)
+        return
+    remaining = len(running)
+
+    def stopped(_):
+        nonlocal remaining
+        remaining -= 1
+        if not remaining:
+            scheduler.release(ticket)
+
+    for job in running:
+        job.add_done_callback(stopped)
+
+def too_many(e):
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def output_fields(output):
+    # Response fields for a command's output. Too big to send inline: the
+    # first page plus a handle for the rest.
+    if isinstance(output, StoredResult):
+        head = output.head()
+        return {
+            "output": "\n".join(head),
+            "result": {
+                "id": output.id,
+                "lines": output.lines,
+                "bytes": output.bytes,
+                "returned_lines": len(head),
+                "truncated": output.truncated,
+            },
+        }
+    return {"output": output}
+
 @app.post("/execute")
-def run_command(req: CommandRequest):
+async def run_command(req: CommandRequest, request: Request, response: Response):
+    session = bind_session(request, response)
     try:
-        output = processor.execute(req.command)
-        return {"output": output}
+        ticket = await admit(session, request, [req.command])
+    except Overloaded as e:
+        raise too_many(e)
+    abandoned = []
+    try:
+        # Heavy commands go to the bounded executor; all commands get a timeout
+        output, _ = await executor.run(session.processor, req.command, request, budget=OUTPUT_BUDGET, owner=session.id)
+        record_usage(req.command)
+        return {**output_fields(output), "session_id": session.id}
+    except ExecutorBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except CommandTimeout as e:
+        abandoned.append(e.job)
+        return {"output": f"Error: {e}", "session_id": session.id}
+    except CommandCancelled as e:
+        # The client disconnected; nobody is left to read the output
+        abandoned.append(e.job)
+        return {"output": "", "session_id": session.id}
+    except asyncio.CancelledError as e:
+        abandoned.append(getattr(e, "job", None))
+        raise
     except Exception as e:
         # Log error for debugging
         print(f"Error executing command '{req.command}': {str(e)}")
-        return {"output": f"Error: {str(e)}"}
+        return {"output": f"Error: {str(e)}", "session_id": session.id}
+    finally:
+        release_when_stopped(ticket, abandoned)
+
+@app.post("/execute/batch")
+async def run_batch(req: BatchRequest, request: Request, response: Response):
+    # Run several commands in order on one session in a single round trip.
+    # Each result has the command, its output, a status ("ok", "error",
+    # "timeout", "skipped" or "limited" when the rate limit ran out part way)
+    # and elapsed_ms. A command after && runs only if
+    # the last one that ran succeeded, after || only if it failed, after ; or
+    # in a commands list always; stop_on_error ends the batch at the first
+    # failure that no || handles.
+    if (req.commands is None) == (req.script is None):
+        raise HTTPException(status_code=400, detail="Send exactly one of commands or script")
+    if req.script is not None:
+        try:
+            steps = pipeline.split_list(req.script)
+        except pipeline.PipelineError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        steps = [(";", command) for command in req.commands if command.strip()]
+    if len(steps) > MAX_BATCH_COMMANDS:
+        raise HTTPException(status_code=400, detail=f"Too many commands in one batch (limit {MAX_BATCH_COMMANDS})")
+
+    session = bind_session(request, response)
+    # The batch is scheduled as one job weighing what its commands weigh. The
+    # rate limit is charged step by step as each command runs, starting with
+    # the first one here.
+    commands = [command for _, command in steps] or [""]
+    try:
+        ticket = await admit(session, request, commands, charge=session.processor.weight_for(commands[0]))
+    except Overloaded as e:
+        raise too_many(e)
+    abandoned = []
+    try:
+        return await run_steps(session, steps, req.stop_on_error, request, abandoned)
+    finally:
+        release_when_stopped(ticket, abandoned)
+
+async def run_steps(session, steps, stop_on_error, request, abandoned):
+    results_out = []
+    failed = stopped = False
+    paid = True  # the first command to run was charged on admission
+    start = time.perf_counter()
+    for i, (connector, command) in enumerate(steps):
+        if stopped or (connector == "&&" and failed) or (connector == "||" and not failed):
+            results_out.append({"command": command, "output": "", "status": "skipped", "elapsed_ms": 0.0})
+            continue
+        if not paid:
+            try:
+                limiter.check(session.id, client_ip(request), session.processor.weight_for(command))
+            except Overloaded as e:
+                # Out of tokens part way through: report it and leave the rest unrun
+                results_out.append({"command": command, "output": f"Error: {e}", "status": "limited", "elapsed_ms": 0.0, "retry_after": e.retry_after})
+                failed = stopped = True
+                continue
+        paid = False
+        began = time.perf_counter()
+        try:
+            output, step_failed = await executor.run(session.processor, command, request, budget=OUTPUT_BUDGET, owner=session.id)
+            record_usage(command)
+            fields = output_fields(output)
+            # The step's own exit status, as the executor saw it end
+            status = "error" if step_failed else "ok"
+        except ExecutorBusy as e:
+            # Nothing else will get a worker either; leave the rest unrun
+            fields, status, stopped = {"output": f"Error: {e}"}, "error", True
+        except CommandTimeout as e:
+            abandoned.append(e.job)
+            fields, status = {"output": f"Error: {e}"}, "timeout"
+        except CommandCancelled as e:
+            # The client disconnected; nobody is left to read the results
+            abandoned.append(e.job)
+            return {"results": results_out, "session_id": session.id}
+        except asyncio.CancelledError as e:
+            abandoned.append(getattr(e, "job", None))
+            raise
+        except Exception as e:
+            print(f"Error executing command '{command}': {str(e)}")
+            fields, status = {"output": f"Error: {str(e)}"}, "error"
+        results_out.append({
+            "command": command,
+            **fields,
+            "status": status,
+            "elapsed_ms": round((time.perf_counter() - began) * 1000, 3),
+        })
+        failed = status != "ok"
+        handled = i + 1 < len(steps) and steps[i + 1][0] == "||"
+        if failed and stop_on_error and not handled:
+            stopped = True
+    return {
+        "results": results_out,
+        "ran": sum(result["status"] not in ("skipped", "limited") for result in results_out),
+        "failed": failed,
+        "stopped": stopped,
+        "cwd": session.processor.cmd_pwd([]),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+        "session_id": session.id,
+    }
+
+@app.post("/execute/stream")
+async def run_command_stream(req: CommandRequest, request: Request):
+    # NDJSON output: {"lines": [...]} records, then a final {"done": true}
+    session = registry.get(session_id_from(request))
+    try:
+        ticket = await admit(session, request, [req.command])
+    except Overloaded as e:
+        raise too_many(e)
+
+    # The command runs on the executor like /execute (bounded pool, timeout)
+    # and hands its batches over a short queue, so a slow reader throttles it
+    loop = asyncio.get_running_loop()
+    batches = asyncio.Queue(maxsize=STREAM_QUEUE_BATCHES)
+    gone = threading.Event()
+    started = False
+
+    def sink(batch):
+        # Called from the worker thread
+        if gone.is_set():
+            raise CommandCancelled()
+        asyncio.run_coroutine_threadsafe(batches.put(batch), loop).result()
+
+    async def run():
+        abandoned = []
+        try:
+            await executor.run(session.processor, req.command, sink=sink)
+            record_usage(req.command)
+        except (ExecutorBusy, CommandTimeout, CommandCancelled) as e:
+            abandoned.append(getattr(e, "job", None))
+            await batches.put([f"Error: {str(e) or 'cancelled'}"])
+        except asyncio.CancelledError as e:
+            # The client left mid-stream: the slot stays charged until the
+            # worker has really stopped
+            abandoned.append(getattr(e, "job", None))
+            raise
+        except Exception as e:
+            print(f"Error streaming command '{req.command}': {str(e)}")
+            await batches.put([f"Error: {str(e)}"])
+        finally:
+            release_when_stopped(ticket, abandoned)
+        await batches.put(None)
+
+    async def ndjson():
+        nonlocal started
+        started = True
+        task = asyncio.ensure_future(run())
+        try:
+            while True:
+                batch = await batches.get()
+                if batch is None:
+                    break
+                yield json.dumps({"lines": batch}) + "\n"
+            yield json.dumps({"done": True, "session_id": session.id}) + "\n"
+        finally:
+            if not task.done():
+                # The client left: stop the worker, and unblock it if it is
+                # waiting for room in the queue
+                gone.set()
+                while not batches.empty():
+                    batches.get_nowait()
+                task.cancel()
+
+    def release_unstarted():
+        # A client that leaves before streaming starts never runs ndjson()
+        if not started:
+            scheduler.release(ticket)
+
+    response = StreamingResponse(ndjson(), media_type="application/x-ndjson", background=BackgroundTask(release_unstarted))
+    attach_session(response, session)
+    return response
+
+@app.get("/result/{result_id}")
+def read_result(result_id: str, request: Request, offset: int = 0, limit: int = MAX_PAGE_LINES, unit: str = "lines"):
+    # Page through an oversized /execute result by line (default) or byte range
+    if unit not in ("lines", "bytes"):
+        raise HTTPException(status_code=400, detail=f"Invalid unit: {unit}")
+    result = results.get(result_id, session_id_from(request))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result expired or not found")
+    try:
+        if unit == "bytes":
+            output = result.read_bytes(offset, limit)
+        else:
+            output = "\n".join(result.read_lines(offset, limit))
+    except (OSError, ValueError):
+        # Evicted while being read
+        raise HTTPException(status_code=404, detail="Result expired or not found")
+    return {"output": output, "offset": offset, "lines": result.lines, "bytes": result.bytes, "truncated": result.truncated}
+
+@app.get("/results")
+def result_stats():
+    results.sweep()
+    return results.stats()
+
+def message_int(value):
+    # A number from a websocket message as an int, or None if it isn't one
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+@app.websocket("/ws")
+async def terminal_socket(websocket: WebSocket):
+    # One persistent connection per terminal. Client messages:
+    #   {"type": "execute", "id": n, "command": "..."}
+    #   {"type": "autocomplete", "id": n, "prefix": "...", "limit": 10}
+    #   {"type": "history_search", "id": n, "query": "...", "before": id}
+    # Server messages: "session", "output" (line batches), "done" (with the
+    # new cwd), "suggestions", "history", "error" and "stats" (changed
+    # fields only).
+    await websocket.accept()
+    session = registry.get(session_id_from(websocket))
+    loop = asyncio.get_running_loop()
+    send_lock = asyncio.Lock()
+    tasks = set()
+    pending_commands = asyncio.Queue()
+
+    async def send(message):
+        async with send_lock:
+            await websocket.send_json(message)
+
+    async def execute(msg_id, command):
+        def sink(batch):
+            # Called from the worker thread; waiting here applies backpressure
+            asyncio.run_coroutine_threadsafe(send({"type": "output", "id": msg_id, "lines": batch}), loop).result()
+
+        try:
+            ticket = await admit(session, websocket, [command])
+        except Overloaded as e:
+            await send({"type": "error", "id": msg_id, "message": str(e), "retry_after": e.retry_after})
+            await send({"type": "done", "id": msg_id, "cwd": session.processor.cmd_pwd([])})
+            return
+        abandoned = []
+        try:
+            await executor.run(session.processor, command, sink=sink)
+            record_usage(command)
+        except ExecutorBusy as e:
+            await send({"type": "error", "id": msg_id, "message": str(e), "retry_after": 1})
+        except (CommandTimeout, CommandCancelled) as e:
+            abandoned.append(e.job)
+            await send({"type": "output", "id": msg_id, "lines": [f"Error: {str(e) or 'cancelled'}"]})
+        except asyncio.CancelledError as e:
+            abandoned.append(getattr(e, "job", None))
+            raise
+        except Exception as e:
+            print(f"Error executing command '{command}': {str(e)}")
+            await send({"type": "output", "id": msg_id, "lines": [f"Error: {str(e)}"]})
+        finally:
+            release_when_stopped(ticket, abandoned)
+        await send({"type": "done", "id": msg_id, "cwd": session.processor.cmd_pwd([])})
+
+    async def run_commands():
+        # One command at a time, in the order sent, so "cd x" has taken
+        # effect before the "ls" typed after it runs
+        while True:
+            msg_id, command = await pending_commands.get()
+            await execute(msg_id, command)
+
+    async def push_stats():
+        previous = {}
+        while True:
+            snapshot = sampler.latest()
+            changed = {key: snapshot[key] for key in ("cpu", "mem", "net_up", "net_down") if previous.get(key) != snapshot[key]}
+            if changed:
+                await send({"type": "stats", **changed})
+                previous.update(changed)
+            await asyncio.sleep(WS_STATS_INTERVAL)
+
+    def spawn(coro):
+        task = asyncio.ensure_future(coro)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    await send({"type": "session", "session_id": session.id, "cwd": session.processor.cmd_pwd([])})
+    spawn(push_stats())
+    spawn(run_commands())
+    try:
+        while True:
+            message = await websocket.receive_json()
+            if not isinstance(message, dict):
+                await send({"type": "error", "id": None, "message": "Messages must be JSON objects"})
+                continue
+            msg_type = message.get("type")
+            msg_id = message.get("id")
+            session.last_seen = time.time()
+            if msg_type == "execute":
+                pending_commands.put_nowait((msg_id, str(message.get("command", ""))))
+            elif msg_type == "history_search":
+                # Ctrl-R: send back the previous "before" id to step further back
+                limit = message_int(message.get("limit", 1))
+                before = message.get("before")
+                if before is not None:
+                    before = message_int(before)
+                if limit is None or (before is None and message.get("before") is not None):
+                    await send({"type": "error", "id": msg_id, "message": "limit and before must be integers"})
+                    continue
+                matches = history.search(str(message.get("query", "")), session.id, before, limit)
+                await send({"type": "history", "id": msg_id, "entries": matches})
+            elif msg_type == "autocomplete":
+                limit = message_int(message.get("limit", DEFAULT_LIMIT))
+                if limit is None:
+                    await send({"type": "error", "id": msg_id, "message": "limit must be an integer"})
+                    continue
+                limit = max(1, min(limit, 100))
+                suggestions = completer.complete(
+                    str(message.get("prefix", "")), session.processor.current_dir, TERMINAL_ROOT, limit,
+                    extra=session.processor.aliases,
+                )
+                await send({"type": "suggestions", "id": msg_id, "suggestions": suggestions})
+            else:
+                await send({"type": "error", "id": msg_id, "message": f"Unknown message type: {msg_type}"})
+    except WebSocketDisconnect:
+        pass
+    except ValueError as e:
+        # Malformed JSON from the client
+        print(f"Closing websocket after bad message: {e}")
+        await websocket.close(code=1003)
+    finally:
+        for task in list(tasks):
+            task.cancel()
+
+@app.get("/history")
+def read_history(request: Request, limit: int = 100):
+    # The caller's most recent commands, oldest first
+    session_id = session_id_from(request)
+    if not session_id:
+        return {"entries": []}
+    return {"entries": history.last(session_id, max(1, min(limit, MAX_HISTORY_PAGE)))}
+
+@app.get("/history/search")
+def search_history(q: str, request: Request, before: Optional[int] = None, limit: int = 20, scope: str = "session"):
+    # Newest-first substring search; pass the last id seen as before to keep
+    # stepping back (limit=1 gives Ctrl-R). scope=all searches every session
+    # and is for operators only: other sessions' commands may hold secrets.
+    if scope not in ("session", "all"):
+        raise HTTPException(status_code=400, detail=f"Invalid scope: {scope}")
+    if scope == "all" and not (ADMIN_TOKEN and hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN)):
+        raise HTTPException(status_code=403, detail="scope=all needs the admin token")
+    if not q:
+        return {"entries": []}
+    session_id = session_id_from(request)
+    if scope == "session" and not session_id:
+        return {"entries": []}
+    return {"entries": history.search(q, session_id if scope == "session" else None, before, limit)}
+
+@app.get("/executor")
+def executor_stats():
+    return executor.stats()
+
+@app.get("/admission")
+def admission_stats():
+    return {"rate_limit": limiter.stats(), "scheduler": scheduler.stats()}
+
+@app.get("/sandbox")
+def sandbox_stats():
+    return sandbox.stats()
+
+@app.get("/find-index")
+def find_index_stats():
+    return name_index.index.stats()
+
+@app.get("/file-cache")
+def file_cache_stats():
+    return file_cache.cache.stats()
+
+@app.get("/sessions")
+def session_stats():
+    return registry.stats()
+
+@app.delete("/sessions/{session_id}")
+def end_session(session_id: str):
+    return {"closed": registry.drop(session_id)}
+
+def compile_cache(module_name, function):
+    # (hits, misses) of an engine's compile cache. The sed/awk engines load
+    # on first use, and reading them here shouldn't load them early.
+    module = sys.modules.get(module_name)
+    if module is None:
+        return 0, 0
+    info = getattr(module, function).cache_info()
+    return info.hits, info.misses
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    # Prometheus text format: per-command counters and latency histograms,
+    # per-route latency, plus gauges from the other shared components
+    sessions = registry.stats()
+    jobs = executor.stats()
+    du = dir_index.index.stats()
+    names = name_index.index.stats()
+    words = completer.stats()
+    stored = results.stats()
+    files = file_cache.cache.stats()
+    recorded = history.stats()
+    processes = sandbox.stats()
+    limits = limiter.stats()
+    queue = scheduler.stats()
+    sed_hits, sed_misses = compile_cache("sed_engine", "compile_script")
+    awk_hits, awk_misses = compile_cache("awk_engine", "compile_program")
+    gauges = [
+        ("terminal_sessions_active", "Live terminal sessions", sessions["active"]),
+        ("terminal_sessions_created", "Sessions created since start", sessions["created"]),
+        ("terminal_executor_queued", "Heavy commands waiting for a worker", jobs["queued"]),
+        ("terminal_executor_running", "Heavy commands running", jobs["running"]),
+        ("terminal_executor_timed_out", "Commands stopped by their timeout", jobs["timed_out"]),
+        ("terminal_executor_rejected", "Heavy commands turned away with 503", jobs["rejected"]),
+        ("terminal_du_index_entries", "Directories with a cached du size", du["entries"]),
+        ("terminal_du_index_hits", "du index hits", du["hits"]),
+        ("terminal_du_index_misses", "du index misses", du["misses"]),
+        ("terminal_find_index_entries", "Names held in the find filename index", names["entries"]),
+        ("terminal_find_index_hits", "find runs answered from the filename index", names["hits"]),
+        ("terminal_find_index_misses", "find runs the filename index could not answer", names["misses"]),
+        ("terminal_find_index_updates", "Filename index updates from mutating commands", names["updates"]),
+        ("terminal_path_cache_hits", "Autocomplete directory listing cache hits", words["path_cache_hits"]),
+        ("terminal_path_cache_misses", "Autocomplete directory listing cache misses", words["path_cache_misses"]),
+        ("terminal_file_cache_files", "Files held in the shared read cache", files["files"]),
+        ("terminal_file_cache_bytes", "Memory used by the shared read cache", files["memory"]),
+        ("terminal_file_cache_hits", "Read cache hits", files["hits"]),
+        ("terminal_file_cache_misses", "Read cache misses", files["misses"]),
+        ("terminal_result_cache_results", "Oversized results held for paging", stored["results"]),
+        ("terminal_result_cache_bytes", "Bytes spooled in the result cache", stored["bytes"]),
+        ("terminal_history_appends", "Command lines recorded in history since start", recorded["appends"]),
+        ("terminal_history_searches", "History searches since start", recorded["searches"]),
+        ("terminal_rate_limited", "Commands refused by the per-session/IP rate limit", limits["limited"]),
+        ("terminal_scheduler_running", "Commands holding an execution slot", queue["running"]),
+        ("terminal_scheduler_queued", "Commands waiting for an execution slot", queue["queued"]),
+        ("terminal_scheduler_rejected", "Commands refused because the queue was full", queue["rejected"]),
+        ("terminal_scheduler_expired", "Commands that gave up waiting for a slot", queue["expired"]),
+        ("terminal_sandbox_running", "Sandboxed processes running", processes["running"]),
+        ("terminal_sandbox_started", "Sandboxed processes started", processes["started"]),
+        ("terminal_sandbox_rejected", "Sandboxed commands turned away with every slot busy", processes["rejected"]),
+        ("terminal_sandbox_timed_out", "Sandboxed processes killed at the wall-clock limit", processes["timed_out"]),
+        ("terminal_sandbox_limited", "Sandboxed processes stopped by a resource limit", processes["limited"]),
+        ("terminal_sed_cache_hits", "sed runs that reused a compiled script", sed_hits),
+        ("terminal_sed_cache_misses", "sed scripts compiled", sed_misses),
+        ("terminal_awk_cache_hits", "awk runs that reused a compiled program", awk_hits),
+        ("terminal_awk_cache_misses", "awk programs compiled", awk_misses),
+    ]
+    return metrics.render_prometheus(gauges)
+
+@app.post("/profile/{command}")
+def enable_profile(command: str, every: int = 1, mode: str = "cprofile"):
+    # Sample one in every N runs of command under cProfile or tracemalloc
+    if command not in COMMAND_NAMES:
+        raise HTTPException(status_code=404, detail=f"Unknown command: {command}")
+    try:
+        metrics.profiler.enable(command, every, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"command": command, "every": max(1, every), "mode": mode}
+
+@app.delete("/profile/{command}")
+def disable_profile(command: str):
+    metrics.profiler.disable(command)
+    return {"command": command, "enabled": False}
+
+@app.get("/profile/{command}")
+def get_profile(command: str):
+    # Most recent sampled profiles for command, newest last
+    return {"command": command, "profiles": metrics.profiler.latest(command)}
 
 @app.get("/autocomplete")
-def autocomplete(prefix: str):
+def autocomplete(prefix: str, request: Request, limit: int = DEFAULT_LIMIT):
     if not prefix:
         return {"suggestions": []}
-    
-    # Simple prefix matching
-    matches = [c for c in COMMANDS if c.startswith(prefix.lower())]
-    return {"suggestions": matches}
+
+    # Commands come from the shared trie plus the session's own aliases;
+    # arguments complete as paths relative to the caller's session (if it
+    # already has one)
+    session = registry.peek(session_id_from(request))
+    cwd = session.processor.current_dir if session else TERMINAL_ROOT
+    aliases = session.processor.aliases if session else ()
+    limit = max(1, min(limit, 100))
+    return {"suggestions": completer.complete(prefix, cwd, TERMINAL_ROOT, limit, extra=aliases)}
+
+@app.on_event("startup")
+def start_background_tasks():
+    sampler.start()
+    if name_index.INDEX_ENABLED:
+        # Built in the background; find walks the tree until it is ready
+        name_index.index.start(TERMINAL_ROOT)
+    # Rank autocomplete by usage recorded in earlier runs too
+    for word, count in history.frequencies().items():
+        if word in COMMAND_NAMES:
+            completer.record(word, count)
+        elif sandbox.allowed(word):
+            completer.add(word)
+            completer.record(word, count)
+
+@app.on_event("shutdown")
+def stop_background_tasks():
+    sampler.stop()
 
 @app.get("/stats")
-def stats():
+def stats(window: Optional[str] = None):
+    # Served from the background sampler's ring buffer - never blocks on psutil
     try:
-        mem = psutil.virtual_memory().percent
-        cpu = psutil.cpu_percent(interval=1)  # Get actual CPU usage
-        net = psutil.net_io_counters()
-        
-        return {
-            "cpu": round(cpu, 1),
-            "mem": round(mem, 1),
-            "net_up": net.bytes_sent,
-            "net_down": net.bytes_recv
-        }
-    except Exception as e:
-        print(f"Error getting stats: {e}")
-        # Return default values if stats fail
-        return {
-            "cpu": 0.0,
-            "mem": 0.0,
-            "net_up": 0,
-            "net_down": 0
-        }
+        seconds = parse_window(window)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid window: {window}")
+
+    snapshot = sampler.latest()
+    result = {
+        "cpu": snapshot["cpu"],
+        "mem": snapshot["mem"],
+        "net_up": snapshot["net_up"],
+        "net_down": snapshot["net_down"]
+    }
+    if seconds is not None:
+        result["window"] = seconds
+        result["history"] = sampler.history(seconds)
+    return result
 
 # Health check endpoint
 @app.get("/health")
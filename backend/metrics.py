@@ -0,0 +1,305 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# Latency histogram bucket bounds in seconds (Prometheus "le" labels)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Profiles kept per command, and how many lines of each are rendered
+PROFILES_KEPT = 5
+PROFILE_TOP = 30
+
+# Sample 1 in N commands with cProfile from startup (0 disables)
+PROFILE_EVERY = int(os.environ.get("TERMINAL_PROFILE_EVERY", "0"))
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.count += 1
+
+
+class CommandStats:
+    __slots__ = ("calls", "errors", "latency", "output_bytes", "read_bytes")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+        self.output_bytes = 0
+        self.read_bytes = 0
+
+
+class Profiler:
+    # Opt-in sampling profiler: every Nth run of an enabled command is run
+    # under cProfile or tracemalloc and the rendered result kept for /profile.
+    # cProfile hooks a single thread, so the executor starts and stops it
+    # around the whole command line on the thread that runs it.
+
+    def __init__(self, every=PROFILE_EVERY):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.default_every = every
+        self.enabled = {}  # command -> (every, mode)
+        self._seen = {}
+        self.profiles = {}  # command -> deque of rendered profiles
+
+    def enable(self, command, every=1, mode="cprofile"):
+        if mode not in ("cprofile", "tracemalloc"):
+            raise ValueError(f"unknown profile mode: {mode}")
+        with self._lock:
+            self.enabled[command] = (max(1, every), mode)
+
+    def disable(self, command):
+        with self._lock:
+            self.enabled.pop(command, None)
+
+    def wanted(self):
+        # Cheap check before working out a line's command names
+        return bool(self.default_every or self.enabled)
+
+    def _should_sample(self, command):
+        with self._lock:
+            every, mode = self.enabled.get(command, (self.default_every, "cprofile"))
+            if not every:
+                return None
+            seen = self._seen.get(command, 0) + 1
+            self._seen[command] = seen
+            return mode if seen % every == 0 else None
+
+    def start(self, commands):
+        # Called with the names in one command line; returns a handle for
+        # stop(), or None if this run isn't sampled. A sampled pipeline is
+        # profiled as a whole and filed under the first command that was due.
+        if getattr(self._local, "active", False):
+            return None  # one profile per thread at a time
+        mode = None
+        for name in commands:
+            due = self._should_sample(name)
+            if due is not None and mode is None:
+                command, mode = name, due
+        if mode is None:
+            return None
+        self._local.active = True
+        if mode == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            return (command, mode, profile, time.time())
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        return (command, mode, (tracemalloc.take_snapshot(), started_tracing), time.time())
+
+    def stop(self, handle):
+        if handle is None:
+            return
+        command, mode, state, started = handle
+        self._local.active = False
+        out = io.StringIO()
+        if mode == "cprofile":
+            state.disable()
+            pstats.Stats(state, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        else:
+            before, started_tracing = state
+            after = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            for stat in after.compare_to(before, "lineno")[:PROFILE_TOP]:
+                out.write(f"{stat}\n")
+        with self._lock:
+            self.profiles.setdefault(command, deque(maxlen=PROFILES_KEPT)).append({
+                "command": command,
+                "mode": mode,
+                "timestamp": started,
+                "duration": time.time() - started,
+                "report": out.getvalue(),
+            })
+
+    def latest(self, command):
+        with self._lock:
+            return list(self.profiles.get(command, ()))
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.commands = {}
+        self.routes = {}  # (method, path, status) -> Histogram
+        self.queue_waits = {}  # command class -> Histogram
+        self.profiler = Profiler()
+
+    # ---------- Command instrumentation ----------
+
+    def current_command(self):
+        return getattr(self._local, "command", None)
+
+    def record(self, command, seconds, output_bytes=0, error=False):
+        with self._lock:
+            stats = self.commands.get(command)
+            if stats is None:
+                stats = self.commands[command] = CommandStats()
+            stats.calls += 1
+            stats.latency.observe(seconds)
+            stats.output_bytes += output_bytes
+            if error:
+                stats.errors += 1
+
+    def add_read(self, nbytes, command=None):
+        # Attribute bytes read from disk to command (default: the running one)
+        command = command or self.current_command()
+        if not command or not nbytes:
+            return
+        with self._lock:
+            stats = self.commands.get(command)
+            if stats is None:
+                stats = self.commands[command] = CommandStats()
+            stats.read_bytes += nbytes
+
+    def call(self, command, handler, *args):
+        # Time a plain cmd_* handler call, handler(*args)
+        previous = self.current_command()
+        self._local.command = command
+        start = time.perf_counter()
+        error = False
+        result = None
+        try:
+            result = handler(*args)
+            return result
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._local.command = previous
+            self.record(command, time.perf_counter() - start, len(result) if isinstance(result, str) else 0, error)
+
+    def measure(self, command, lines):
+        # Wrap a stream_* generator. Time is only counted while the stage
+        # itself runs, and the stage is marked current on each resume so
+        # reads are attributed to the right command inside pipelines.
+        elapsed = 0.0
+        output = 0
+        error = False
+        try:
+            while True:
+                previous = self.current_command()
+                self._local.command = command
+                start = time.perf_counter()
+                try:
+                    line = next(lines)
+                except StopIteration:
+                    break
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    elapsed += time.perf_counter() - start
+                    self._local.command = previous
+                output += len(line) + 1
+                yield line
+        finally:
+            lines.close()
+            self.record(command, elapsed, output, error)
+
+    # ---------- HTTP instrumentation ----------
+
+    def record_route(self, method, path, status, seconds):
+        key = (method, path, status)
+        with self._lock:
+            histogram = self.routes.get(key)
+            if histogram is None:
+                histogram = self.routes[key] = Histogram()
+            histogram.observe(seconds)
+
+    def record_queue_wait(self, kind, seconds):
+        # Time a command spent in the fair scheduler's queue before it ran
+        with self._lock:
+            histogram = self.queue_waits.get(kind)
+            if histogram is None:
+                histogram = self.queue_waits[kind] = Histogram()
+            histogram.observe(seconds)
+
+    # ---------- Exposition ----------
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    "calls": s.calls,
+                    "errors": s.errors,
+                    "latency_sum": s.latency.total,
+                    "output_bytes": s.output_bytes,
+                    "read_bytes": s.read_bytes,
+                }
+                for name, s in self.commands.items()
+            }
+
+    def render_prometheus(self, gauges=()):
+        # Prometheus text exposition format; gauges are extra (name, help, value) rows
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, labels, hist):
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, hist.counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+            lines.append(f"{name}_sum{{{labels}}} {hist.total}")
+            lines.append(f"{name}_count{{{labels}}} {hist.count}")
+
+        with self._lock:
+            commands = sorted(self.commands.items())
+            routes = sorted(self.routes.items())
+            waits = sorted(self.queue_waits.items())
+            header("terminal_command_calls_total", "counter", "Command handler invocations")
+            for name, s in commands:
+                lines.append(f'terminal_command_calls_total{{command="{name}"}} {s.calls}')
+            header("terminal_command_errors_total", "counter", "Command handler invocations that raised")
+            for name, s in commands:
+                lines.append(f'terminal_command_errors_total{{command="{name}"}} {s.errors}')
+            header("terminal_command_output_bytes_total", "counter", "Bytes of output produced per command")
+            for name, s in commands:
+                lines.append(f'terminal_command_output_bytes_total{{command="{name}"}} {s.output_bytes}')
+            header("terminal_command_read_bytes_total", "counter", "Bytes read from files per command")
+            for name, s in commands:
+                lines.append(f'terminal_command_read_bytes_total{{command="{name}"}} {s.read_bytes}')
+            header("terminal_command_duration_seconds", "histogram", "Command handler latency")
+            for name, s in commands:
+                histogram("terminal_command_duration_seconds", f'command="{name}"', s.latency)
+            header("terminal_http_request_duration_seconds", "histogram", "HTTP request latency by route")
+            for (method, path, status), hist in routes:
+                histogram("terminal_http_request_duration_seconds", f'method="{method}",path="{path}",status="{status}"', hist)
+            header("terminal_queue_wait_seconds", "histogram", "Time commands waited for an execution slot")
+            for kind, hist in waits:
+                histogram("terminal_queue_wait_seconds", f'class="{kind}"', hist)
+
+        for name, help_text, value in gauges:
+            header(name, "gauge", help_text)
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide metrics registry
+metrics = Metrics()
@@ -0,0 +1,356 @@
+import os
+import re
+import stat
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import dir_index
+
+# Threads listing directories for find and for index builds; like the other
+# file-op pools this is syscall-bound, so it can exceed the core count
+WALK_WORKERS = int(os.environ.get("TERMINAL_FIND_WORKERS", str(min(16, (os.cpu_count() or 1) * 4))))
+WALK_INFLIGHT = WALK_WORKERS * 4
+
+# Opt-in: TERMINAL_FIND_INDEX=1 keeps every name under terminal_root in
+# memory so find -name answers without walking. Changes made through the
+# terminal are applied as they happen; a full rebuild every INDEX_TTL seconds
+# picks up anything changed behind its back.
+INDEX_ENABLED = os.environ.get("TERMINAL_FIND_INDEX", "0") == "1"
+INDEX_TTL = float(os.environ.get("TERMINAL_FIND_INDEX_TTL", "600"))
+
+# Glob characters; a pattern without them is a plain name lookup
+_MAGIC = re.compile(r"[*?\[]")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WALK_WORKERS, thread_name_prefix="walk")
+        return _executor
+
+
+def mode_kind(mode):
+    # find -type letter for an lstat mode ("o" for fifos, sockets, devices)
+    if stat.S_ISLNK(mode):
+        return "l"
+    if stat.S_ISDIR(mode):
+        return "d"
+    if stat.S_ISREG(mode):
+        return "f"
+    return "o"
+
+
+def _entry_kind(entry):
+    try:
+        if entry.is_symlink():
+            return "l"
+        if entry.is_dir(follow_symlinks=False):
+            return "d"
+        if entry.is_file(follow_symlinks=False):
+            return "f"
+    except OSError:
+        pass
+    return "o"
+
+
+def _suffix(name):
+    # Everything from the last dot, so any name ending in "x.log" is filed under ".log"
+    dot = name.rfind(".")
+    return name[dot:] if dot >= 0 else ""
+
+
+def _scan(path, match, want_stat):
+    # List one directory on a pool thread: (subdirectory names, [(name, kind,
+    # lstat or None)] for entries match(name, kind) accepts), both sorted
+    subdirs = []
+    found = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            kind = _entry_kind(entry)
+            if kind == "d":
+                subdirs.append(entry.name)
+            if match is not None and not match(entry.name, kind):
+                continue
+            st = None
+            if want_stat:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+            found.append((entry.name, kind, st))
+    subdirs.sort()
+    found.sort()
+    return subdirs, found
+
+
+def walk(top, maxdepth=None, match=None, want_stat=False):
+    # Yield (path, name, kind, depth, lstat) for everything below top that
+    # match(name, kind) accepts (everything without one), never following
+    # symlinks. Directories are listed across the walk pool with
+    # WALK_INFLIGHT in flight and the tests run there too; results are
+    # consumed in submission order, so output is breadth-first and sorted
+    # within each directory whatever the thread timing. A directory that
+    # can't be listed yields (path, None, None, depth, error).
+    executor = _get_executor()
+    waiting = deque([(top, 0)])
+    pending = deque()
+    try:
+        while waiting or pending:
+            while waiting and len(pending) < WALK_INFLIGHT:
+                path, depth = waiting.popleft()
+                pending.append((path, depth, executor.submit(_scan, path, match, want_stat)))
+            path, depth, future = pending.popleft()
+            try:
+                subdirs, found = future.result()
+            except OSError as e:
+                yield path, None, None, depth, e
+                continue
+            depth += 1
+            prefix = path + os.sep
+            for name, kind, st in found:
+                yield prefix + name, name, kind, depth, st
+            if maxdepth is None or depth < maxdepth:
+                waiting.extend((prefix + name, depth) for name in subdirs)
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+
+
+class FileNameIndex:
+    # Every name under one root, grouped by directory, by basename, and by
+    # suffix. find -name looks a literal name up directly, a "*.log" style
+    # pattern in the suffix table, and anything else by matching the set of
+    # distinct names, so the cost follows the number of matches rather than
+    # the size of the tree. Mutating commands already report each change to
+    # dir_index; the index watches those reports and re-reads just the
+    # changed paths.
+
+    def __init__(self, ttl=INDEX_TTL):
+        self.ttl = ttl
+        self.root = None
+        self._children = {}  # directory -> {name: kind}
+        self._dirs = {}  # name -> set of directories holding it
+        self._suffixes = {}  # suffix -> set of names
+        self._lock = threading.Lock()
+        self._missed = None  # changes reported while a build runs
+        self._watching = False
+        self.building = False
+        self.built_at = None
+        self.entries = 0
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+
+    # ---------- Building ----------
+
+    def start(self, root):
+        # Build (or rebuild) in the background; queries keep using the
+        # current index meanwhile, or walk until the first build is done
+        root = os.path.realpath(root)
+        with self._lock:
+            if self.building:
+                return
+            if self.root != root:
+                self.root = root
+                self._children, self._dirs, self._suffixes = {}, {}, {}
+                self.entries = 0
+                self.built_at = None
+            self.building = True
+            self._missed = []
+            if not self._watching:
+                self._watching = True
+                dir_index.index.watch(self.touched)
+        threading.Thread(target=self._build, args=(root,), name="name-index", daemon=True).start()
+
+    def _build(self, root):
+        started = time.time()
+        children = {root: {}}
+        try:
+            for path, name, kind, _, _ in walk(root):
+                if name is None:
+                    continue
+                children[os.path.dirname(path)][name] = kind
+                if kind == "d":
+                    children[path] = {}
+        except Exception as e:
+            print(f"Filename index build failed: {e}")
+            with self._lock:
+                self.building = False
+                self._missed = None
+            return
+        dirs, suffixes, entries = {}, {}, 0
+        for directory, names in children.items():
+            entries += len(names)
+            for name in names:
+                holders = dirs.get(name)
+                if holders is None:
+                    holders = dirs[name] = set()
+                    suffixes.setdefault(_suffix(name), set()).add(name)
+                holders.add(directory)
+        with self._lock:
+            missed = self._missed or []
+            self._missed = None
+            self.building = False
+            if self.root != root:
+                return
+            self._children, self._dirs, self._suffixes = children, dirs, suffixes
+            self.entries = entries
+            self.built_at = started
+        # Changes that landed while the walk ran may or may not be in it
+        for path, tree in missed:
+            self.touched(path, tree)
+
+    def ready(self, root):
+        # True if queries under root can be answered now; starts the first
+        # build, and a refresh once the index is older than ttl
+        if not INDEX_ENABLED:
+            return False
+        with self._lock:
+            current = self.root == os.path.realpath(root) and self.built_at is not None
+            stale = not current or time.time() - self.built_at > self.ttl
+        if stale:
+            self.start(root)
+        return current
+
+    # ---------- Incremental updates ----------
+
+    def _kind(self, path):
+        parent, name = os.path.split(path)
+        return self._children.get(parent, {}).get(name)
+
+    def _add(self, parent, name, kind):
+        siblings = self._children.get(parent)
+        if siblings is None:
+            # The parent appeared too (mkdir -p, an extracted archive)
+            grandparent, parent_name = os.path.split(parent)
+            if parent == grandparent or not parent.startswith(self.root + os.sep):
+                return
+            self._add(grandparent, parent_name, "d")
+            siblings = self._children[parent]
+        if name not in siblings:
+            holders = self._dirs.get(name)
+            if holders is None:
+                holders = self._dirs[name] = set()
+                self._suffixes.setdefault(_suffix(name), set()).add(name)
+            holders.add(parent)
+            self.entries += 1
+        siblings[name] = kind
+        if kind == "d":
+            self._children.setdefault(os.path.join(parent, name), {})
+
+    def _unname(self, directory, name):
+        holders = self._dirs.get(name)
+        if holders is None:
+            return
+        holders.discard(directory)
+        self.entries -= 1
+        if not holders:
+            del self._dirs[name]
+            names = self._suffixes.get(_suffix(name))
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._suffixes[_suffix(name)]
+
+    def _remove(self, path):
+        parent, name = os.path.split(path)
+        siblings = self._children.get(parent)
+        if siblings is None or siblings.pop(name, None) is None:
+            return
+        self._unname(parent, name)
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            for child in self._children.pop(directory, {}):
+                self._unname(directory, child)
+                stack.append(os.path.join(directory, child))
+
+    def touched(self, path, tree=False):
+        # dir_index watcher: re-read path (and, for tree changes, everything
+        # below it) and bring the index in line with the disk
+        path = os.path.abspath(path)
+        with self._lock:
+            root = self.root
+            if root is None or not path.startswith(root + os.sep):
+                return
+            if self._missed is not None:
+                self._missed.append((path, tree))
+            if self.built_at is None:
+                return
+            current = self._kind(path)
+        try:
+            kind = mode_kind(os.lstat(path).st_mode)
+        except OSError:
+            kind = None
+        subtree = ()
+        if kind == "d":
+            if current == "d" and not tree:
+                return
+            subtree = [(os.path.dirname(p), name, k) for p, name, k, _, _ in walk(path) if name is not None]
+        with self._lock:
+            if self.root != root or self.built_at is None:
+                return
+            self.updates += 1
+            if self._kind(path) is not None:
+                self._remove(path)
+            if kind is None:
+                return
+            self._add(os.path.dirname(path), os.path.basename(path), kind)
+            for parent, name, child_kind in subtree:
+                self._add(parent, name, child_kind)
+
+    # ---------- Queries ----------
+
+    def _names(self, pattern, regex, ignore_case):
+        # Distinct names that could match pattern, without scanning all of them if possible
+        if not ignore_case and not _MAGIC.search(pattern):
+            return [pattern] if pattern in self._dirs else []
+        tail = pattern[1:]
+        if pattern.startswith("*") and "." in tail and not ignore_case and not _MAGIC.search(tail):
+            return [name for name in self._suffixes.get(_suffix(tail), ()) if name.endswith(tail)]
+        return [name for name in self._dirs if regex.match(name)]
+
+    def search(self, top, pattern, regex, ignore_case=False):
+        # {directory: [(name, kind)]} for indexed entries below top whose name
+        # may match pattern, or None if the index can't answer for top
+        top = os.path.realpath(top)
+        with self._lock:
+            if self.built_at is None or (top != self.root and not top.startswith(self.root + os.sep)):
+                self.misses += 1
+                return None
+            if top != self.root and self._kind(top) != "d":
+                self.misses += 1
+                return None
+            self.hits += 1
+            prefix = top + os.sep
+            found = {}
+            for name in self._names(pattern, regex, ignore_case):
+                for directory in self._dirs[name]:
+                    if directory == top or directory.startswith(prefix):
+                        found.setdefault(directory, []).append((name, self._children[directory][name]))
+        return found
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": INDEX_ENABLED,
+                "root": self.root,
+                "building": self.building,
+                "age": None if self.built_at is None else round(time.time() - self.built_at, 1),
+                "directories": len(self._children),
+                "entries": self.entries,
+                "names": len(self._dirs),
+                "hits": self.hits,
+                "misses": self.misses,
+                "updates": self.updates,
+            }
+
+
+# Shared by every session, since they all work under the same terminal_root
+index = FileNameIndex()
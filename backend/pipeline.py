@@ -0,0 +1,159 @@
+import shlex
+
+# Shell operators understood by the processor, longest first
+OPERATORS = (">>", "|", ">", "<")
+OPERATOR_CHARS = "|<>"
+
+
+class PipelineError(ValueError):
+    pass
+
+
+class Diagnostic(str):
+    # An error or warning line, the processor's stderr: it is shown to the
+    # client but never fed to the next stage or written to a redirect
+    __slots__ = ()
+
+
+class Pipeline:
+    __slots__ = ("stages", "stdin_path", "stdout_path", "append")
+
+    def __init__(self):
+        self.stages = []
+        self.stdin_path = None
+        self.stdout_path = None
+        self.append = False
+
+
+def tokenize(cmd):
+    # Split cmd on unquoted operators, keeping the text between them verbatim
+    # so each piece can still be handed to shlex for word splitting
+    items, current = [], []
+    quote = None
+    i = 0
+    while i < len(cmd):
+        ch = cmd[i]
+        if quote:
+            if ch == "\\" and quote == '"' and i + 1 < len(cmd):
+                current.append(cmd[i:i + 2])
+                i += 2
+                continue
+            if ch == quote:
+                quote = None
+        elif ch == "\\" and i + 1 < len(cmd):
+            current.append(cmd[i:i + 2])
+            i += 2
+            continue
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch in OPERATOR_CHARS:
+            items.append("".join(current))
+            current = []
+            op = ">>" if cmd.startswith(">>", i) else ch
+            items.append(op)
+            i += len(op)
+            continue
+        current.append(ch)
+        i += 1
+    if quote:
+        raise PipelineError("No closing quotation")
+    items.append("".join(current))
+    return items
+
+
+def has_operators(cmd):
+    # Cheap pre-check before tokenizing; quoted operators are ruled out by parse()
+    return any(ch in cmd for ch in OPERATOR_CHARS)
+
+
+def parse(cmd):
+    # Returns a Pipeline, or None when cmd has no unquoted operators
+    if not has_operators(cmd):
+        return None
+    items = tokenize(cmd)
+    if len(items) == 1:
+        return None
+
+    pipeline = Pipeline()
+    argv = shlex.split(items[0])
+    i = 1
+    while i < len(items):
+        op, text = items[i], items[i + 1]
+        words = shlex.split(text)
+        if op == "|":
+            if not argv or not words:
+                raise PipelineError("syntax error near unexpected token `|'")
+            if pipeline.stdout_path is not None:
+                raise PipelineError("output redirection is only allowed on the last command")
+            pipeline.stages.append(argv)
+            argv = words
+        else:
+            if not words:
+                raise PipelineError(f"syntax error near unexpected token `{op}'")
+            target, rest = words[0], words[1:]
+            if op == "<":
+                if pipeline.stages:
+                    raise PipelineError("input redirection is only allowed on the first command")
+                pipeline.stdin_path = target
+            else:
+                pipeline.stdout_path = target
+                pipeline.append = op == ">>"
+            argv = argv + rest
+        i += 2
+    if not argv:
+        raise PipelineError("syntax error: missing command")
+    pipeline.stages.append(argv)
+    return pipeline
+
+
+def split_list(script):
+    # Split a script into its commands on unquoted &&, ||, ; and newlines.
+    # Returns [(connector, command)], where connector is how the command joins
+    # the one before it (None for the first, newlines become ";").
+    commands, current = [], []
+    connector = None
+    quote = None
+    i = 0
+
+    def finish(op):
+        nonlocal connector, current
+        text = "".join(current).strip()
+        if text:
+            commands.append((connector, text))
+        elif op != ";" or connector in ("&&", "||"):
+            # An empty command is only allowed around ; and newlines
+            raise PipelineError(f"syntax error near unexpected token `{op or connector}'")
+        connector, current = op, []
+
+    while i < len(script):
+        ch = script[i]
+        if quote:
+            if ch == "\\" and quote == '"' and i + 1 < len(script):
+                current.append(script[i:i + 2])
+                i += 2
+                continue
+            if ch == quote:
+                quote = None
+        elif ch == "\\" and i + 1 < len(script):
+            current.append(script[i:i + 2])
+            i += 2
+            continue
+        elif ch in ("'", '"'):
+            quote = ch
+        elif script.startswith("&&", i) or script.startswith("||", i):
+            finish(script[i:i + 2])
+            i += 2
+            continue
+        elif ch in ";\n":
+            finish(";")
+            i += 1
+            continue
+        current.append(ch)
+        i += 1
+    if quote:
+        raise PipelineError("No closing quotation")
+    if "".join(current).strip():
+        commands.append((connector, "".join(current).strip()))
+    elif connector in ("&&", "||"):
+        raise PipelineError("syntax error: unexpected end of file")
+    return commands
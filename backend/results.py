@@ -0,0 +1,179 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+
+# Output an /execute response may carry inline; anything larger is spooled to
+# the result cache and the client pages through it with /result/{id}
+OUTPUT_BUDGET = int(os.environ.get("TERMINAL_OUTPUT_BUDGET", str(256 * 1024)))
+
+# Bounds for the result cache: per result, for all results together, and how
+# long an unread result is kept
+RESULT_MAX_BYTES = int(os.environ.get("TERMINAL_RESULT_MAX", str(256 * 1024 * 1024)))
+RESULT_CACHE_BYTES = int(os.environ.get("TERMINAL_RESULT_CACHE", str(1024 * 1024 * 1024)))
+RESULT_CACHE_ENTRIES = 256
+RESULT_TTL = float(os.environ.get("TERMINAL_RESULT_TTL", "300"))
+
+# One line offset is kept per LINE_INDEX_STRIDE lines, so the index for a
+# 100M-line result stays around 12MB
+LINE_INDEX_STRIDE = 64
+
+# Largest page a single /result request returns
+MAX_PAGE_LINES = 10000
+MAX_PAGE_BYTES = 4 * 1024 * 1024
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class StoredResult:
+    # Command output spooled to an unnamed temp file, with a sparse line index
+    # for ranged reads. Reads use os.pread so concurrent pages need no lock.
+
+    def __init__(self, owner=None):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.created = time.time()
+        self.last_read = self.created
+        self.lines = 0
+        self.bytes = 0
+        self.truncated = False
+        self._offsets = array("Q")
+        self._file = tempfile.TemporaryFile()
+
+    def write(self, chunk):
+        # Append one output chunk (which may itself span several lines);
+        # returns False once RESULT_MAX_BYTES is reached
+        for line in chunk.split("\n"):
+            data = line.encode("utf-8", errors="replace") + b"\n"
+            if self.bytes + len(data) > RESULT_MAX_BYTES:
+                self.truncated = True
+                return False
+            if self.lines % LINE_INDEX_STRIDE == 0:
+                self._offsets.append(self.bytes)
+            self._file.write(data)
+            self.bytes += len(data)
+            self.lines += 1
+        return True
+
+    def finish(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def read_lines(self, offset=0, limit=MAX_PAGE_LINES):
+        offset = max(0, offset)
+        limit = max(0, min(limit, MAX_PAGE_LINES))
+        if offset >= self.lines or not limit:
+            return []
+        fd = self._file.fileno()
+        pos = self._offsets[offset // LINE_INDEX_STRIDE]
+        skip = offset % LINE_INDEX_STRIDE
+        lines = []
+        pending = b""
+        read = 0
+        while len(lines) < limit and pos < self.bytes and read < MAX_PAGE_BYTES:
+            block = os.pread(fd, READ_BLOCK_SIZE, pos)
+            if not block:
+                break
+            pos += len(block)
+            parts = (pending + block).split(b"\n")
+            pending = parts.pop()
+            for part in parts:
+                if skip:
+                    skip -= 1
+                    continue
+                lines.append(part.decode("utf-8", errors="replace"))
+                read += len(part) + 1
+                if len(lines) >= limit:
+                    break
+        self.last_read = time.time()
+        return lines
+
+    def read_bytes(self, offset=0, limit=MAX_PAGE_BYTES):
+        offset = max(0, offset)
+        limit = max(0, min(limit, MAX_PAGE_BYTES))
+        self.last_read = time.time()
+        return os.pread(self._file.fileno(), limit, offset).decode("utf-8", errors="replace")
+
+    def head(self, budget=OUTPUT_BUDGET):
+        # The first lines of the output that fit in budget bytes
+        lines = []
+        size = 0
+        for line in self.read_lines(0, MAX_PAGE_LINES):
+            size += len(line) + 1
+            if size > budget and lines:
+                break
+            lines.append(line)
+        return lines
+
+
+class ResultCache:
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES, max_entries=RESULT_CACHE_ENTRIES, ttl=RESULT_TTL):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Ordered least- to most-recently used, so eviction pops from the front
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.stored = 0
+        self.evicted = 0
+
+    def add(self, result):
+        result.finish()
+        evicted = []
+        with self._lock:
+            self._results[result.id] = result
+            self.total_bytes += result.bytes
+            self.stored += 1
+            evicted.extend(self._expire(time.time()))
+            while len(self._results) > 1 and (self.total_bytes > self.max_bytes or len(self._results) > self.max_entries):
+                _, old = self._results.popitem(last=False)
+                self.total_bytes -= old.bytes
+                self.evicted += 1
+                evicted.append(old)
+        for old in evicted:
+            old.close()
+        return result
+
+    def get(self, result_id, owner=None):
+        with self._lock:
+            result = self._results.get(result_id)
+            if result is None or (result.owner is not None and result.owner != owner):
+                return None
+            self._results.move_to_end(result_id)
+            return result
+
+    def _expire(self, now):
+        expired = []
+        cutoff = now - self.ttl
+        for result_id, result in list(self._results.items()):
+            if result.last_read < cutoff:
+                del self._results[result_id]
+                self.total_bytes -= result.bytes
+                self.evicted += 1
+                expired.append(result)
+        return expired
+
+    def sweep(self):
+        with self._lock:
+            expired = self._expire(time.time())
+        for result in expired:
+            result.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "results": len(self._results),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "stored": self.stored,
+                "evicted": self.evicted,
+            }
+
+
+# Shared cache of oversized /execute results
+results = ResultCache()
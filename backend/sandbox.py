@@ -0,0 +1,353 @@
+import os
+import pwd
+import resource
+import selectors
+import shutil
+import signal
+import subprocess
+import threading
+import time
+
+from pipeline import Diagnostic
+
+# Opt-in: TERMINAL_SANDBOX=1 lets allow-listed binaries with no native
+# handler run as real processes. sed, awk and grep are left out: they have
+# native handlers, and the real ones can run commands (system(), sed's e)
+# or write anywhere (w, print >), which no argument check can see.
+SANDBOX_ENABLED = os.environ.get("TERMINAL_SANDBOX", "0") == "1"
+SANDBOX_COMMANDS = frozenset(
+    name.strip()
+    for name in os.environ.get(
+        "TERMINAL_SANDBOX_COMMANDS",
+        "find,xargs,diff,tr,nl,tac,rev,seq,md5sum,sha256sum,base64,comm,paste,fold",
+    ).split(",")
+    if name.strip()
+)
+SANDBOX_PATH = "/usr/bin:/bin"
+
+# When the server runs as root, sandboxed processes run as this user instead
+# (its primary group, no supplementary groups). This is the confinement that
+# matters: the argument checks below only catch obvious paths.
+SANDBOX_USER = os.environ.get("TERMINAL_SANDBOX_USER", "nobody")
+
+# Limits are set by prlimit(1) exec'ing the command, so no Python runs in the
+# child between fork and exec (preexec_fn isn't safe in a threaded server)
+PRLIMIT = shutil.which("prlimit", path="/usr/bin:/bin:/usr/sbin:/sbin")
+
+# Processes running at once across every session; a command waits up to
+# SLOT_WAIT seconds for a free slot before it is turned away
+SANDBOX_SLOTS = int(os.environ.get("TERMINAL_SANDBOX_SLOTS", "4"))
+SLOT_WAIT = float(os.environ.get("TERMINAL_SANDBOX_SLOT_WAIT", "5"))
+
+# Per-process limits: wall clock and CPU seconds, address space and largest
+# file written, in bytes
+WALL_TIMEOUT = float(os.environ.get("TERMINAL_SANDBOX_TIMEOUT", "30"))
+CPU_LIMIT = int(os.environ.get("TERMINAL_SANDBOX_CPU", "10"))
+MEMORY_LIMIT = int(os.environ.get("TERMINAL_SANDBOX_MEMORY", str(512 * 1024 * 1024)))
+FILE_SIZE_LIMIT = int(os.environ.get("TERMINAL_SANDBOX_FILE_SIZE", str(64 * 1024 * 1024)))
+
+# Pipes are read in chunks of this size; a line longer than MAX_LINE_LENGTH
+# is passed on in pieces
+READ_SIZE = 64 * 1024
+MAX_LINE_LENGTH = 1024 * 1024
+POLL_INTERVAL = 0.25
+
+# Exported variables a session may not pass to a real process
+BLOCKED_ENV = frozenset({"PATH", "IFS", "ENV", "BASH_ENV", "SHELLOPTS"})
+
+# Options of xargs that take a separate value, and the find actions that
+# run another program
+XARGS_VALUE_OPTIONS = frozenset({"-a", "-d", "-E", "-I", "-L", "-n", "-P", "-s"})
+FIND_EXEC_ACTIONS = frozenset({"-exec", "-execdir", "-ok", "-okdir"})
+
+# Programs that can start other programs or write files named in their own
+# scripts; never run through xargs or find -exec, even if allow-listed
+RUNNERS = frozenset({
+    "xargs", "find", "sed", "awk", "gawk", "mawk", "sh", "bash", "dash", "env",
+    "nice", "nohup", "timeout", "stdbuf", "setsid", "perl", "python", "python3",
+    "tee", "dd", "vi", "vim", "less", "more", "man", "git", "tar", "zip", "unzip",
+})
+
+# Signals a limit ends a process with, as the message printed for them
+LIMIT_SIGNALS = {
+    signal.SIGXCPU: f"CPU time limit exceeded ({CPU_LIMIT}s)",
+    signal.SIGXFSZ: "file size limit exceeded",
+    signal.SIGKILL: "killed",
+}
+
+
+def allowed(name):
+    return SANDBOX_ENABLED and name in SANDBOX_COMMANDS
+
+
+def _rlimits():
+    # Computed in the parent: the child only makes the setrlimit calls
+    limits = []
+    for kind, value in (
+        (resource.RLIMIT_CPU, CPU_LIMIT),
+        (resource.RLIMIT_AS, MEMORY_LIMIT),
+        (resource.RLIMIT_FSIZE, FILE_SIZE_LIMIT),
+        (resource.RLIMIT_CORE, 0),
+    ):
+        hard = resource.getrlimit(kind)[1]
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        # CPU: SIGXCPU at the soft limit, then SIGKILL a second later
+        ceiling = value + 1 if kind == resource.RLIMIT_CPU else value
+        if hard != resource.RLIM_INFINITY:
+            ceiling = min(ceiling, hard)
+        limits.append((kind, (value, ceiling)))
+    return limits
+
+
+RLIMITS = _rlimits()
+
+
+PRLIMIT_OPTIONS = {
+    resource.RLIMIT_CPU: "--cpu",
+    resource.RLIMIT_AS: "--as",
+    resource.RLIMIT_FSIZE: "--fsize",
+    resource.RLIMIT_CORE: "--core",
+}
+
+
+def _limit_argv():
+    # prlimit arguments for RLIMITS, ending with the "--" before the command
+    argv = [PRLIMIT]
+    for kind, (soft, hard) in RLIMITS:
+        argv.append(f"{PRLIMIT_OPTIONS[kind]}={soft}:{hard}")
+    argv.append("--")
+    return argv
+
+
+LIMIT_ARGV = _limit_argv() if PRLIMIT else None
+
+
+def _identity():
+    # (user, group) to run as, or None when the server isn't root
+    if os.geteuid() != 0 or not SANDBOX_USER:
+        return None
+    try:
+        entry = pwd.getpwnam(SANDBOX_USER)
+    except KeyError:
+        print(f"Sandbox user {SANDBOX_USER!r} does not exist; sandboxed commands are disabled")
+        return False
+    return entry.pw_uid, entry.pw_gid
+
+
+IDENTITY = _identity()
+
+
+def _outside(arg, cwd, root):
+    # True if arg, read as a path from cwd, resolves outside root
+    real = os.path.realpath(os.path.join(cwd, arg))
+    return real != root and not real.startswith(root + os.sep)
+
+
+def _runnable(name):
+    # May xargs or find -exec start name?
+    return allowed(name) and name not in RUNNERS
+
+
+def check_argv(argv, cwd, root):
+    # Error message if argv may not run, else None. Every argument that
+    # could be a path must stay under root, and programs started by xargs
+    # or find -exec must be allow-listed and unable to start or write
+    # anything themselves. This is a guard against mistakes, not a
+    # confinement boundary: a path read from stdin or built by the program
+    # is never seen here. The unprivileged SANDBOX_USER is what confines.
+    root = os.path.realpath(root)
+    for arg in argv[1:]:
+        for candidate in (arg, arg.partition("=")[2]):
+            if ("/" in candidate or candidate == "..") and _outside(candidate, cwd, root):
+                return f"{argv[0]}: {arg}: outside the terminal root"
+    name = argv[0]
+    if name == "xargs":
+        i = 1
+        while i < len(argv) and argv[i].startswith("-"):
+            i += 2 if argv[i] in XARGS_VALUE_OPTIONS else 1
+        if i < len(argv):
+            if not _runnable(argv[i]):
+                return f"xargs: {argv[i]}: not allowed in the sandbox"
+            return check_argv(argv[i:], cwd, root)
+    elif name == "find":
+        for i, arg in enumerate(argv[:-1]):
+            if arg in FIND_EXEC_ACTIONS and not _runnable(argv[i + 1]):
+                return f"find: {argv[i + 1]}: not allowed in the sandbox"
+    return None
+
+
+class Sandbox:
+    # Runs allow-listed binaries as real processes in their own process
+    # group, under CPU, memory and file-size rlimits and a wall-clock
+    # timeout. stdout and stderr are read together through non-blocking
+    # pipes so lines stream out as they are written, and stopping early
+    # (head, a timeout, a disconnect) kills the whole group.
+
+    def __init__(self, slots=SANDBOX_SLOTS):
+        self.slots = slots
+        self._slots = threading.BoundedSemaphore(slots)
+        self._lock = threading.Lock()
+        self._binaries = {}
+        self.running = 0
+        self.started = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.limited = 0
+
+    def allowed(self, name):
+        return allowed(name)
+
+    def _binary(self, name):
+        if name not in self._binaries:
+            self._binaries[name] = shutil.which(name, path=SANDBOX_PATH)
+        return self._binaries[name]
+
+    def run(self, argv, cwd, root, env=None, stdin=None):
+        # Generator of output lines (stdout and stderr in arrival order);
+        # returns the exit status, as a shell would report it
+        name = argv[0]
+        binary = self._binary(name)
+        if binary is None:
+            yield Diagnostic(f"{name}: command not available")
+            return 127
+        if LIMIT_ARGV is None or IDENTITY is False:
+            yield Diagnostic(f"{name}: sandbox unavailable (needs prlimit and TERMINAL_SANDBOX_USER)")
+            return 126
+        error = check_argv(argv, str(cwd), str(root))
+        if error:
+            yield Diagnostic(error)
+            return 1
+        if not self._slots.acquire(timeout=SLOT_WAIT):
+            with self._lock:
+                self.rejected += 1
+            yield Diagnostic(f"{name}: too many sandboxed commands running, try again shortly")
+            return 1
+        process = None
+        try:
+            environment = {"PATH": SANDBOX_PATH, "HOME": str(root), "LANG": "C.UTF-8"}
+            for key, value in (env or {}).items():
+                if key not in BLOCKED_ENV and not key.startswith("LD_"):
+                    environment[key] = value
+            # prlimit sets the limits and execs the name from SANDBOX_PATH,
+            # so argv[0] stays the name and messages read "diff: ..."
+            identity = {} if IDENTITY is None else {"user": IDENTITY[0], "group": IDENTITY[1], "extra_groups": []}
+            process = subprocess.Popen(
+                LIMIT_ARGV + [name] + list(argv[1:]),
+                cwd=str(cwd),
+                env=environment,
+                stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True,
+                **identity,
+            )
+            with self._lock:
+                self.running += 1
+                self.started += 1
+            return (yield from self._pump(name, process, iter(stdin) if stdin is not None else None))
+        finally:
+            if process is not None:
+                self._kill(process)
+                with self._lock:
+                    self.running -= 1
+            self._slots.release()
+
+    def _pump(self, name, process, stdin):
+        deadline = time.monotonic() + WALL_TIMEOUT
+        selector = selectors.DefaultSelector()
+        buffers = {}
+        for pipe in (process.stdout, process.stderr):
+            os.set_blocking(pipe.fileno(), False)
+            selector.register(pipe, selectors.EVENT_READ)
+            buffers[pipe] = b""
+        pending = b""
+        if stdin is not None:
+            os.set_blocking(process.stdin.fileno(), False)
+            selector.register(process.stdin, selectors.EVENT_WRITE)
+        try:
+            while selector.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        self.timed_out += 1
+                    yield Diagnostic(f"{name}: killed after {WALL_TIMEOUT:g}s")
+                    return 124
+                for key, _ in selector.select(min(remaining, POLL_INTERVAL)):
+                    pipe = key.fileobj
+                    if pipe is process.stdin:
+                        # Feed the upstream stage a line at a time as the pipe drains
+                        if not pending:
+                            line = next(stdin, None)
+                            if line is None:
+                                selector.unregister(pipe)
+                                pipe.close()
+                                continue
+                            pending = (line + "\n").encode("utf-8", "surrogateescape")
+                        try:
+                            pending = pending[os.write(pipe.fileno(), pending):]
+                        except BrokenPipeError:
+                            selector.unregister(pipe)
+                            pipe.close()
+                        continue
+                    # stderr stays out of the next stage and any redirect
+                    kind = Diagnostic if pipe is process.stderr else str
+                    chunk = os.read(pipe.fileno(), READ_SIZE)
+                    if not chunk:
+                        selector.unregister(pipe)
+                        if buffers[pipe]:
+                            yield kind(buffers[pipe].decode("utf-8", "replace"))
+                        continue
+                    data = buffers[pipe] + chunk
+                    lines = data.split(b"\n")
+                    data = lines.pop()
+                    for line in lines:
+                        yield kind(line.decode("utf-8", "replace"))
+                    while len(data) > MAX_LINE_LENGTH:
+                        yield kind(data[:MAX_LINE_LENGTH].decode("utf-8", "replace"))
+                        data = data[MAX_LINE_LENGTH:]
+                    buffers[pipe] = data
+        finally:
+            selector.close()
+
+        try:
+            status = process.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            with self._lock:
+                self.timed_out += 1
+            yield Diagnostic(f"{name}: killed after {WALL_TIMEOUT:g}s")
+            return 124
+        if status < 0 and -status in LIMIT_SIGNALS:
+            with self._lock:
+                self.limited += 1
+            yield Diagnostic(f"{name}: {LIMIT_SIGNALS[-status]}")
+        # Killed by a signal reads as 128 + the signal number, as in bash
+        return 128 - status if status < 0 else status
+
+    def _kill(self, process):
+        # The group outlives its leader when the command forked (xargs, find
+        # -exec), so always signal the whole group
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        process.wait()
+        for pipe in (process.stdin, process.stdout, process.stderr):
+            if pipe is not None and not pipe.closed:
+                pipe.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": SANDBOX_ENABLED,
+                "slots": self.slots,
+                "running": self.running,
+                "started": self.started,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "limited": self.limited,
+            }
+
+
+# Shared by every session so the slot cap is global
+sandbox = Sandbox()
@@ -0,0 +1,509 @@
+import re
+from functools import lru_cache
+
+# Compiled scripts kept per (script, -n, -E); a repeated sed skips parsing
+# and code generation entirely
+SCRIPT_CACHE_SIZE = 256
+
+USAGE = "Usage: sed [-n] [-E] [-e script]... [script] [file...]"
+
+# POSIX bracket classes and their Python equivalents
+POSIX_CLASSES = {
+    "alpha": "a-zA-Z", "digit": "0-9", "alnum": "a-zA-Z0-9", "upper": "A-Z",
+    "lower": "a-z", "space": " \\t\\n\\r\\f\\v", "blank": " \\t", "xdigit": "0-9A-Fa-f",
+    "punct": re.escape("!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~"), "word": "\\w",
+}
+
+# Characters special in a BRE only when backslashed, and in an ERE only bare
+BRE_ESCAPED_SPECIALS = "(){}+?|"
+
+# Control-character escapes allowed in s replacement text
+REPLACEMENT_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "a": "\a", "f": "\f", "v": "\v"}
+
+# A translated pattern made only of literal characters, which can use str
+# methods instead of a regex
+LITERAL_PATTERN = re.compile(r"(?:[^\\.^$*+?{}\[\]|()]|\\[^A-Za-z0-9])*")
+
+
+def translate_regex(pattern, extended=False):
+    # POSIX BRE (or ERE) to Python regex syntax
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        ch = pattern[i]
+        if ch == "\\" and i + 1 < n:
+            nxt = pattern[i + 1]
+            i += 2
+            if not extended and nxt in BRE_ESCAPED_SPECIALS:
+                out.append(nxt)
+            elif nxt in "<>":
+                out.append("\\b")
+            elif nxt == "n":
+                out.append("\\n")
+            elif nxt == "t":
+                out.append("\\t")
+            elif nxt.isdigit() or nxt in "wWsSbB":
+                out.append("\\" + nxt)
+            else:
+                out.append(re.escape(nxt))
+            continue
+        if ch == "[":
+            end, bracket = _translate_bracket(pattern, i)
+            out.append(bracket)
+            i = end
+            continue
+        if not extended and ch in BRE_ESCAPED_SPECIALS:
+            out.append("\\" + ch)
+        elif ch == "*" and (not out or out[-1] in ("(", "|", "^")):
+            out.append("\\*")  # a leading * is literal
+        elif not extended and ch == "^" and out and out[-1] not in ("(", "|"):
+            out.append("\\^")  # BRE anchors only at the ends
+        elif not extended and ch == "$" and i + 1 < n and not pattern.startswith("\\)", i + 1):
+            out.append("\\$")
+        else:
+            out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def _translate_bracket(pattern, start):
+    # Copy a bracket expression, turning [:class:] into ranges and escaping
+    # the backslashes POSIX treats as literal; returns (end index, text)
+    i = start + 1
+    out = ["["]
+    if i < len(pattern) and pattern[i] == "^":
+        out.append("^")
+        i += 1
+    if i < len(pattern) and pattern[i] == "]":
+        out.append("\\]")
+        i += 1
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "]":
+            out.append("]")
+            return i + 1, "".join(out)
+        if pattern.startswith("[:", i):
+            close = pattern.find(":]", i + 2)
+            name = pattern[i + 2:close] if close != -1 else None
+            if name not in POSIX_CLASSES:
+                raise ValueError(f"invalid character class: '{pattern[i:close + 2]}'")
+            out.append(POSIX_CLASSES[name])
+            i = close + 2
+            continue
+        out.append("\\\\" if ch == "\\" else "\\[" if ch == "[" else ch)
+        i += 1
+    raise ValueError("unterminated address regex")
+
+
+def literal_text(translated):
+    # The plain string a translated pattern matches, or None if it has any
+    # regex syntax
+    if not LITERAL_PATTERN.fullmatch(translated):
+        return None
+    return re.sub(r"\\(.)", r"\1", translated)
+
+
+def _replacement(text):
+    # sed replacement text to a Python template: & is the match, \1-\9 groups
+    out = []
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if ch == "\\" and i + 1 < len(text):
+            nxt = text[i + 1]
+            if nxt.isdigit():
+                out.append(f"\\g<{nxt}>")
+            elif nxt in REPLACEMENT_ESCAPES:
+                out.append(REPLACEMENT_ESCAPES[nxt])
+            elif nxt in "ULulEcdox":
+                # GNU case conversion and character codes
+                raise ValueError(f"unsupported escape \\{nxt} in the replacement")
+            else:
+                out.append("\\\\" if nxt == "\\" else nxt)
+            i += 2
+            continue
+        out.append("\\g<0>" if ch == "&" else "\\\\" if ch == "\\" else ch)
+        i += 1
+    return "".join(out)
+
+
+def _unescape(text):
+    # y strings: \n is a newline, \\ a backslash, any other \c just c
+    return re.sub(r"\\(.)", lambda m: "\n" if m.group(1) == "n" else m.group(1), text)
+
+
+class _Parser:
+    def __init__(self, script, extended):
+        self.s = script
+        self.i = 0
+        self.extended = extended
+
+    def peek(self):
+        return self.s[self.i] if self.i < len(self.s) else ""
+
+    def skip_space(self, newlines=False):
+        while self.i < len(self.s) and (self.s[self.i] in " \t" or (newlines and self.s[self.i] in "\n;")):
+            self.i += 1
+
+    def delimited(self, delim, command="s"):
+        # Text up to the next unescaped delim; \delim becomes a literal delim
+        out = []
+        while self.i < len(self.s):
+            ch = self.s[self.i]
+            if ch == "\\" and self.i + 1 < len(self.s):
+                nxt = self.s[self.i + 1]
+                if nxt == delim:
+                    special = delim in (BRE_ESCAPED_SPECIALS if self.extended else "") or delim in ".*[]^$"
+                    out.append("\\" + delim if special else delim)
+                else:
+                    out.append(ch + nxt)
+                self.i += 2
+                continue
+            if ch == delim:
+                self.i += 1
+                return "".join(out)
+            if ch == "\n":
+                break
+            out.append(ch)
+            self.i += 1
+        raise ValueError(f"unterminated `{command}' command")
+
+    def address(self):
+        # (kind, value) or None: ("line", n), ("last", None), ("regex", (pattern, flags))
+        ch = self.peek()
+        if ch.isdigit():
+            start = self.i
+            while self.peek().isdigit():
+                self.i += 1
+            return ("line", int(self.s[start:self.i]))
+        if ch == "$":
+            self.i += 1
+            return ("last", None)
+        if ch == "/" or ch == "\\":
+            if ch == "\\":
+                self.i += 1
+                ch = self.peek()
+            self.i += 1
+            source = self.delimited(ch)
+            if not source:
+                raise ValueError("no previous regular expression")
+            flags = 0
+            if self.peek() in ("I",):
+                flags = re.IGNORECASE
+                self.i += 1
+            return ("regex", (translate_regex(source, self.extended), flags))
+        return None
+
+    def commands(self, nested=False):
+        # A {...} group parses its commands recursively up to the closing }
+        parsed = []
+        self.skip_space(newlines=True)
+        while self.i < len(self.s):
+            if self.peek() == "}":
+                self.i += 1
+                if not nested:
+                    raise ValueError("unexpected `}'")
+                return parsed
+            first = self.address()
+            second = None
+            if first is not None and self.peek() == ",":
+                self.i += 1
+                second = self.address()
+                if second is None:
+                    raise ValueError("unexpected `,'")
+            # 0 only starts a 0,/re/ range, which can end on line 1
+            if first == ("line", 0) and (second is None or second[0] != "regex"):
+                raise ValueError("invalid usage of line address 0")
+            self.skip_space()
+            negate = False
+            if self.peek() == "!":
+                negate = True
+                self.i += 1
+                self.skip_space()
+            name = self.peek()
+            self.i += 1
+            if name == "s":
+                delim = self.peek()
+                if not delim or delim in "\\\n":
+                    raise ValueError("unterminated `s' command")
+                self.i += 1
+                pattern = self.delimited(delim)
+                repl = self.delimited(delim)
+                if not pattern:
+                    raise ValueError("no previous regular expression")
+                flags = self.substitute_flags()
+                action = ("s", translate_regex(pattern, self.extended), _replacement(repl), flags)
+            elif name == "y":
+                delim = self.peek()
+                if not delim or delim in "\\\n":
+                    raise ValueError("unterminated `y' command")
+                self.i += 1
+                source = _unescape(self.delimited(delim, "y"))
+                target = _unescape(self.delimited(delim, "y"))
+                if len(source) != len(target):
+                    raise ValueError("strings for `y' command are different lengths")
+                action = ("y", str.maketrans(source, target))
+            elif name == "{":
+                action = ("block", self.commands(nested=True))
+            elif name in ("d", "p", "q", "="):
+                action = (name,)
+            elif not name:
+                raise ValueError("missing command")
+            else:
+                raise ValueError(f"unknown command: `{name}'")
+            parsed.append((first, second, negate, action))
+            self.skip_space()
+            if self.i < len(self.s) and self.peek() not in ";\n}" and name != "{":
+                raise ValueError("extra characters after command")
+            self.skip_space(newlines=True)
+        if nested:
+            raise ValueError("unmatched `{'")
+        return parsed
+
+    def substitute_flags(self):
+        flags = {"global": False, "print": False, "ignore_case": False, "occurrence": 1}
+        while self.i < len(self.s) and self.peek() not in ";\n }":
+            ch = self.peek()
+            if ch == "g":
+                flags["global"] = True
+            elif ch == "p":
+                flags["print"] = True
+            elif ch in "iI":
+                flags["ignore_case"] = True
+            elif ch.isdigit():
+                start = self.i
+                while self.peek().isdigit():
+                    self.i += 1
+                flags["occurrence"] = int(self.s[start:self.i]) or 1
+                continue
+            else:
+                raise ValueError("unknown option to `s'")
+            self.i += 1
+        return flags
+
+
+def global_sub(regex, template, text):
+    # (new text, substitutions made) replacing every match, but skipping an
+    # empty match right where the previous one ended, as sed and awk do;
+    # re.subn takes it, so "aaa" with /a*/ would come out as two matches
+    out = []
+    pos = 0
+    last = -1
+    made = 0
+    for match in regex.finditer(text):
+        start, end = match.span()
+        if start == end == last:
+            continue
+        out.append(text[pos:start])
+        out.append(match.expand(template))
+        pos = last = end
+        made += 1
+    out.append(text[pos:])
+    return "".join(out), made
+
+
+def _nth_sub(regex, template, text, occurrence, every):
+    # s///N and s///Ng: replace the Nth match (and every later one with g)
+    seen = 0
+
+    def replace(match):
+        nonlocal seen
+        seen += 1
+        if seen < occurrence or (seen > occurrence and not every):
+            return match.group(0)
+        return match.expand(template)
+
+    return regex.subn(replace, text)
+
+
+class _CodeGen:
+    # Emits the body of a generator function over the input lines; regexes
+    # and templates go into the function's namespace as constants
+    def __init__(self):
+        self.lines = []
+        self.namespace = {"_nth_sub": _nth_sub, "_global_sub": global_sub}
+        self.uses_last = False
+        self.ranges = 0
+        self.open_ranges = set()  # 0,/re/ ranges, active before line 1
+
+    def constant(self, value):
+        name = f"_k{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def emit(self, depth, line):
+        self.lines.append("    " * depth + line)
+
+    def condition(self, address):
+        kind, value = address
+        if kind == "line":
+            return f"n == {value}"
+        if kind == "last":
+            self.uses_last = True
+            return "last"
+        pattern, flags = value
+        literal = literal_text(pattern)
+        if literal is not None and not flags:
+            return f"{self.constant(literal)} in ps"
+        return f"{self.constant(re.compile(pattern, flags))}.search(ps)"
+
+    def action(self, depth, action, quiet):
+        name = action[0]
+        if name == "d":
+            self.emit(depth, "continue")
+        elif name == "p":
+            self.emit(depth, "yield ps")
+        elif name == "=":
+            self.emit(depth, "yield str(n)")
+        elif name == "q":
+            if not quiet:
+                self.emit(depth, "yield ps")
+            self.emit(depth, "return")
+        elif name == "y":
+            self.emit(depth, f"ps = ps.translate({self.constant(action[1])})")
+        elif name == "block":
+            if not action[1]:
+                self.emit(depth, "pass")
+            for command in action[1]:
+                self.command(depth, *command, quiet)
+        else:
+            self.substitute(depth, *action[1:])
+
+    def substitute(self, depth, pattern, template, flags):
+        literal = literal_text(pattern)
+        plain = "\\" not in template
+        count = 0 if flags["global"] else 1
+        if flags["occurrence"] > 1:
+            regex = re.compile(pattern, re.IGNORECASE if flags["ignore_case"] else 0)
+            self.emit(depth, f"ps, hit = _nth_sub({self.constant(regex)}, {self.constant(template)}, ps, {flags['occurrence']}, {flags['global']})")
+        elif literal is not None and plain and not flags["ignore_case"] and literal:
+            # Fixed text both sides: str.replace is several times faster than re
+            old, new = self.constant(literal), self.constant(template)
+            if flags["print"]:
+                self.emit(depth, f"hit = {old} in ps")
+            self.emit(depth, f"ps = ps.replace({old}, {new}{'' if count == 0 else ', 1'})")
+        else:
+            compiled = re.compile(pattern, re.IGNORECASE if flags["ignore_case"] else 0)
+            regex = self.constant(compiled)
+            if count == 0 and compiled.search("") is not None:
+                self.emit(depth, f"ps, hit = _global_sub({regex}, {self.constant(template)}, ps)")
+            elif flags["print"]:
+                self.emit(depth, f"ps, hit = {regex}.subn({self.constant(template)}, ps, {count})")
+            else:
+                self.emit(depth, f"ps = {regex}.sub({self.constant(template)}, ps, {count})")
+        if flags["print"]:
+            self.emit(depth, "if hit:")
+            self.emit(depth + 1, "yield ps")
+
+    def command(self, depth, first, second, negate, action, quiet):
+        if first is None:
+            self.action(depth, action, quiet)
+            return
+        if second is None:
+            test = self.condition(first)
+            self.emit(depth, f"if {'not ' if negate else ''}{test}:")
+            self.action(depth + 1, action, quiet)
+            return
+        # addr1,addr2: on from a line matching addr1 through the next line
+        # matching addr2 (or just that line if addr2 is a line number <= it)
+        state = f"r{self.ranges}"
+        if first == ("line", 0):
+            self.open_ranges.add(self.ranges)
+        self.ranges += 1
+        start, end = self.condition(first), self.condition(second)
+        self.emit(depth, f"if {state}:")
+        self.emit(depth + 1, "hit = True")
+        if second[0] == "line":
+            self.emit(depth + 1, f"if n >= {second[1]}:")
+        else:
+            self.emit(depth + 1, f"if {end}:")
+        self.emit(depth + 2, f"{state} = False")
+        self.emit(depth, f"elif {start}:")
+        self.emit(depth + 1, "hit = True")
+        if second[0] == "line":
+            self.emit(depth + 1, f"{state} = n < {second[1]}")
+        elif second[0] == "last":
+            self.emit(depth + 1, f"{state} = not last")
+        else:
+            self.emit(depth + 1, f"{state} = True")
+        self.emit(depth, "else:")
+        self.emit(depth + 1, "hit = False")
+        self.emit(depth, f"if {'not ' if negate else ''}hit:")
+        self.action(depth + 1, action, quiet)
+
+
+@lru_cache(maxsize=SCRIPT_CACHE_SIZE)
+def compile_script(script, quiet=False, extended=False):
+    # Parse script and generate one Python generator function for it;
+    # raises ValueError for scripts outside the supported subset
+    parser = _Parser(script, extended)
+    try:
+        commands = parser.commands()
+    except ValueError as e:
+        raise ValueError(f"sed: -e expression #1, char {parser.i}: {e}")
+    gen = _CodeGen()
+    for first, second, negate, action in commands:
+        try:
+            gen.command(2, first, second, negate, action, quiet)
+        except re.error as e:
+            raise ValueError(f"sed: -e expression #1: invalid regular expression: {e}")
+    body = gen.lines
+    if not quiet:
+        body.append("        yield ps")
+    head = ["def program(lines):", "    n = 0"]
+    head.extend(f"    r{i} = {i in gen.open_ranges}" for i in range(gen.ranges))
+    if gen.uses_last:
+        # One line of lookahead so $ knows when it's on the last line
+        head += [
+            "    lines = iter(lines)",
+            "    following = next(lines, _end)",
+            "    while following is not _end:",
+            "        line = following",
+            "        following = next(lines, _end)",
+            "        last = following is _end",
+        ]
+        gen.namespace["_end"] = object()
+    else:
+        head.append("    for line in lines:")
+    head += ["        n += 1", "        ps = line"]
+    source = "\n".join(head + body)
+    exec(compile(source, "<sed>", "exec"), gen.namespace)
+    return gen.namespace["program"]
+
+
+def parse_args(args):
+    # Returns (script, quiet, extended, operands); raises ValueError on bad usage
+    scripts, operands = [], []
+    quiet = extended = False
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "-e" or arg == "--expression":
+            if i + 1 >= len(args):
+                raise ValueError("sed: option requires an argument -- 'e'")
+            scripts.append(args[i + 1])
+            i += 2
+            continue
+        if arg.startswith("-") and len(arg) > 1 and not operands:
+            for flag in arg[1:]:
+                if flag == "n":
+                    quiet = True
+                elif flag in ("E", "r"):
+                    extended = True
+                elif flag == "i":
+                    raise ValueError("sed: in-place editing is not supported; redirect the output instead")
+                else:
+                    raise ValueError(f"sed: invalid option -- '{flag}'")
+        elif not scripts:
+            scripts.append(arg)
+        else:
+            operands.append(arg)
+        i += 1
+    if not scripts:
+        raise ValueError(USAGE)
+    return "\n".join(scripts), quiet, extended, operands
+
+
+def sed(lines, script, quiet=False, extended=False):
+    return compile_script(script, quiet, extended)(lines)
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from command_processor import CommandProcessor
+
+# Limits for live terminal sessions (overridable from the environment)
+MAX_SESSIONS = int(os.environ.get("TERMINAL_MAX_SESSIONS", "5000"))
+IDLE_TTL = float(os.environ.get("TERMINAL_SESSION_TTL", "1800"))
+
+SESSION_HEADER = "X-Session-Id"
+SESSION_COOKIE = "session_id"
+
+
+class Session:
+    __slots__ = ("id", "processor", "created", "last_seen")
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.processor = CommandProcessor(session_id=session_id)
+        self.created = time.time()
+        self.last_seen = self.created
+
+
+class SessionRegistry:
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_ttl=IDLE_TTL):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        # Ordered least- to most-recently used, so eviction pops from the front
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted_lru = 0
+        self.evicted_idle = 0
+
+    def get(self, session_id=None):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                # Unknown or missing ids get a fresh server-generated id
+                session = Session(uuid.uuid4().hex)
+                self._sessions[session.id] = session
+                self.created += 1
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evicted_lru += 1
+            else:
+                self._sessions.move_to_end(session.id)
+            session.last_seen = now
+            return session
+
+    def peek(self, session_id):
+        # Look up an existing session without creating one or touching LRU order
+        if not session_id:
+            return None
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def drop(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _expire(self, now):
+        cutoff = now - self.idle_ttl
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.last_seen >= cutoff:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted_idle += 1
+
+    def sweep(self):
+        with self._lock:
+            self._expire(time.time())
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "idle_ttl": self.idle_ttl,
+                "created": self.created,
+                "evicted_lru": self.evicted_lru,
+                "evicted_idle": self.evicted_idle,
+            }
+
+
+def session_id_from(request):
+    # Header wins over cookie so API clients can pin a session explicitly;
+    # the query parameter is for WebSocket clients, which can't set headers
+    return (
+        request.headers.get(SESSION_HEADER)
+        or request.query_params.get(SESSION_COOKIE)
+        or request.cookies.get(SESSION_COOKIE)
+    )
+
+
+# Shared registry used by the API
+registry = SessionRegistry()
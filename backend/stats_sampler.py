@@ -0,0 +1,102 @@
+import math
+import threading
+import time
+from collections import deque
+
+import psutil
+
+# Sampling cadence and how much history the ring buffer keeps (10 minutes at 1s)
+DEFAULT_INTERVAL = 1.0
+DEFAULT_HISTORY = 600
+
+# Suffixes accepted by parse_window ("60s", "5m", "1h"); bare numbers are seconds
+WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+
+def parse_window(value):
+    if value is None or value == "":
+        return None
+    value = str(value).strip().lower()
+    unit = 1
+    if value and value[-1] in WINDOW_UNITS:
+        unit = WINDOW_UNITS[value[-1]]
+        value = value[:-1]
+    seconds = float(value) * unit
+    # float() also takes "nan", "inf" and overflowing exponents like "1e400"
+    if not math.isfinite(seconds):
+        raise ValueError("window must be a finite number")
+    if seconds <= 0:
+        raise ValueError("window must be positive")
+    return seconds
+
+
+class StatsSampler:
+    def __init__(self, interval=DEFAULT_INTERVAL, history=DEFAULT_HISTORY):
+        self.interval = interval
+        self.samples = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        # Prime cpu_percent so the first non-blocking reading is meaningful
+        psutil.cpu_percent(interval=None)
+        self._thread = threading.Thread(target=self._run, name="stats-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval * 2)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def sample(self):
+        try:
+            net = psutil.net_io_counters()
+            snapshot = {
+                "timestamp": time.time(),
+                "cpu": round(psutil.cpu_percent(interval=None), 1),
+                "mem": round(psutil.virtual_memory().percent, 1),
+                "net_up": net.bytes_sent,
+                "net_down": net.bytes_recv,
+            }
+        except Exception as e:
+            print(f"Error sampling stats: {e}")
+            return None
+        with self._lock:
+            self.samples.append(snapshot)
+        return snapshot
+
+    def latest(self):
+        with self._lock:
+            if self.samples:
+                return dict(self.samples[-1])
+        # Sampler not running yet (or first tick pending): take one inline, non-blocking
+        snapshot = self.sample()
+        if snapshot is None:
+            return {"timestamp": time.time(), "cpu": 0.0, "mem": 0.0, "net_up": 0, "net_down": 0}
+        return dict(snapshot)
+
+    def history(self, seconds):
+        cutoff = time.time() - seconds
+        with self._lock:
+            # Samples are appended in time order, so walk back from the newest
+            result = []
+            for snapshot in reversed(self.samples):
+                if snapshot["timestamp"] < cutoff:
+                    break
+                result.append(dict(snapshot))
+        result.reverse()
+        return result
+
+
+# Shared sampler used by the API
+sampler = StatsSampler()
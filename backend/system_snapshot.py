@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+
+import psutil
+
+# How stale ps/top/free/df/uptime output may be; every caller inside this
+# window shares one /proc scan
+SNAPSHOT_TTL = float(os.environ.get("TERMINAL_PS_REFRESH", "2.0"))
+
+PROCESS_ATTRS = [
+    "pid", "ppid", "name", "cmdline", "username", "status", "nice",
+    "memory_info", "memory_percent", "cpu_percent", "cpu_times",
+    "create_time", "num_threads", "terminal",
+]
+
+
+def _process_row(info):
+    mem = info.get("memory_info")
+    times = info.get("cpu_times")
+    cmdline = info.get("cmdline")
+    return {
+        "pid": info["pid"],
+        "ppid": info.get("ppid") or 0,
+        "name": info.get("name") or "?",
+        "command": " ".join(cmdline).replace("\n", " ") if cmdline else f"[{info.get('name') or '?'}]",
+        "user": info.get("username") or "?",
+        "status": info.get("status") or "?",
+        "nice": info.get("nice") or 0,
+        "vms": mem.vms if mem else 0,
+        "rss": mem.rss if mem else 0,
+        "shared": getattr(mem, "shared", 0) if mem else 0,
+        "mem": info.get("memory_percent") or 0.0,
+        "cpu": info.get("cpu_percent") or 0.0,
+        "time": (times.user + times.system) if times else 0.0,
+        "started": info.get("create_time") or 0.0,
+        "threads": info.get("num_threads") or 0,
+        "tty": info.get("terminal") or "?",
+    }
+
+
+class SystemSnapshot:
+    # Process table, memory, disk and uptime figures taken together and
+    # reused until they're SNAPSHOT_TTL old. Only one thread refreshes at a
+    # time; the others keep serving the previous snapshot meanwhile.
+
+    def __init__(self, ttl=SNAPSHOT_TTL):
+        self.ttl = ttl
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._mounts = {}
+        self.refreshes = 0
+
+    def _mount_for(self, path):
+        # Device and mountpoint holding path (longest matching mountpoint)
+        if path not in self._mounts:
+            best = ("-", "/")
+            for part in psutil.disk_partitions(all=True):
+                mount = part.mountpoint
+                if (path == mount or path.startswith(mount.rstrip("/") + "/")) and len(mount) >= len(best[1]):
+                    best = (part.device, mount)
+            self._mounts[path] = best
+        return self._mounts[path]
+
+    def _take(self, root):
+        processes = []
+        for proc in psutil.process_iter(PROCESS_ATTRS, ad_value=None):
+            processes.append(_process_row(proc.info))
+        try:
+            load = os.getloadavg()
+        except OSError:
+            load = (0.0, 0.0, 0.0)
+        device, mount = self._mount_for(root)
+        return {
+            "taken": time.monotonic(),
+            "timestamp": time.time(),
+            "processes": processes,
+            "memory": psutil.virtual_memory(),
+            "swap": psutil.swap_memory(),
+            "disk": psutil.disk_usage(root),
+            "device": device,
+            "mount": mount,
+            "boot_time": psutil.boot_time(),
+            "load": load,
+            "users": len(psutil.users()),
+            "self_pid": os.getpid(),
+        }
+
+    def get(self, root):
+        # root is the sandbox root whose disk usage df reports
+        root = os.path.realpath(str(root))
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot["root"] == root and time.monotonic() - snapshot["taken"] < self.ttl:
+            return snapshot
+        # Serve the stale copy rather than queueing behind a refresh in progress
+        if not self._refresh_lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot["root"] != root or time.monotonic() - snapshot["taken"] >= self.ttl:
+                snapshot = self._take(root)
+                snapshot["root"] = root
+                self._snapshot = snapshot
+                self.refreshes += 1
+            return snapshot
+        finally:
+            self._refresh_lock.release()
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "ttl": self.ttl,
+            "refreshes": self.refreshes,
+            "processes": len(snapshot["processes"]) if snapshot else 0,
+            "age": round(time.monotonic() - snapshot["taken"], 3) if snapshot else None,
+        }
+
+
+# Shared by every session so concurrent ps/top calls cost one scan per TTL
+system = SystemSnapshot()
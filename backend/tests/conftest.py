@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The backend modules read their settings at import time: keep history in
+# memory and point the default root at a scratch directory before any import
+os.environ.setdefault("TERMINAL_HISTORY_DB", ":memory:")
+os.environ.setdefault("TERMINAL_ROOT", tempfile.mkdtemp(prefix="terminal_root_"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from command_processor import CommandProcessor  # noqa: E402
+
+
+@pytest.fixture
+def root(tmp_path):
+    # The terminal root for one test, with "outside" as a sibling that the
+    # commands must not reach
+    top = tmp_path.resolve()
+    (top / "outside").mkdir()
+    (top / "outside" / "secret.txt").write_text("secret\n")
+    (top / "root").mkdir()
+    return top / "root"
+
+
+@pytest.fixture
+def processor(root):
+    return CommandProcessor(terminal_root=root)
@@ -0,0 +1,85 @@
+import io
+import tarfile
+import zipfile
+
+
+def _add_file(tar, name, data=b"evil\n"):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _add_symlink(tar, name, target):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.SYMTYPE
+    info.linkname = target
+    tar.addfile(info)
+
+
+def test_tar_skips_members_that_escape(root, processor):
+    outside = root.parent / "outside"
+    with tarfile.open(root / "bad.tar", "w") as tar:
+        _add_file(tar, "ok.txt", b"fine\n")
+        _add_file(tar, "../outside/evil.txt")
+        _add_file(tar, str(outside / "absolute.txt"))
+        _add_symlink(tar, "link", "../outside")
+        _add_symlink(tar, "abs_link", str(outside))
+
+    output = processor.execute("tar -xf bad.tar")
+
+    for name in ("../outside/evil.txt", str(outside / "absolute.txt"), "link", "abs_link"):
+        assert f"tar: {name}: path escapes the extraction directory, skipped" in output
+    assert (root / "ok.txt").read_text() == "fine\n"
+    assert sorted(p.name for p in outside.iterdir()) == ["secret.txt"]
+    assert not (root / "link").exists() and not (root / "abs_link").exists()
+
+
+def test_tar_skips_members_written_through_a_symlink(root, processor):
+    outside = root.parent / "outside"
+    (root / "escape").symlink_to(outside)
+    with tarfile.open(root / "bad.tar", "w") as tar:
+        _add_symlink(tar, "dir", "../outside")
+        _add_file(tar, "dir/kept.txt")
+        _add_file(tar, "escape/evil.txt")
+
+    output = processor.execute("tar -xf bad.tar")
+
+    assert "tar: dir: path escapes the extraction directory, skipped" in output
+    assert "tar: escape/evil.txt: path escapes the extraction directory, skipped" in output
+    assert not (root / "dir").is_symlink() and (root / "dir" / "kept.txt").is_file()
+    assert sorted(p.name for p in outside.iterdir()) == ["secret.txt"]
+
+
+def test_tar_into_a_directory_outside_the_root_is_refused(root, processor):
+    with tarfile.open(root / "ok.tar", "w") as tar:
+        _add_file(tar, "ok.txt", b"fine\n")
+
+    processor.execute("tar -xf ok.tar -C ../outside")
+
+    assert processor.failed
+    assert not (root.parent / "outside" / "ok.txt").exists()
+
+
+def test_unzip_skips_members_that_escape(root, processor):
+    outside = root.parent / "outside"
+    with zipfile.ZipFile(root / "bad.zip", "w") as archive:
+        archive.writestr("ok.txt", "fine\n")
+        archive.writestr("../outside/evil.txt", "evil\n")
+        archive.writestr("sub/../../outside/deep.txt", "evil\n")
+
+    output = processor.execute("unzip bad.zip")
+
+    for name in ("../outside/evil.txt", "sub/../../outside/deep.txt"):
+        assert f"  skipping: {name}: path escapes the extraction directory" in output
+    assert (root / "ok.txt").read_text() == "fine\n"
+    assert sorted(p.name for p in outside.iterdir()) == ["secret.txt"]
+
+
+def test_unzip_into_a_directory_outside_the_root_is_refused(root, processor):
+    with zipfile.ZipFile(root / "ok.zip", "w") as archive:
+        archive.writestr("ok.txt", "fine\n")
+
+    processor.execute("unzip ok.zip -d ../outside")
+
+    assert processor.failed
+    assert not (root.parent / "outside" / "ok.txt").exists()
@@ -0,0 +1,50 @@
+import pytest
+
+
+@pytest.fixture
+def escape(root):
+    # A symlink inside the root that leads out of it
+    (root / "escape").symlink_to(root.parent / "outside")
+    (root / "secret.txt").symlink_to(root.parent / "outside" / "secret.txt")
+    return root
+
+
+@pytest.mark.parametrize("operand", ["/etc", "..", "../outside", "escape", "escape/"])
+def test_ls_stays_inside_the_root(escape, processor, operand):
+    output = processor.execute(f"ls {operand}")
+
+    assert output == f"ls: cannot access '{operand}': outside the terminal root"
+    assert processor.failed
+
+
+@pytest.mark.parametrize("command", ["sed -n 1p", "awk 'NR==1'"])
+@pytest.mark.parametrize("operand", ["/etc/passwd", "../outside/secret.txt", "escape/secret.txt", "secret.txt"])
+def test_sed_and_awk_stay_inside_the_root(escape, processor, command, operand):
+    output = processor.execute(f"{command} {operand}")
+
+    name = command.split()[0]
+    assert output == f"{name}: can't read {operand}: outside the terminal root"
+    assert processor.failed
+
+
+def test_sed_in_place_does_not_write_outside_the_root(escape, processor):
+    processor.execute("sed -i s/secret/leaked/ secret.txt")
+
+    assert (escape.parent / "outside" / "secret.txt").read_text() == "secret\n"
+
+
+@pytest.mark.parametrize("command", ["cat", "head", "tail", "wc", "sort"])
+def test_readers_stay_inside_the_root(escape, processor, command):
+    output = processor.execute(f"{command} secret.txt")
+
+    assert "secret" not in output.split("\n")
+    assert processor.failed
+
+
+def test_files_inside_the_root_are_still_read(root, processor):
+    (root / "notes.txt").write_text("first\nsecond\n")
+    (root / "link.txt").symlink_to(root / "notes.txt")
+
+    assert processor.execute("sed -n 2p link.txt") == "second"
+    assert processor.execute("awk 'NR==1' notes.txt") == "first"
+    assert "notes.txt" in processor.execute("ls")
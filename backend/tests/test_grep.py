@@ -0,0 +1,23 @@
+import grep_engine
+
+OVER_CAP = grep_engine.MAX_RESULTS * 2 + 5000
+
+
+def test_count_is_not_capped_by_max_results(root, processor):
+    (root / "big.log").write_text("".join(f"match {i}\n" for i in range(OVER_CAP)))
+
+    assert processor.execute("grep -c match big.log") == str(OVER_CAP)
+    assert not processor.failed
+
+
+def test_count_from_a_pipe_is_not_capped(root, processor):
+    (root / "big.log").write_text("".join(f"match {i}\n" for i in range(OVER_CAP)))
+
+    assert processor.execute("cat big.log | grep -c match") == str(OVER_CAP)
+
+
+def test_listing_is_still_capped(root, processor):
+    (root / "big.log").write_text("".join(f"match {i}\n" for i in range(OVER_CAP)))
+
+    output = processor.execute("grep match big.log").split("\n")
+    assert len([line for line in output if ":match " in line]) == grep_engine.MAX_RESULTS
@@ -0,0 +1,37 @@
+def test_redirect_of_a_missing_file_leaves_the_target_empty(root, processor):
+    output = processor.execute("cat missing.txt > out.txt")
+
+    assert "missing.txt" in output
+    assert processor.failed
+    assert (root / "out.txt").read_text() == ""
+
+
+def test_redirect_of_a_grep_without_matches_is_empty(root, processor):
+    (root / "a.txt").write_text("one\ntwo\n")
+
+    assert processor.execute("grep zzz a.txt > out.txt") == ""
+    assert processor.failed
+    assert (root / "out.txt").read_text() == ""
+
+
+def test_append_of_a_failing_command_keeps_the_target(root, processor):
+    (root / "out.txt").write_text("kept\n")
+
+    processor.execute("cat missing.txt >> out.txt")
+
+    assert (root / "out.txt").read_text() == "kept\n"
+
+
+def test_failing_stage_does_not_feed_the_next(root, processor):
+    (root / "a.txt").write_text("one\ntwo\n")
+
+    assert processor.execute("grep zzz a.txt | wc") == "0 0 0"
+    assert processor.execute("cat missing.txt | wc").split("\n") == ["No such file: missing.txt", "0 0 0"]
+
+
+def test_diagnostics_in_a_redirected_pipeline_reach_the_client(root, processor):
+    output = processor.execute("cat missing.txt | sort > out.txt")
+
+    assert "missing.txt" in output
+    assert (root / "out.txt").read_text() == ""
+
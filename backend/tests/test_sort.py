@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+import external_sort
+
+
+def _lines(count, seed=7):
+    rng = random.Random(seed)
+    pieces = ["alpha", "beta", "\r", "gamma\r", "\rdelta", "a\rb", "10", "9", " 2", ""]
+    return [" ".join(rng.choice(pieces) for _ in range(rng.randint(1, 4))) for _ in range(count)]
+
+
+def _sort(lines, args, spill):
+    options, _ = external_sort.parse_args(args)
+    if spill:
+        options.memory = 1024
+    return list(external_sort.sort_lines(iter(lines), options))
+
+
+@pytest.fixture
+def spills(monkeypatch):
+    # Count the runs written, and merge a few at a time so the merge rounds run
+    written = []
+    write_run = external_sort._write_run
+
+    def counting_write_run(lines):
+        written.append(1)
+        return write_run(lines)
+
+    monkeypatch.setattr(external_sort, "_write_run", counting_write_run)
+    monkeypatch.setattr(external_sort, "SORT_MAX_MERGE", 4)
+    return written
+
+
+@pytest.mark.parametrize("args", [[], ["-r"], ["-n"], ["-k", "2"], ["-u"], ["-n", "-u"], ["-t", "\r", "-k", "2"]])
+def test_spilled_sort_matches_in_memory_with_carriage_returns(spills, args):
+    lines = _lines(3000)
+
+    expected = _sort(lines, args, spill=False)
+    assert not spills
+    result = _sort(lines, args, spill=True)
+
+    assert len(spills) > external_sort.SORT_MAX_MERGE
+    assert result == expected
+
+
+def test_spilled_sort_keeps_every_line(spills):
+    lines = _lines(3000)
+
+    result = _sort(lines, [], spill=True)
+
+    assert result == sorted(lines)
+
+
+def test_sort_command_spills_to_the_same_output(root, processor, spills):
+    (root / "data.txt").write_bytes(("\n".join(_lines(3000)) + "\n").encode())
+
+    in_memory = processor.execute("sort data.txt")
+    assert not spills
+    spilled = processor.execute("sort -S 1K data.txt")
+
+    assert spills
+    assert spilled == in_memory
+    assert len(spilled.split("\n")) == 3000
+
+
+def test_buffer_size_is_clamped_to_the_memory_budget():
+    options, _ = external_sort.parse_args(["-S", "1000G"])
+
+    assert options.memory == external_sort.SORT_MEMORY_BUDGET
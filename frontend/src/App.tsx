@@ -15,6 +15,7 @@ interface SystemStats {
 }
 
 const API_BASE = import.meta.env.VITE_API_URL || 'https://codemateai-hackathon-production.up.railway.app';
+const WS_URL = `${API_BASE.replace(/^http/, 'ws')}/ws`;
 
 const App: React.FC = () => {
   const [lines, setLines] = useState<TerminalLine[]>([
@@ -50,6 +51,28 @@ const App: React.FC = () => {
   const inputRef = useRef<HTMLInputElement>(null);
   const contentRef = useRef<HTMLDivElement>(null);
   const lineIdCounter = useRef(4);
+  // Server-issued session id so cwd and other state persist between commands
+  const sessionIdRef = useRef<string | null>(null);
+  // Persistent terminal channel; HTTP is only used while it is down
+  const wsRef = useRef<WebSocket | null>(null);
+  const wsMessageId = useRef(1);
+  const cdCommandIds = useRef(new Set<number>());
+  // Commands typed while another is still running; each is sent once the
+  // previous one reports done, so they run in the order typed
+  const queuedCommands = useRef<string[]>([]);
+  const runningCommandId = useRef<number | null>(null);
+  const latestSuggestionId = useRef(0);
+  const latestPrefix = useRef('');
+
+  const socketOpen = () => wsRef.current !== null && wsRef.current.readyState === WebSocket.OPEN;
+
+  const sessionHeaders = (json: boolean = true): Record<string, string> => {
+    const headers: Record<string, string> = json ? { 'Content-Type': 'application/json' } : {};
+    if (sessionIdRef.current) {
+      headers['X-Session-Id'] = sessionIdRef.current;
+    }
+    return headers;
+  };
 
   // Helper function to measure text width
   const getTextWidth = (text: string, font: string) => {
@@ -71,33 +94,64 @@ const App: React.FC = () => {
     setLines(prev => [...prev, newLine]);
   };
 
+  const applySuggestions = (prefix: string, suggestions: string[] | undefined) => {
+    const first: string | undefined = suggestions && suggestions[0];
+    if (first && first.toLowerCase().startsWith(prefix.toLowerCase()) && first.length > prefix.length) {
+      setHint(first);
+      setIsAutocompleting(true);
+    } else {
+      setHint(null);
+    }
+  };
+
+  const sendNextCommand = () => {
+    if (runningCommandId.current !== null || !socketOpen()) return;
+    const command = queuedCommands.current.shift();
+    if (command === undefined) return;
+    const id = wsMessageId.current++;
+    if (command.startsWith('cd')) {
+      cdCommandIds.current.add(id);
+    }
+    runningCommandId.current = id;
+    wsRef.current!.send(JSON.stringify({ type: 'execute', id, command }));
+  };
+
   const executeCommand = async (input: string) => {
     if (!input.trim()) return;
 
     addLine(`${currentDirectory} > ${input}`, 'command');
 
+    if (socketOpen()) {
+      queuedCommands.current.push(input.trim());
+      sendNextCommand();
+      return;
+    }
+
     try {
       console.log('Attempting to connect to:', `${API_BASE}/execute`);
       const response = await fetch(`${API_BASE}/execute`, {
         method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
+        headers: sessionHeaders(),
         body: JSON.stringify({ command: input.trim() }),
       });
 
       if (response.ok) {
         const data = await response.json();
+        if (data.session_id) {
+          sessionIdRef.current = data.session_id;
+        }
         if (data.output === '<CLEAR_SCREEN>') {
           setLines([]);
         } else {
           addLine(data.output);
+          if (data.result) {
+            // Oversized output: the rest stays on the server at /result/{id}
+            addLine(`[showing first ${data.result.returned_lines} of ${data.result.lines} lines; fetch the rest from /result/${data.result.id}?offset=${data.result.returned_lines}]`, 'error');
+          }
           if (input.trim().startsWith('cd')) {
             const pwdResponse = await fetch(`${API_BASE}/execute`, {
               method: 'POST',
-              headers: {
-                'Content-Type': 'application/json',
-              },
+              headers: sessionHeaders(),
               body: JSON.stringify({ command: 'pwd' }),
             });
             if (pwdResponse.ok) {
@@ -141,30 +195,108 @@ const App: React.FC = () => {
     setIsAutocompleting(false);
     setCurrentInput(value);
 
-    const hasSpace = value.includes(' ');
-    if (!value || hasSpace) {
+    if (!value || value.endsWith(' ')) {
       setHint(null);
       return;
     }
 
+    // The backend completes command names and, after a space, file paths
     const prefix = value;
     setTypedLength(prefix.length);
+    if (socketOpen()) {
+      const id = wsMessageId.current++;
+      latestSuggestionId.current = id;
+      latestPrefix.current = prefix;
+      wsRef.current!.send(JSON.stringify({ type: 'autocomplete', id, prefix, limit: 1 }));
+      return;
+    }
     try {
-      const res = await fetch(`${API_BASE}/autocomplete?prefix=${encodeURIComponent(prefix)}`);
+      const res = await fetch(`${API_BASE}/autocomplete?prefix=${encodeURIComponent(prefix)}&limit=1`, {
+        headers: sessionHeaders(false),
+      });
       if (!res.ok) return;
       const data = await res.json();
-      const first: string | undefined = data.suggestions && data.suggestions[0];
-      if (first && first.toLowerCase().startsWith(prefix.toLowerCase()) && first.length > prefix.length) {
-        setHint(first);
-        setIsAutocompleting(true);
-      } else {
-        setHint(null);
-      }
+      applySuggestions(prefix, data.suggestions);
     } catch (_e) { }
   };
 
+  useEffect(() => {
+    let closed = false;
+    let retry: ReturnType<typeof setTimeout> | undefined;
+
+    const connect = () => {
+      const query = sessionIdRef.current ? `?session_id=${encodeURIComponent(sessionIdRef.current)}` : '';
+      const ws = new WebSocket(`${WS_URL}${query}`);
+      wsRef.current = ws;
+
+      ws.onmessage = (event) => {
+        const msg = JSON.parse(event.data);
+        switch (msg.type) {
+          case 'session':
+            sessionIdRef.current = msg.session_id;
+            break;
+          case 'output':
+            if (msg.lines.includes('<CLEAR_SCREEN>')) {
+              setLines([]);
+            } else {
+              addLine(msg.lines.join('\n'));
+            }
+            break;
+          case 'done':
+            if (cdCommandIds.current.delete(msg.id)) {
+              setCurrentDirectory(msg.cwd);
+            }
+            if (msg.id === runningCommandId.current) {
+              runningCommandId.current = null;
+              sendNextCommand();
+            }
+            break;
+          case 'suggestions':
+            if (msg.id === latestSuggestionId.current) {
+              applySuggestions(latestPrefix.current, msg.suggestions);
+            }
+            break;
+          case 'stats':
+            // Only changed fields are pushed
+            setStats(prev => ({
+              cpu: msg.cpu ?? prev.cpu,
+              memory: msg.mem ?? prev.memory,
+              networkUp: msg.net_up !== undefined ? msg.net_up / (1024 * 1024) : prev.networkUp,
+              networkDown: msg.net_down !== undefined ? msg.net_down / (1024 * 1024) : prev.networkDown
+            }));
+            break;
+          case 'error':
+            addLine(`Error: ${msg.message}`, 'error');
+            break;
+        }
+      };
+
+      ws.onopen = () => {
+        // Commands still queued from before a reconnect
+        sendNextCommand();
+      };
+
+      ws.onclose = () => {
+        wsRef.current = null;
+        runningCommandId.current = null;
+        if (!closed) {
+          retry = setTimeout(connect, 2000);
+        }
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      if (retry) clearTimeout(retry);
+      wsRef.current?.close();
+    };
+  }, []);
+
   useEffect(() => {
     const fetchStats = async () => {
+      // Stats are pushed over the socket while it is connected
+      if (socketOpen()) return;
       try {
         const response = await fetch(`${API_BASE}/stats`);
         if (response.ok) {